@@ -36,18 +36,57 @@ export default function ChatPage() {
     setConversationHistory((prev) => [...prev, message]);
   };
 
+  // Append streamed content to the assistant message currently being generated
+  const appendToLastMessage = (content: string) => {
+    setConversationHistory((prev) => {
+      const last = prev[prev.length - 1];
+      return [...prev.slice(0, -1), { ...last, content: last.content + content }];
+    });
+  };
+
   const fetchResponse = async (message: string) => {
     if (!sessionId) return;
 
     setIsTyping(true);
     try {
-      const res = await fetch(`${process.env.NEXT_PUBLIC_API_BASE_URL}/ask/`, {
+      const res = await fetch(`${process.env.NEXT_PUBLIC_API_BASE_URL}/ask/stream/`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ query: message, session_id: sessionId }),
       });
-      const data = await res.json();
-      addMessage({ role: "assistant", content: data.message || "No response." });
+      if (!res.ok || !res.body) {
+        const data = await res.json();
+        addMessage({ role: "assistant", content: data.error || "No response." });
+        return;
+      }
+
+      // Parse the Server-Sent Events stream: events are separated by a blank line
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let started = false;
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}");
+          if (event === "token") {
+            if (!started) {
+              started = true;
+              setIsTyping(false);
+              addMessage({ role: "assistant", content: "" });
+            }
+            appendToLastMessage(data.content);
+          } else if (event === "error") {
+            addMessage({ role: "assistant", content: data.error || "No response." });
+          }
+        }
+      }
     } catch (error) {
       addMessage({ role: "assistant", content: "Error connecting to the server." });
     } finally {
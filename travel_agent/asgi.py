@@ -0,0 +1,39 @@
+"""
+ASGI config for travel_agent project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server to use the async agent views, e.g.:
+
+    uvicorn travel_agent.asgi:application
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_agent.settings')
+
+django_application = get_asgi_application()
+
+from utils.clients import aclose_clients  # noqa: E402 (requires configured settings)
+
+
+async def application(scope, receive, send):
+    """
+    Serve HTTP through Django and handle the ASGI lifespan protocol, which Django does not,
+    so the shared HTTP clients are closed cleanly when the server shuts down.
+    """
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aclose_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
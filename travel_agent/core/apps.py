@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'travel_agent.core'
+
+    def ready(self):
+        # Register signal handlers
+        from travel_agent.core import signals  # noqa: F401
@@ -0,0 +1,116 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_agent.core.models import Conversation
+from utils.benchmark import AgentBenchmark
+from utils.stores import CONVERSATION_STORE_BACKENDS, create_conversation_store, get_conversation_store
+
+
+def _parse_latency(value):
+    """
+    Parse "mean" or "mean,stdev" (milliseconds) into a tuple.
+    """
+    try:
+        parts = [float(part) for part in value.split(",")]
+    except ValueError:
+        raise CommandError(f"Invalid latency '{value}'; expected 'mean' or 'mean,stdev' in milliseconds.")
+    if len(parts) not in (1, 2) or min(parts) < 0:
+        raise CommandError(f"Invalid latency '{value}'; expected 'mean' or 'mean,stdev' in milliseconds.")
+    return parts[0], parts[1] if len(parts) == 2 else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark TravelAgent.process_user_input over scripted conversations with fake LLM and Places "
+        "backends: per-stage timings, DB queries, prompt sizes and peak memory, as JSON for comparing runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--turns", default="1,10,100,500",
+            help="Comma-separated conversation lengths to run (default: 1,10,100,500).",
+        )
+        parser.add_argument(
+            "--llm-latency", default="0",
+            help="Simulated LLM call latency in ms, as 'mean' or 'mean,stdev' (log-normal; default: 0).",
+        )
+        parser.add_argument(
+            "--tool-latency", default="0",
+            help="Simulated Places API latency in ms, as 'mean' or 'mean,stdev' (log-normal; default: 0).",
+        )
+        parser.add_argument("--reply-words", type=int, default=None, help="Words per fake LLM reply (default: 60).")
+        parser.add_argument(
+            "--places-results", type=int, default=None, help="Places per fake Places API response (default: 20).",
+        )
+        parser.add_argument(
+            "--routing-mode", choices=["classic", "function_calling"], default=None,
+            help="Routing mode of the agent (default: settings.AGENT_ROUTING_MODE).",
+        )
+        parser.add_argument(
+            "--store", default=None,
+            help=f"Conversation store backend, one of {', '.join(CONVERSATION_STORE_BACKENDS)} (default: configured).",
+        )
+        parser.add_argument(
+            "--local-router", action="store_true", help="Let the local tool router skip LLM routing calls.",
+        )
+        parser.add_argument(
+            "--speculate", action="store_true", help="Run the Places tool speculatively during classic routing calls.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the scripts and fake backends (default: 0).")
+        parser.add_argument("--per-turn", action="store_true", help="Include the measurements of every turn.")
+        parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass.")
+        parser.add_argument("--output", help="Write the JSON report to this file and print a summary instead.")
+
+    def handle(self, *args, **options):
+        try:
+            lengths = [int(turns) for turns in options["turns"].split(",") if turns.strip()]
+        except ValueError:
+            raise CommandError("--turns must be a comma-separated list of integers.")
+        if not lengths or min(lengths) < 1:
+            raise CommandError("--turns must list conversation lengths of at least 1.")
+        if options["store"] and options["store"] not in CONVERSATION_STORE_BACKENDS:
+            raise CommandError(
+                f"Unknown store '{options['store']}'; choose from {', '.join(CONVERSATION_STORE_BACKENDS)}."
+            )
+
+        store = create_conversation_store(options["store"]) if options["store"] else get_conversation_store()
+        benchmark = AgentBenchmark(
+            store,
+            llm_latency=_parse_latency(options["llm_latency"]),
+            tool_latency=_parse_latency(options["tool_latency"]),
+            reply_words=options["reply_words"],
+            places_results=options["places_results"],
+            routing_mode=options["routing_mode"],
+            local_router=options["local_router"],
+            speculate=options["speculate"],
+            seed=options["seed"],
+        )
+        try:
+            report = benchmark.run(lengths, per_turn=options["per_turn"], memory=not options["no_memory"])
+        finally:
+            benchmark.speculator.shutdown()
+            # Benchmark conversations share the real tables; remove them
+            if options["store"] != "memory":
+                Conversation.objects.filter(session_id__in=benchmark.session_ids).delete()
+            if options["store"]:
+                store.close()
+
+        if not options["output"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(
+            f"{'turns':>6} {'turn p50 ms':>12} {'turn p95 ms':>12} {'other p50 ms':>13} {'queries/turn':>13} "
+            f"{'last prompt tok':>16} {'peak KB':>9}"
+        )
+        for run in report["runs"]:
+            peak = run.get("memory_kb", {}).get("peak", "-")
+            self.stdout.write(
+                f"{run['turns']:>6} {run['turn_ms']['p50']:>12.3f} {run['turn_ms']['p95']:>12.3f} "
+                f"{run['stages_ms']['other']['p50']:>13.3f} {run['db_queries']['mean']:>13.1f} "
+                f"{run['prompt_tokens']['last']:>16} {peak:>9}"
+            )
+        self.stdout.write(f"Report written to {options['output']}")
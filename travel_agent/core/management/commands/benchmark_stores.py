@@ -0,0 +1,119 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from travel_agent.core.models import Conversation
+from utils.stores import CONVERSATION_STORE_BACKENDS, Message, create_conversation_store
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the conversation store backends: latency of a turn's persistence work "
+        "(freshness check, history load, batched write) and write throughput under concurrent writers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backends", default="memory,orm,sqlite",
+            help="Comma-separated backends to compare (default: memory,orm,sqlite).",
+        )
+        parser.add_argument("--turns", type=int, default=200, help="Turns timed per backend (default: 200).")
+        parser.add_argument("--threads", type=int, default=8, help="Concurrent writers (default: 8).")
+        parser.add_argument("--batches", type=int, default=50, help="Batches written per writer (default: 50).")
+
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options["backends"].split(",") if name.strip()]
+        for name in backends:
+            if name not in CONVERSATION_STORE_BACKENDS:
+                raise CommandError(f"Unknown backend '{name}'; choose from {', '.join(CONVERSATION_STORE_BACKENDS)}.")
+
+        history_limit = getattr(settings, "AGENT_HISTORY_LIMIT", None)
+        self.stdout.write(
+            f"{'backend':<8} {'turn p50 ms':>12} {'turn p95 ms':>12} {'turn mean ms':>13} {'writes msg/s':>13} {'errors':>7}"
+        )
+        for name in backends:
+            store = create_conversation_store(name)
+            session_ids = []
+            try:
+                latencies = self._time_turns(store, options["turns"], history_limit, session_ids)
+                throughput, errors = self._time_writes(store, options["threads"], options["batches"], session_ids)
+            finally:
+                store.close()
+                # The ORM and SQLite backends share the real tables; remove the benchmark's conversations
+                if name != "memory":
+                    Conversation.objects.filter(session_id__in=session_ids).delete()
+
+            latencies.sort()
+            p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            self.stdout.write(
+                f"{name:<8} {statistics.median(latencies):>12.3f} {p95:>12.3f} {statistics.fmean(latencies):>13.3f} "
+                f"{throughput:>13.0f} {errors:>7}"
+            )
+
+    def _time_turns(self, store, turns, history_limit, session_ids):
+        """
+        Time the store work of `turns` consecutive turns of one conversation, in milliseconds each.
+        """
+        session_id = uuid.uuid4()
+        session_ids.append(session_id)
+        conversation_id = store.get_or_create_conversation(session_id)
+        latencies = []
+        for turn in range(turns):
+            started = time.perf_counter()
+            store.latest_message_id(conversation_id)
+            store.history(conversation_id, limit=history_limit)
+            store.append_messages(self._turn_messages(conversation_id, turn))
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    def _time_writes(self, store, threads, batches, session_ids):
+        """
+        Write `batches` turns from each of `threads` concurrent writers; return (messages/s, failed batches).
+        """
+        conversations = []
+        for _ in range(threads):
+            session_id = uuid.uuid4()
+            session_ids.append(session_id)
+            conversations.append(store.get_or_create_conversation(session_id))
+
+        errors = []
+        start = threading.Barrier(threads + 1)
+
+        def writer(conversation_id):
+            start.wait()
+            try:
+                for turn in range(batches):
+                    try:
+                        store.append_messages(self._turn_messages(conversation_id, turn))
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=writer, args=(conversation_id,)) for conversation_id in conversations]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        written = (threads * batches - len(errors)) * 3
+        return written / elapsed, len(errors)
+
+    @staticmethod
+    def _turn_messages(conversation_id, turn):
+        """
+        Build the three messages of a tool-using turn.
+        """
+        return [
+            Message(conversation_id, "user", f"Find restaurants near stop {turn}", token_count=6),
+            Message(conversation_id, "assistant", "Tool result: " + "- **Place** (Rating: 4.5)\n" * 5, token_count=60),
+            Message(conversation_id, "assistant", "Here are a few places you could try.", token_count=9),
+        ]
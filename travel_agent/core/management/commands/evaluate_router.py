@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from travel_agent.core.models import RoutingDecision, ToolMethod
+from utils.router import DEFAULT_TOOL_ROUTER, fit_router_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the local tool router on the logged LLM routing decisions: train on the oldest ones, "
+        "replay the most recent ones and report accuracy, coverage at the threshold and latency saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--holdout", type=float, default=0.2,
+            help="Fraction of the most recent LLM decisions held out for evaluation (default: 0.2).",
+        )
+        parser.add_argument(
+            "--threshold", type=float, default=None,
+            help="Confidence threshold to evaluate (default: TOOL_ROUTER['THRESHOLD']).",
+        )
+
+    def handle(self, *args, **options):
+        config = {**DEFAULT_TOOL_ROUTER, **getattr(settings, "TOOL_ROUTER", {})}
+        threshold = options["threshold"] if options["threshold"] is not None else config["THRESHOLD"]
+        if not 0 < options["holdout"] < 1:
+            raise CommandError("--holdout must be between 0 and 1.")
+
+        decisions = list(
+            RoutingDecision.objects.filter(source="llm")
+            .order_by("-created_at")
+            .values_list("text", "context", "tool", "latency_ms")[: config["MAX_EXAMPLES"]]
+        )
+        decisions.reverse()
+        held_out = max(int(len(decisions) * options["holdout"]), 1)
+        if len(decisions) - held_out < 1:
+            raise CommandError(f"Not enough logged LLM decisions to evaluate ({len(decisions)}).")
+        train, test = decisions[:-held_out], decisions[-held_out:]
+
+        tools = dict(ToolMethod.objects.values_list("name", "description"))
+        model = fit_router_model(tools, [(text, context, tool) for text, context, tool, _ in train])
+        if model is None:
+            raise CommandError("Could not train a router (are there tools to route to?).")
+
+        correct = covered = covered_correct = 0
+        local_latencies = []
+        for text, context, tool, _ in test:
+            started = time.perf_counter()
+            label, confidence = model.predict(text, context)
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            correct += label == tool
+            if label is not None and confidence >= threshold:
+                covered += 1
+                covered_correct += label == tool
+
+        llm_latencies = [latency for _, _, _, latency in decisions if latency is not None]
+        llm_ms = statistics.fmean(llm_latencies) if llm_latencies else None
+        local_ms = statistics.fmean(local_latencies)
+
+        self.stdout.write(f"Trained on {len(train)} LLM decisions, evaluated on the latest {len(test)}")
+        rows = [
+            ("Accuracy", f"{correct / len(test):.1%}"),
+            (f"Coverage at {threshold:.2f}", f"{covered / len(test):.1%}"),
+        ]
+        if covered:
+            rows.append(("Accuracy on covered turns", f"{covered_correct / covered:.1%}"))
+        rows.append(("Local routing latency", f"{local_ms:.3f} ms"))
+        if llm_ms is not None:
+            rows.append(("LLM routing latency", f"{llm_ms:.1f} ms"))
+            rows.append(("Estimated saving", f"{covered / len(test) * (llm_ms - local_ms):.1f} ms per routed turn"))
+        for label, value in rows:
+            self.stdout.write(f"{label + ':':<27}{value}")
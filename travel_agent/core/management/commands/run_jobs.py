@@ -0,0 +1,57 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+import utils.agent  # noqa: F401 (registers the agent's job handlers)
+from utils.jobs import JOB_HANDLERS, JobWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs (such as tool calls deferred by the agent) from the jobs table until interrupted. "
+        "Start as many workers as needed; each leases its jobs, so they never run the same job concurrently."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=None,
+            help="Jobs run at once by this worker (default: JOB_QUEUE['CONCURRENCY']).",
+        )
+        parser.add_argument(
+            "--kinds", default=None,
+            help=f"Comma-separated job kinds to run (default: all of {', '.join(sorted(JOB_HANDLERS))}).",
+        )
+        parser.add_argument(
+            "--lease", type=float, default=None,
+            help="Seconds a claimed job is reserved for this worker between renewals (default: JOB_QUEUE['LEASE_SECONDS']).",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=None,
+            help="Seconds to wait between looks for due jobs when idle (default: JOB_QUEUE['POLL_INTERVAL']).",
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due or running.")
+
+    def handle(self, *args, **options):
+        kinds = [kind.strip() for kind in options["kinds"].split(",") if kind.strip()] if options["kinds"] else None
+        unknown = set(kinds or []) - set(JOB_HANDLERS)
+        if unknown:
+            raise CommandError(f"Unknown job kinds: {', '.join(sorted(unknown))}.")
+        if options["concurrency"] is not None and options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        worker = JobWorker(
+            kinds=kinds,
+            concurrency=options["concurrency"],
+            lease_seconds=options["lease"],
+            poll_interval=options["poll_interval"],
+        )
+
+        # Finish the running jobs on SIGINT/SIGTERM instead of abandoning them until their leases expire
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        self.stdout.write(f"Worker {worker.name} running up to {worker.concurrency} jobs at once.")
+        worker.run(once=options["once"], stop=stop)
+        self.stdout.write("Worker stopped.")
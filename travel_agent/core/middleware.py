@@ -0,0 +1,65 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from utils.metrics import metrics
+from utils.tracing import DEFAULT_TRACING, start_trace
+
+
+class TracingMiddleware:
+    """
+    Trace each request: spans recorded while the view runs are collected into a Trace, returned
+    in a Server-Timing header and, for slow requests, printed as a tree. Request counts and
+    latencies are recorded per view in the metrics served at /metrics.
+
+    Streaming responses send their headers before the body is generated, so their Server-Timing
+    header only covers the work done before the first byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = {**DEFAULT_TRACING, **getattr(settings, "TRACING", {})}
+        self.enabled = config["ENABLED"]
+        self.server_timing = config["SERVER_TIMING"]
+        self.log_slow_ms = config["LOG_SLOW_MS"]
+        self.requests = metrics.counter(
+            "agent_http_requests_total", "HTTP requests handled, by view and status.", ("view", "method", "status"),
+        )
+        self.latency = metrics.histogram(
+            "agent_http_request_duration_seconds", "Time to the response headers, by view.", ("view",),
+            buckets=config["BUCKETS"],
+        )
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        with start_trace() as trace:
+            response = self.get_response(request)
+        return self._finish(request, response, trace)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        with start_trace() as trace:
+            response = await self.get_response(request)
+        return self._finish(request, response, trace)
+
+    def _finish(self, request, response, trace):
+        started = trace.start
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        self.requests.inc(view=view, method=request.method, status=response.status_code)
+        self.latency.observe(time.perf_counter() - started, view=view)
+        if self.server_timing:
+            response["Server-Timing"] = trace.server_timing()
+        if self.log_slow_ms is not None and trace.duration_ms >= self.log_slow_ms:
+            print(f"Slow request {request.method} {request.path} ({trace.duration_ms:.1f} ms):\n{trace.format()}")
+        return response
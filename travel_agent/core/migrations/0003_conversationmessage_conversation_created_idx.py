@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_conversationmessage_token_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversationmessage',
+            index=models.Index(fields=['conversation', 'created_at'], name='core_message_conv_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_conversationmessage_conversation_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationmessage',
+            name='tool_result',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_conversationmessage_tool_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoutingDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('tool', models.CharField(blank=True, max_length=50)),
+                ('source', models.CharField(choices=[('llm', 'LLM'), ('local', 'Local router')], max_length=10)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('latency_ms', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['source', 'created_at'], name='core_routing_src_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_tableversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routingdecision',
+            name='context',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+SEARCH_FLIGHTS = {
+    "description": (
+        "Searches flight offers between two airports on a given date with the Amadeus Flight Offers Search API "
+        "and returns the cheapest offers with their price, carriers, departure and arrival times, duration and "
+        "number of stops. Use it when the user asks about flights, airfares or plane tickets."
+    ),
+    "parameters": {
+        "origin": "IATA code of the departure airport or city, e.g. BOS",
+        "destination": "IATA code of the arrival airport or city, e.g. LHR",
+        "departure_date": "Departure date in YYYY-MM-DD format",
+        "adults": {"type": "integer", "minimum": 1, "description": "Number of adult travelers"},
+    },
+    "tool_class": "AmadeusTool",
+}
+
+
+def add_search_flights(apps, schema_editor):
+    ToolMethod = apps.get_model("core", "ToolMethod")
+    ToolMethod.objects.get_or_create(name="search_flights", defaults=SEARCH_FLIGHTS)
+
+
+def remove_search_flights(apps, schema_editor):
+    ToolMethod = apps.get_model("core", "ToolMethod")
+    ToolMethod.objects.filter(name="search_flights").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_routingdecision_context'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_flights, remove_search_flights),
+    ]
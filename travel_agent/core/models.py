@@ -1,4 +1,8 @@
 from django.db import models
+from django.db.models import Count, F, Q, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from datetime import timedelta
 import uuid
 
 class ToolMethod(models.Model):
@@ -11,6 +15,35 @@ class ToolMethod(models.Model):
         return f"{self.tool_class}.{self.name}"
 
 
+class TableVersionQuerySet(models.QuerySet):
+    def current(self, name):
+        """
+        Return the version of table `name`; 0 until it is first bumped.
+        """
+        return self.filter(name=name).values_list("version", flat=True).first() or 0
+
+    def bump(self, name):
+        """
+        Increment the version of table `name`, atomically.
+        """
+        self.get_or_create(name=name)
+        self.filter(name=name).update(version=F("version") + 1)
+
+
+class TableVersion(models.Model):
+    """
+    Version counter of a table whose contents processes cache (e.g. the ToolMethod rows behind the
+    tool registry), bumped on every change so each process can tell when to reload.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    objects = TableVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
 class Conversation(models.Model):
     """
     Represents a conversation between a user and the TravelAgent.
@@ -18,11 +51,72 @@ class Conversation(models.Model):
     session_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    summary = models.TextField(blank=True)  # Rolling summary of the older messages (see utils/summary.py)
+    summary_through = models.BigIntegerField(null=True, blank=True)  # Id of the last message the summary covers
 
     def __str__(self):
         return f"Conversation {self.session_id}"
 
 
+class ConversationMessageQuerySet(models.QuerySet):
+    # Columns fetched when loading history, instead of whole model instances
+    HISTORY_FIELDS = ("id", "sender", "content", "token_count", "tool_id", "tool_result", "created_at")
+
+    def _history_page(self, conversation, limit=None, before=None, after=None):
+        """
+        Build the query for a page of a conversation's history: newest first, or oldest first
+        when paging forward from `after`.
+        """
+        queryset = self.filter(conversation=conversation)
+        # Keyset pagination on (created_at, id), resolved in the same query
+        if before is not None:
+            cursor = Subquery(self.filter(pk=before).values("created_at")[:1])
+            queryset = queryset.filter(Q(created_at__lt=cursor) | Q(created_at=cursor, id__lt=before))
+        if after is not None:
+            # Forward pages follow ids, which increase with insertion order like the summary watermark
+            queryset = queryset.filter(id__gt=after).order_by("id")
+        else:
+            queryset = queryset.order_by("-created_at", "-id")
+        queryset = queryset.values_list(*self.HISTORY_FIELDS, named=True)
+        return queryset[:limit] if limit is not None else queryset
+
+    def history(self, conversation, limit=None, before=None, after=None):
+        """
+        Return a conversation's messages as named rows of HISTORY_FIELDS, oldest first.
+
+        :param conversation: Conversation (or its id) to read.
+        :param limit: Return only the most recent `limit` messages; all messages if None. With
+                      `after`, the `limit` messages that follow it instead.
+        :param before: Id of a message; only messages preceding it are returned (keyset pagination).
+        :param after: Id of a message (or 0); only messages with greater ids are returned (forward
+                      keyset pagination).
+        """
+        rows = list(self._history_page(conversation, limit, before, after))
+        return rows if after is not None else rows[::-1]
+
+    async def ahistory(self, conversation, limit=None, before=None, after=None):
+        """
+        Async version of `history`.
+        """
+        rows = [row async for row in self._history_page(conversation, limit, before, after)]
+        return rows if after is not None else rows[::-1]
+
+    def _latest(self, conversation):
+        return self.filter(conversation=conversation).order_by("-created_at", "-id").values_list("id", flat=True)
+
+    def latest_id(self, conversation):
+        """
+        Return the id of the conversation's most recent message, or None.
+        """
+        return self._latest(conversation).first()
+
+    async def alatest_id(self, conversation):
+        """
+        Async version of `latest_id`.
+        """
+        return await self._latest(conversation).afirst()
+
+
 class ConversationMessage(models.Model):
     """
     Represents a single message in a conversation.
@@ -37,13 +131,224 @@ class ConversationMessage(models.Model):
         choices=[("user", "User"), ("assistant", "Assistant")],
     )  # Indicates the sender of the message
     content = models.TextField()  # The message text
+    token_count = models.PositiveIntegerField(null=True, blank=True)  # Tokens sent to the LLM, counted at write time
     tool = models.ForeignKey(
         ToolMethod,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
     )  # Optional: Tool used in the message
+    tool_result = models.JSONField(null=True, blank=True)  # Structured result of the tool (see utils/results.py)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ConversationMessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves history loads and keyset pagination, which filter on conversation and order by created_at
+            models.Index(fields=["conversation", "created_at"], name="core_message_conv_created_idx"),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender} in {self.conversation} at {self.created_at}"
+
+
+class RoutingDecision(models.Model):
+    """
+    A tool routing decision for a user message, logged to train and evaluate the local router.
+    """
+    text = models.TextField()  # The user message that was routed
+    context = models.TextField(blank=True)  # The previous user message of the conversation, if any
+    tool = models.CharField(max_length=50, blank=True)  # Name of the chosen tool method; empty if none
+    source = models.CharField(
+        max_length=10,
+        choices=[("llm", "LLM"), ("local", "Local router")],
+    )  # Which router made the decision; only LLM decisions are used as training labels
+    confidence = models.FloatField(null=True, blank=True)  # Local router's probability for the chosen tool
+    latency_ms = models.FloatField(null=True, blank=True)  # Time the routing decision took
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["source", "created_at"], name="core_routing_src_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.source} routed to {self.tool or 'no tool'} at {self.created_at}"
+
+
+class LLMUsageQuerySet(models.QuerySet):
+    def totals_by(self, *fields):
+        """
+        Return call counts and token sums grouped by `fields` and model (pricing depends on the model).
+        """
+        return (
+            self.values(*fields, "model")
+            .annotate(calls=Count("id"), prompt_tokens=Sum("prompt_tokens"), completion_tokens=Sum("completion_tokens"))
+            .order_by(*fields, "model")
+        )
+
+    def by_session(self):
+        return self.totals_by("conversation__session_id")
+
+    def by_day(self):
+        return self.annotate(day=TruncDate("created_at")).totals_by("day")
+
+    def by_tool(self):
+        return self.totals_by("tool")
+
+    def by_step(self):
+        return self.totals_by("step")
+
+
+class LLMUsage(models.Model):
+    """
+    Token usage of one LLM call, as reported by the API, attributed to the message the call produced.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name="llm_usage",
+    )
+    message = models.ForeignKey(
+        ConversationMessage,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="llm_usage",
+    )  # Message produced by (or following) the call: the tool result after routing, or the reply
+    step = models.CharField(max_length=20)  # Agent step that made the call: "routing", "tool_routing" or "answer"
+    tool = models.CharField(max_length=50, blank=True)  # Tool used in the turn; empty if none
+    model = models.CharField(max_length=50)  # Model name reported by the API
+    prompt_tokens = models.PositiveIntegerField()
+    completion_tokens = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LLMUsageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the per-day report and the reporting window
+            models.Index(fields=["created_at"], name="core_llmusage_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.step} call to {self.model}: {self.prompt_tokens}+{self.completion_tokens} tokens"
+
+
+class JobQuerySet(models.QuerySet):
+    def claim(self, worker, lease_seconds, kinds=None, limit=1):
+        """
+        Lease up to `limit` runnable jobs to `worker` and return them, oldest first.
+
+        Runnable jobs are queued jobs that are due, and running jobs whose lease expired (their
+        worker died). Each job is taken with a conditional update, so concurrent workers never
+        claim the same job. Expired jobs without attempts left are marked failed instead.
+        """
+        now = timezone.now()
+        self.filter(status=Job.RUNNING, leased_until__lt=now, attempts__gte=F("max_attempts")).update(
+            status=Job.FAILED, error="The worker running the job stopped before it finished.", finished_at=now,
+        )
+        runnable = self.filter(Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, leased_until__lt=now))
+        if kinds:
+            runnable = runnable.filter(kind__in=kinds)
+
+        claimed = []
+        # Look past the first `limit` jobs, since concurrent workers may win some of them
+        for job in runnable.order_by("run_at")[:limit * 4]:
+            if len(claimed) >= limit:
+                break
+            leased_until = now + timedelta(seconds=lease_seconds)
+            won = self.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+                status=Job.RUNNING, leased_until=leased_until, worker=worker, attempts=F("attempts") + 1,
+            )
+            if won:
+                job.status, job.leased_until, job.worker, job.attempts = Job.RUNNING, leased_until, worker, job.attempts + 1
+                claimed.append(job)
+        return claimed
+
+    def renew(self, worker, job_ids, lease_seconds):
+        """
+        Extend the leases `worker` holds on the jobs `job_ids`.
+        """
+        return self.filter(pk__in=job_ids, worker=worker, status=Job.RUNNING).update(
+            leased_until=timezone.now() + timedelta(seconds=lease_seconds),
+        )
+
+
+class Job(models.Model):
+    """
+    A unit of background work, such as a slow tool call, run by `python manage.py run_jobs` workers.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Known before the job is saved
+    kind = models.CharField(max_length=30)  # Selects the handler that runs the job (see utils/jobs.py)
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )  # Conversation the job's result is folded into, if any
+    payload = models.JSONField(default=dict)  # Arguments of the handler
+    status = models.CharField(
+        max_length=10,
+        choices=[(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")],
+        default=QUEUED,
+    )
+    result = models.JSONField(null=True, blank=True)  # Handler's return value once succeeded
+    error = models.TextField(blank=True)  # Error of the latest failed attempt
+    attempts = models.PositiveSmallIntegerField(default=0)  # Attempts started so far
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)  # Not claimed before this time (retry backoff)
+    leased_until = models.DateTimeField(null=True, blank=True)  # A running job is reclaimed after its lease expires
+    worker = models.CharField(max_length=100, blank=True)  # Worker holding (or last holding) the lease
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the workers' claim query
+            models.Index(fields=["status", "run_at"], name="core_job_status_run_at_idx"),
+        ]
+
+    def _finish(self, **fields):
+        """
+        Update the job if the lease is still this worker's; return whether it was. A worker that
+        lost the lease (e.g. it expired and another worker claimed the job) leaves both the row and
+        the instance unchanged.
+        """
+        updated = Job.objects.filter(
+            pk=self.pk, worker=self.worker, status=Job.RUNNING, attempts=self.attempts,
+        ).update(**fields)
+        if updated:
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return bool(updated)
+
+    def complete(self, result):
+        """
+        Record the result of a successful attempt.
+        """
+        return self._finish(status=Job.SUCCEEDED, result=result, error="", leased_until=None, finished_at=timezone.now())
+
+    def fail(self, error, retry_delay, retry=True):
+        """
+        Record a failed attempt: requeue the job after `retry_delay` seconds, or fail it for good
+        if it has no attempts left or `retry` is False.
+        """
+        now = timezone.now()
+        if retry and self.attempts < self.max_attempts:
+            return self._finish(
+                status=Job.QUEUED, error=error, leased_until=None, run_at=now + timedelta(seconds=retry_delay),
+            )
+        return self._finish(status=Job.FAILED, error=error, leased_until=None, finished_at=now)
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from travel_agent.core.models import TableVersion, ToolMethod
+
+TOOL_REGISTRY_VERSION = "tool_method"  # TableVersion counter of the ToolMethod table
+
+
+def get_tool_registry_version():
+    """
+    Return the current version of the ToolMethod table, bumped on every change, or None if it
+    cannot be read (e.g. before migrations ran).
+
+    The counter is a TableVersion row, so a change made by any process (an admin edit, `loaddata`,
+    a shell) is seen by all of them, and unlike a cache entry it is never evicted. Only changes
+    going through model signals bump it: `QuerySet.update()`, `bulk_create()` and raw SQL bypass
+    them, so call `bump_tool_registry_version()` after changing ToolMethod rows that way.
+    """
+    try:
+        return TableVersion.objects.current(TOOL_REGISTRY_VERSION)
+    except DatabaseError:
+        return None
+
+
+@receiver(post_save, sender=ToolMethod)
+@receiver(post_delete, sender=ToolMethod)
+def bump_tool_registry_version(sender=ToolMethod, **kwargs):
+    """
+    Invalidate cached tool registries whenever a ToolMethod row is saved or deleted.
+    """
+    TableVersion.objects.bump(TOOL_REGISTRY_VERSION)
+
+
+@receiver(connection_created)
+def enable_sqlite_wal(sender, connection, **kwargs):
+    """
+    Put SQLite databases in WAL mode when settings.SQLITE_WAL is on. The mode is stored in the
+    database file, so this is a no-op after the first connection.
+    """
+    if connection.vendor == "sqlite" and getattr(settings, "SQLITE_WAL", False):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
@@ -0,0 +1,96 @@
+import random
+import time
+import uuid
+from types import SimpleNamespace
+
+from travel_agent.core.models import ToolMethod
+from utils.agent import TravelAgent
+from utils.benchmark import FakeChatGPT, FakeCompletions, FakeGooglePlacesTool, Latency
+from utils.llm import AsyncChatGPT
+from utils.ratelimit import ProviderLimiter
+from utils.registry import ToolRegistry
+from utils.response_cache import ResponseCache
+from utils.router import ToolRouter
+
+
+def wait_until(condition, timeout=2.0):
+    """
+    Poll `condition` until it holds, failing the test if it does not within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.005)
+
+
+def create_places_method():
+    """
+    Create the search_places ToolMethod, which the test database does not have.
+    """
+    method, _ = ToolMethod.objects.get_or_create(
+        name="search_places",
+        defaults={
+            "description": "Search for places such as restaurants, museums and hotels.",
+            "parameters": {"query": "query string: e.g. pizza in New York"},
+            "tool_class": "GooglePlacesTool",
+        },
+    )
+    return method
+
+
+def fake_llm(reply_words=8):
+    """
+    Return a ChatGPT answering instantly from the benchmark's fake completions: messages about
+    restaurants, museums, hotels or coffee are routed to search_places.
+    """
+    return FakeChatGPT(latency=Latency(), reply_words=reply_words)
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    """
+    FakeCompletions behind the async interface of the AsyncOpenAI client.
+    """
+
+    async def create(self, **request):
+        response = super().create(**request)
+        if not request.get("stream"):
+            return response
+
+        async def chunks():
+            for chunk in response:
+                yield chunk
+        return chunks()
+
+
+def fake_async_llm(reply_words=8):
+    """
+    Async version of `fake_llm`.
+    """
+    completions = FakeAsyncCompletions(Latency(), reply_words, random.Random(0))
+    llm = AsyncChatGPT(
+        client=SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+        response_cache=ResponseCache(enabled=False),
+        limiter=ProviderLimiter("test"),
+    )
+    llm.completions = completions
+    return llm
+
+
+def fake_registry(results=5):
+    """
+    Return a loaded ToolRegistry whose search_places returns `results` synthetic places instantly.
+    """
+    registry = ToolRegistry()
+    registry.tool_instances["GooglePlacesTool"] = FakeGooglePlacesTool(latency=Latency(), results=results)
+    registry.get_tool_registry()
+    return registry
+
+
+def fake_agent(llm=None, registry=None, store=None, session_id=None):
+    """
+    Return a TravelAgent on the fake LLM and Places backends, with the local router off.
+    """
+    agent = TravelAgent(llm or fake_llm(), session_id or uuid.uuid4(), store=store, registry=registry or fake_registry())
+    agent.router = ToolRouter(enabled=False, recording=False)
+    return agent
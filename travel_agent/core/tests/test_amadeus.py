@@ -0,0 +1,142 @@
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+from amadeus import ResponseError
+from django.test import SimpleTestCase, TestCase
+
+from utils.cache import ToolResultCache
+from utils.ratelimit import ProviderLimiter
+from utils.registry import ToolRegistry
+from utils.results import ToolResultEncoder
+from utils.tools import AmadeusTool
+
+
+def offer(price, *segments, seats=4, duration="PT7H"):
+    """
+    Build a Flight Offers Search offer whose single itinerary flies `segments` of (carrier, departs, arrives).
+    """
+    return {
+        "type": "flight-offer",
+        "id": str(price),
+        "price": {"currency": "EUR", "total": str(price), "grandTotal": str(price), "fees": []},
+        "numberOfBookableSeats": seats,
+        "itineraries": [{
+            "duration": duration,
+            "segments": [
+                {
+                    "carrierCode": carrier,
+                    "departure": {"iataCode": "XXX", "at": departs},
+                    "arrival": {"iataCode": "YYY", "at": arrives},
+                    "aircraft": {"code": "32A"},
+                }
+                for carrier, departs, arrives in segments
+            ],
+        }],
+        "travelerPricings": [{"fareDetailsBySegment": []}],
+    }
+
+
+DIRECT = offer(420.5, ("BA", "2025-06-01T18:00:00", "2025-06-02T06:00:00"))
+ONE_STOP = offer(
+    310.0, ("UA", "2025-06-01T07:00:00", "2025-06-01T09:00:00"), ("LH", "2025-06-01T11:00:00", "2025-06-01T23:00:00"),
+    duration="PT16H",
+)
+EXPENSIVE = offer(980.0, ("VS", "2025-06-01T20:00:00", "2025-06-02T08:00:00"))
+
+
+class FakeFlightOffersSearch:
+    def __init__(self, data=(), error=None):
+        self.data = list(data)
+        self.error = error
+        self.calls = []
+
+    def get(self, **params):
+        self.calls.append(params)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(data=self.data)
+
+
+def response_error(status_code, headers=None):
+    response = SimpleNamespace(
+        status_code=status_code, parsed=False, result=None, http_response=SimpleNamespace(headers=headers or {}),
+    )
+    return ResponseError(response)
+
+
+class AmadeusToolTests(SimpleTestCase):
+    def tool(self, search, max_rows=2):
+        client = SimpleNamespace(shopping=SimpleNamespace(flight_offers_search=search))
+        self.limiter = ProviderLimiter("test")
+        cache = ToolResultCache(ttls={"search_flights": 60}, backend="")
+        return AmadeusTool(client=client, limiter=self.limiter, cache=cache, max_rows=max_rows)
+
+    def test_projects_an_offer(self):
+        self.assertEqual(AmadeusTool._project_offer(ONE_STOP), {
+            "price": 310.0,
+            "currency": "EUR",
+            "carriers": ["LH", "UA"],
+            "departs": "2025-06-01T07:00:00",
+            "arrives": "2025-06-01T23:00:00",
+            "duration": "PT16H",
+            "stops": 1,
+            "seats": 4,
+        })
+
+    def test_keeps_the_cheapest_offers_cheapest_first(self):
+        search = FakeFlightOffersSearch([EXPENSIVE, DIRECT, ONE_STOP])
+        result = self.tool(search).search_flights("BOS", "LHR", "2025-06-01", adults=2)
+        self.assertEqual([row["price"] for row in result["rows"]], [310.0, 420.5])
+        self.assertEqual(result["total"], 3)
+        self.assertEqual(result["meta"], {"origin": "BOS", "destination": "LHR", "date": "2025-06-01"})
+        self.assertEqual(search.calls, [{
+            "originLocationCode": "BOS", "destinationLocationCode": "LHR", "departureDate": "2025-06-01",
+            "adults": 2, "max": AmadeusTool.MAX_OFFERS,
+        }])
+
+    def test_result_encodes_for_the_prompt(self):
+        result = self.tool(FakeFlightOffersSearch([DIRECT, ONE_STOP])).search_flights("BOS", "LHR", "2025-06-01")
+        lines = ToolResultEncoder(fields={}).encode(result).split("\n")
+        self.assertEqual(lines[0], "search_flights(origin=BOS, destination=LHR, date=2025-06-01): 2 of 2 results")
+        self.assertEqual(lines[2].split("|")[:3], ["310.0", "EUR", "LH,UA"])
+
+    def test_searches_are_cached_per_arguments(self):
+        search = FakeFlightOffersSearch([DIRECT])
+        tool = self.tool(search)
+        tool.search_flights("BOS", "LHR", "2025-06-01")
+        tool.search_flights("BOS", "LHR", "2025-06-01")
+        self.assertEqual(len(search.calls), 1)
+        tool.search_flights("BOS", "LHR", "2025-06-01", adults=2)
+        tool.search_flights("BOS", "LHR", "2025-06-02")
+        self.assertEqual(len(search.calls), 3)
+
+    def test_api_errors_become_error_results(self):
+        tool = self.tool(FakeFlightOffersSearch(error=response_error(400)))
+        result = tool.search_flights("BOS", "XXX", "2025-06-01")
+        self.assertEqual(result["tool"], "search_flights")
+        self.assertIn("[400]", result["error"])
+        self.assertEqual(self.limiter.counters["throttled"], 0)
+
+    def test_rate_limited_searches_pause_the_limiter(self):
+        tool = self.tool(FakeFlightOffersSearch(error=response_error(429, {"retry-after": "3"})))
+        result = tool.search_flights("BOS", "LHR", "2025-06-01")
+        self.assertIn("error", result)
+        self.assertEqual(self.limiter.counters["throttled"], 1)
+
+    def test_errors_are_not_cached(self):
+        search = FakeFlightOffersSearch(error=response_error(500))
+        tool = self.tool(search)
+        tool.search_flights("BOS", "LHR", "2025-06-01")
+        search.error, search.data = None, [DIRECT]
+        self.assertEqual(len(tool.search_flights("BOS", "LHR", "2025-06-01")["rows"]), 1)
+
+
+class AmadeusRegistrationTests(TestCase):
+    def test_registered_without_credentials(self):
+        with mock.patch.dict(os.environ, {"AMADEUS_API_KEY": "", "AMADEUS_API_SECRET": ""}), \
+                mock.patch("utils.tools.get_amadeus_client") as get_client:
+            method = ToolRegistry().get_tool_registry()["search_flights"]["method"]
+        self.assertIsInstance(method.__self__, AmadeusTool)
+        # The client is only created by the first search
+        get_client.assert_not_called()
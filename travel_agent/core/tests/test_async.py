@@ -0,0 +1,87 @@
+import asyncio
+import uuid
+from unittest import mock
+
+from django.test import TestCase
+
+from travel_agent.core.tests.helpers import create_places_method, fake_async_llm, fake_registry
+from utils.agent import AsyncTravelAgent
+from utils.router import ToolRouter
+from utils.sessions import AgentSessionCache
+from utils.stores import InMemoryConversationStore
+
+
+class AsyncTravelAgentTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.registry = fake_registry()
+        self.places = self.registry.tool_instances["GooglePlacesTool"]
+        self.store = InMemoryConversationStore()
+
+    def agent(self, llm=None):
+        session_id = uuid.uuid4()
+        conversation_id = self.store.create_conversation(session_id)
+        agent = AsyncTravelAgent(llm or fake_async_llm(), session_id, self.registry, conversation_id, [], self.store)
+        agent.router = ToolRouter(enabled=False, recording=False)
+        return agent
+
+    def test_tool_turn_runs_on_the_async_clients(self):
+        agent = self.agent()
+
+        async def main():
+            return await agent.process_user_input("Can you find good restaurants in Boston?")
+
+        reply = asyncio.run(main())
+        self.assertTrue(reply)
+        self.assertEqual(len(self.places.calls), 1)  # Through the tool's async fetch
+        self.assertEqual(len(agent.llm.completions.calls), 2)
+        history = self.store.history(agent.conversation_id)
+        self.assertEqual([message.sender for message in history], ["user", "assistant", "assistant"])
+        self.assertIsNotNone(history[1].tool_result)
+        self.assertEqual(history[-1].content, reply)
+
+    def test_stream_yields_the_same_events_as_the_sync_agent(self):
+        agent = self.agent()
+
+        async def main():
+            return [event async for event in agent.process_user_input_stream("What museums should I visit in Rome?")]
+
+        events = asyncio.run(main())
+        names = [event["event"] for event in events]
+        self.assertEqual(names[:3], ["routing", "tool_started", "tool_finished"])
+        self.assertEqual(names[-1], "done")
+        tokens = "".join(event["content"] for event in events if event["event"] == "token")
+        self.assertEqual(events[-1]["message"], tokens)
+
+    def test_cancelling_the_turn_saves_no_reply(self):
+        agent = self.agent()
+
+        async def main():
+            stream = agent.process_user_input_stream("Thanks, that helps a lot!")
+            async for event in stream:
+                if event["event"] == "token":
+                    break
+            await stream.aclose()
+
+        asyncio.run(main())
+        self.assertEqual([message.sender for message in self.store.history(agent.conversation_id)], ["user"])
+
+    def test_checkout_rebinds_the_llm_of_each_request(self):
+        sessions = AgentSessionCache("test", verify=False)
+        session_id = uuid.uuid4()
+        conversation_id = self.store.create_conversation(session_id)
+
+        async def factory(llm):
+            return AsyncTravelAgent(llm, session_id, self.registry, conversation_id, [], self.store)
+
+        async def turn():
+            # Each request runs on its own event loop with its own client
+            llm = fake_async_llm()
+            async with sessions.acheckout(session_id, lambda: factory(llm), llm=llm) as agent:
+                return agent, llm
+
+        with mock.patch("utils.agent.get_cached_registry", return_value=self.registry):
+            first, _ = asyncio.run(turn())
+            second, llm = asyncio.run(turn())
+        self.assertIs(second, first)
+        self.assertIs(second.llm, llm)
@@ -0,0 +1,81 @@
+import json
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+
+from travel_agent.core.tests.helpers import create_places_method
+from utils.benchmark import AgentBenchmark, Latency, script_conversation, summarize
+from utils.stores import InMemoryConversationStore
+
+STAGES = {"context", "routing", "tool", "answer", "persist", "other"}
+
+
+class BenchmarkHelperTests(SimpleTestCase):
+    def test_scripts_are_deterministic(self):
+        script = script_conversation(6, seed=1)
+        self.assertEqual(script, script_conversation(6, seed=1))
+        self.assertNotEqual(script, script_conversation(6, seed=2))
+        self.assertEqual(len(script), 6)
+
+    def test_summarize(self):
+        self.assertEqual(summarize([]), {"mean": 0, "p50": 0, "p95": 0, "max": 0})
+        self.assertEqual(summarize([4, 1, 3, 2]), {"mean": 2.5, "p50": 2.5, "p95": 4, "max": 4})
+
+    def test_latency(self):
+        self.assertEqual(Latency().sample(), 0.0)
+        self.assertEqual(Latency(20).sample(), 0.02)
+        samples = [Latency(20, 5).sample() for _ in range(3)]
+        self.assertTrue(all(sample > 0 for sample in samples))
+
+
+class AgentBenchmarkTests(TestCase):
+    def setUp(self):
+        create_places_method()
+
+    def test_report_covers_every_turn_and_stage(self):
+        benchmark = AgentBenchmark(InMemoryConversationStore(), routing_mode="classic")
+        report = benchmark.run([1, 6], per_turn=True, memory=False)
+
+        self.assertEqual(report["config"]["store"], "InMemoryConversationStore")
+        self.assertEqual([run["turns"] for run in report["runs"]], [1, 6])
+        run = report["runs"][1]
+        self.assertEqual(set(run["stages_ms"]), STAGES)
+        self.assertNotIn("memory_kb", run)
+        self.assertEqual(len(run["per_turn"]), 6)
+        # Classic routing: one routing and one answer call per turn
+        self.assertEqual(run["llm_calls"], 12)
+        self.assertEqual([row["llm_calls"] for row in run["per_turn"]], [2] * 6)
+        # Place searches (turns 1 and 4) are timed under the tool stage, the other turns have none
+        self.assertEqual([row["stages_ms"].get("tool", 0) > 0 for row in run["per_turn"]][::3], [True, True])
+        self.assertNotIn("tool", run["per_turn"][1]["stages_ms"])
+        history = [row["history_messages"] for row in run["per_turn"]]
+        self.assertEqual(history, sorted(history))
+        self.assertEqual(run["prompt_tokens"]["last"], run["per_turn"][-1]["prompt_tokens"])
+        json.dumps(report)
+
+    def test_memory_pass(self):
+        report = AgentBenchmark(InMemoryConversationStore()).run([3])
+        self.assertGreater(report["runs"][0]["memory_kb"]["peak"], 0)
+
+    def test_function_calling_mode(self):
+        benchmark = AgentBenchmark(InMemoryConversationStore(), routing_mode="function_calling")
+        run = benchmark.run([3], per_turn=True, memory=False)["runs"][0]
+        # A direct answer takes one call, a place search a second one with the tool result
+        self.assertEqual([row["llm_calls"] for row in run["per_turn"]], [2, 1, 1])
+
+
+class BenchmarkAgentCommandTests(TestCase):
+    def setUp(self):
+        create_places_method()
+
+    def test_prints_the_json_report(self):
+        out = StringIO()
+        call_command("benchmark_agent", turns="2", store="memory", no_memory=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual([run["turns"] for run in report["runs"]], [2])
+
+    def test_rejects_invalid_arguments(self):
+        for options in ({"turns": "0"}, {"turns": "a,b"}, {"store": "redis"}, {"llm_latency": "-5"}):
+            with self.subTest(options=options), self.assertRaises(CommandError):
+                call_command("benchmark_agent", **{"store": "memory", "no_memory": True, **options})
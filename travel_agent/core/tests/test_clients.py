@@ -0,0 +1,59 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from utils import clients
+from utils.clients import (
+    aclose_clients, close_clients, get_async_http_client, get_async_openai_client, get_http_session, get_openai_client,
+    get_request_timeout,
+)
+
+
+class SharedClientTests(SimpleTestCase):
+    def setUp(self):
+        for registry in (clients._clients, clients._async_clients):
+            patch = mock.patch.dict(registry, clear=True)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_sync_clients_are_shared(self):
+        self.assertIs(get_openai_client(), get_openai_client())
+        self.assertIs(get_http_session(), get_http_session())
+        self.assertEqual(get_openai_client().max_retries, 0)
+
+    @override_settings(HTTP_CLIENTS={"POOL_SIZE": 3, "CONNECT_TIMEOUT": 1.5, "READ_TIMEOUT": 9.0})
+    def test_pools_and_timeouts_follow_settings(self):
+        adapter = get_http_session().get_adapter("https://maps.googleapis.com")
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(get_request_timeout(), (1.5, 9.0))
+        self.assertEqual(get_openai_client().timeout.connect, 1.5)
+
+    def test_async_clients_are_kept_per_event_loop(self):
+        async def clients_of_loop():
+            return get_async_openai_client(), get_async_openai_client(), get_async_http_client()
+
+        first, same, http = asyncio.run(clients_of_loop())
+        self.assertIs(first, same)
+        self.assertIsNot(first, http)
+
+        second, _, _ = asyncio.run(clients_of_loop())
+        self.assertIsNot(second, first)
+        # The first loop was closed, so its clients were dropped
+        self.assertEqual(len(clients._async_clients), 1)
+
+    def test_close_clients_closes_and_forgets_sync_clients(self):
+        session = get_http_session()
+        with mock.patch.object(session, "close") as close:
+            close_clients()
+        close.assert_called_once()
+        self.assertIsNot(get_http_session(), session)
+
+    def test_aclose_clients_closes_the_clients_of_the_running_loop(self):
+        async def main():
+            client = get_async_http_client()
+            await aclose_clients()
+            return client
+
+        self.assertTrue(asyncio.run(main()).is_closed)
+        self.assertEqual(clients._async_clients, {})
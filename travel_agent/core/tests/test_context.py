@@ -0,0 +1,82 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from travel_agent.core.tests.helpers import create_places_method, fake_agent
+from utils.context import MESSAGE_OVERHEAD_TOKENS, ContextBuilder, count_tokens, history_entry
+
+
+def cost(entry):
+    return entry["tokens"] + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextBuilderTests(SimpleTestCase):
+    def setUp(self):
+        self.first = history_entry("user", "word " * 50)
+        self.places = history_entry("user", "data " * 300, tool=True)
+        self.reply = history_entry("assistant", "reply " * 50)
+        self.latest = history_entry("user", "latest " * 20)
+        self.history = [self.first, self.places, self.reply, self.latest]
+        self.prompt_tokens = MESSAGE_OVERHEAD_TOKENS  # Of an empty prompt
+
+    def build(self, budget, **kwargs):
+        builder = ContextBuilder(token_budget=budget, response_reserve=0, tool_result_max_tokens=20)
+        return builder.build("", self.history, **kwargs)
+
+    def contents(self, messages):
+        return [message["content"] for message in messages]
+
+    def test_history_within_budget_is_sent_as_is(self):
+        messages, report = self.build(10_000)
+        self.assertEqual(messages, [{"role": entry["role"], "content": entry["content"]} for entry in self.history])
+        self.assertEqual((report["truncated"], report["dropped"]), (0, 0))
+        self.assertEqual(report["total_tokens"], self.prompt_tokens + sum(cost(entry) for entry in self.history))
+
+    def test_older_tool_results_are_truncated_first(self):
+        others = cost(self.first) + cost(self.reply) + cost(self.latest)
+        messages, report = self.build(self.prompt_tokens + others + 40)
+        self.assertEqual((report["truncated"], report["dropped"]), (1, 0))
+        self.assertTrue(messages[1]["content"].endswith("...[truncated]"))
+        self.assertLessEqual(count_tokens(messages[1]["content"]), 30)
+        self.assertLessEqual(report["total_tokens"], report["budget"])
+
+    def test_tool_results_are_dropped_before_other_messages(self):
+        others = cost(self.first) + cost(self.reply) + cost(self.latest)
+        messages, report = self.build(self.prompt_tokens + others)
+        self.assertEqual((report["truncated"], report["dropped"]), (1, 1))
+        self.assertEqual(self.contents(messages), self.contents([self.first, self.reply, self.latest]))
+
+    def test_oldest_messages_go_last_and_the_latest_always_stays(self):
+        messages, report = self.build(self.prompt_tokens + cost(self.reply) + cost(self.latest))
+        self.assertEqual(self.contents(messages), self.contents([self.reply, self.latest]))
+        self.assertEqual(report["dropped"], 2)
+
+        messages, _ = self.build(0)
+        self.assertEqual(self.contents(messages), [self.latest["content"]])
+
+    def test_summary_and_tool_messages_are_always_sent(self):
+        tool_messages = [{"role": "tool", "tool_call_id": "call_0", "content": "results"}]
+        messages, report = self.build(0, summary="The user plans a trip to Rome.", tool_messages=tool_messages)
+        self.assertEqual(messages[0]["role"], "system")
+        self.assertIn("The user plans a trip to Rome.", messages[0]["content"])
+        self.assertEqual(messages[1:], [{"role": "user", "content": self.latest["content"]}, tool_messages[0]])
+        self.assertGreater(report["summary_tokens"], 0)
+        self.assertGreater(report["tool_tokens"], 0)
+
+
+class AgentContextTests(TestCase):
+    def test_history_is_sent_once_as_messages(self):
+        create_places_method()
+        agent = fake_agent()
+        agent.process_user_input("What's the best time of year to visit Kyoto?")
+        with mock.patch.object(agent.llm.completions, "create", wraps=agent.llm.completions.create) as create:
+            agent.process_user_input("How many days should I spend in Kyoto?")
+
+        for call in create.call_args_list:
+            messages = call.kwargs["messages"]
+            self.assertNotIn("best time of year", messages[0]["content"])  # Not in the system prompt
+            earlier = [message for message in messages if "best time of year" in (message["content"] or "")]
+            self.assertEqual(len(earlier), 1)
+        report = agent.get_turn_context_report()
+        self.assertEqual(report["llm_calls"], 2)
+        self.assertTrue(all(call["total_tokens"] <= call["budget"] for call in report["calls"]))
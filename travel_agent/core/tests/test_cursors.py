@@ -0,0 +1,51 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from utils.cursors import ToolCursor
+
+
+class ToolCursorTests(SimpleTestCase):
+    def cursor(self, rows=12, offset=5):
+        return ToolCursor("search_places", {"query": "museums in Rome"}, iter([{"n": i} for i in range(rows)]), offset)
+
+    def test_continues_only_on_more_results_follow_ups(self):
+        cursor = self.cursor()
+        self.assertTrue(cursor.continues("search_places", {"query": "Show me more!"}))
+        self.assertFalse(cursor.continues("search_places", {"query": "museums in Rome"}))
+        self.assertFalse(cursor.continues("search_places", {"query": "museums in Paris"}))
+        self.assertFalse(cursor.continues("search_flights", {"query": "more"}))
+
+    def test_continues_on_phrasings_of_more(self):
+        cursor = ToolCursor("search_places", {"query": "restaurants in Boston"}, iter([]))
+        for query in ["show me more restaurants", "any more?", "more please", "next page", "what else is there?"]:
+            with self.subTest(query=query):
+                self.assertTrue(cursor.continues("search_places", {"query": query}))
+        for query in ["restaurants in Boston", "more museums", "more restaurants in Denver", "cheaper restaurants"]:
+            with self.subTest(query=query):
+                self.assertFalse(cursor.continues("search_places", {"query": query}))
+
+    def test_take_pages_until_exhausted(self):
+        cursor = self.cursor()
+        page = cursor.take(5)
+        self.assertEqual([row["n"] for row in page["rows"]], [5, 6, 7, 8, 9])
+        self.assertEqual((page["total"], page["has_more"], page["meta"]["offset"]), (None, True, 5))
+
+        page = cursor.take(5)
+        self.assertEqual([row["n"] for row in page["rows"]], [10, 11])
+        self.assertEqual(page["total"], 2)
+        self.assertNotIn("has_more", page)
+        self.assertEqual(cursor.take(5)["rows"], [])
+
+    def test_atake_reads_async_iterators(self):
+        async def rows():
+            for i in range(3):
+                yield {"n": i}
+
+        async def main():
+            cursor = ToolCursor("search_places", {"query": "bars"}, rows())
+            return await cursor.atake(2), await cursor.atake(2)
+
+        first, second = asyncio.run(main())
+        self.assertEqual(([row["n"] for row in first["rows"]], first.get("has_more")), ([0, 1], True))
+        self.assertEqual(([row["n"] for row in second["rows"]], second.get("has_more")), ([2], None))
@@ -0,0 +1,82 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from travel_agent.core.tests.helpers import create_places_method, fake_agent
+
+
+class FunctionCallingTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.agent = fake_agent()
+        self.agent.routing_mode = "function_calling"
+        self.create = mock.patch.object(
+            self.agent.llm.completions, "create", wraps=self.agent.llm.completions.create,
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def history(self):
+        return self.agent.store.history(self.agent.conversation_id)
+
+    def test_tool_turn_replays_the_tool_call_with_its_result(self):
+        reply = self.agent.process_user_input("Can you find good restaurants in Boston?")
+
+        self.assertEqual(self.create.call_count, 2)
+        first, second = (call.kwargs for call in self.create.call_args_list)
+        self.assertEqual([tool["function"]["name"] for tool in first["tools"]], ["search_flights", "search_places"])
+        assistant, result = second["messages"][-2:]
+        call = assistant["tool_calls"][0]
+        self.assertEqual(call["function"]["name"], "search_places")
+        self.assertEqual(json.loads(call["function"]["arguments"]), {"query": "Can you find good restaurants in Boston?"})
+        self.assertEqual((result["role"], result["tool_call_id"]), ("tool", call["id"]))
+
+        history = self.history()
+        self.assertEqual([message.sender for message in history], ["user", "assistant", "assistant"])
+        self.assertEqual(history[1].tool_result["tool"], "search_places")
+        self.assertEqual(history[-1].content, reply)
+
+    def test_direct_replies_take_one_call(self):
+        reply = self.agent.process_user_input("Thanks, that helps a lot!")
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual([message.content for message in self.history()], ["Thanks, that helps a lot!", reply])
+
+    def test_stream_reports_the_tool_calls(self):
+        events = list(self.agent.process_user_input_stream("What museums should I visit in Rome?"))
+        names = [event["event"] for event in events]
+        self.assertEqual(names[:3], ["routing", "tool_started", "tool_finished"])
+        self.assertEqual(events[1]["tool"], "search_places")
+        self.assertEqual(names[-1], "done")
+
+
+class ToolArgumentTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.agent = fake_agent()
+
+    def test_tool_identification_replies_are_parsed_as_json(self):
+        self.assertEqual(self.agent._parse_tool_response('{"tool": "search_places"}'), "search_places")
+        for reply in ["{}", '{"tool": null}', '{"tool": 3}']:
+            with self.subTest(reply=reply):
+                self.assertIsNone(self.agent._parse_tool_response(reply))
+        # Malformed replies are logged, and never evaluated
+        for reply in ["search_places", "[1]", "{'tool': __import__('os').getpid()}"]:
+            with self.subTest(reply=reply), self.assertLogs("utils.agent", "WARNING"):
+                self.assertIsNone(self.agent._parse_tool_response(reply))
+
+    def test_malformed_arguments_fall_back_to_the_user_input(self):
+        call = {"arguments": "{query: pizza"}
+        self.assertEqual(self.agent._parse_tool_arguments(call, "pizza in Rome"), {"query": "pizza in Rome"})
+        self.assertEqual(self.agent._parse_tool_arguments({"arguments": '"pizza"'}, "pizza"), {"query": "pizza"})
+
+    def test_arguments_are_checked_against_the_tool_parameters(self):
+        tool_info = self.agent.tool_registry["search_flights"]
+        arguments, error = self.agent._check_tool_arguments(
+            "search_flights", tool_info,
+            {"origin": "BOS", "destination": "LHR", "departure_date": "2026-12-01", "adults": 1, "cabin": "first"},
+        )
+        self.assertNotIn("cabin", arguments)
+        self.assertIsNone(error)
+
+        arguments, error = self.agent._check_tool_arguments("search_flights", tool_info, {"origin": "BOS"})
+        self.assertEqual(error["error"], "Missing arguments: destination, departure_date, adults")
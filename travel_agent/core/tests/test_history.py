@@ -0,0 +1,45 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from travel_agent.core.models import Conversation, ConversationMessage
+
+
+class HistoryPagingTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create()
+        # Created in one statement, so most rows share their created_at: pages must break ties on id
+        ConversationMessage.objects.bulk_create([
+            ConversationMessage(conversation=self.conversation, sender="user", content=f"message {i}")
+            for i in range(25)
+        ])
+        self.ids = list(
+            ConversationMessage.objects.filter(conversation=self.conversation).order_by("created_at", "id")
+            .values_list("id", flat=True)
+        )
+
+    def test_pages_backwards_without_gaps_or_repeats(self):
+        pages, before = [], None
+        while True:
+            rows = ConversationMessage.objects.history(self.conversation, limit=10, before=before)
+            if not rows:
+                break
+            pages.append([row.id for row in rows])
+            before = rows[0].id
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([i for page in reversed(pages) for i in page], self.ids)
+
+    def test_pages_forwards_from_after(self):
+        rows = ConversationMessage.objects.history(self.conversation, limit=5, after=self.ids[9])
+        self.assertEqual([row.id for row in rows], self.ids[10:15])
+
+    def test_history_view_pages(self):
+        url = reverse("history")
+        session_id = str(self.conversation.session_id)
+        first = self.client.get(url, {"session_id": session_id, "limit": 20}).json()
+        self.assertEqual([m["id"] for m in first["messages"]], self.ids[5:])
+        self.assertEqual(first["next_before"], self.ids[5])
+        self.assertFalse(first["messages"][0]["is_tool_result"])
+
+        second = self.client.get(url, {"session_id": session_id, "limit": 20, "before": first["next_before"]}).json()
+        self.assertEqual([m["id"] for m in second["messages"]], self.ids[:5])
+        self.assertIsNone(second["next_before"])
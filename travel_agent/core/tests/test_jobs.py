@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from travel_agent.core.models import Job
+from utils.jobs import JobWorker, job_handler
+
+
+@job_handler("test_failing")
+def failing_job(job):
+    raise RuntimeError("upstream unavailable")
+
+
+class JobQueueTests(TestCase):
+    def make_job(self, **fields):
+        return Job.objects.create(kind="test", payload={}, **fields)
+
+    def test_claim_leases_due_jobs_once(self):
+        job = self.make_job()
+        self.make_job(run_at=timezone.now() + timedelta(minutes=5))  # Not due yet
+
+        claimed = Job.objects.claim("w1", lease_seconds=60)
+        self.assertEqual([c.pk for c in claimed], [job.pk])
+        self.assertEqual((claimed[0].status, claimed[0].worker, claimed[0].attempts), (Job.RUNNING, "w1", 1))
+        self.assertEqual(Job.objects.claim("w2", lease_seconds=60), [])
+
+    def test_claim_filters_kinds(self):
+        self.make_job()
+        self.assertEqual(Job.objects.claim("w1", lease_seconds=60, kinds=["other"]), [])
+        self.assertEqual(len(Job.objects.claim("w1", lease_seconds=60, kinds=["test"])), 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = self.make_job()
+        [first] = Job.objects.claim("w1", lease_seconds=60)
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        [second] = Job.objects.claim("w2", lease_seconds=60)
+        self.assertEqual((second.worker, second.attempts), ("w2", 2))
+
+        # The first worker lost the lease: its outcome is ignored and its instance left as it was
+        self.assertFalse(first.complete({"rows": []}))
+        self.assertEqual(first.status, Job.RUNNING)
+        self.assertTrue(second.complete({"rows": []}))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (Job.SUCCEEDED, "w2"))
+
+    def test_expired_lease_without_attempts_left_fails(self):
+        job = self.make_job(max_attempts=1)
+        Job.objects.claim("w1", lease_seconds=60)
+        Job.objects.filter(pk=job.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(Job.objects.claim("w2", lease_seconds=60), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_fail_requeues_with_delay_until_out_of_attempts(self):
+        job = self.make_job(max_attempts=2)
+        [claimed] = Job.objects.claim("w1", lease_seconds=60)
+        self.assertTrue(claimed.fail("boom", retry_delay=30))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), (Job.QUEUED, "boom"))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(Job.objects.claim("w1", lease_seconds=60), [])  # Backing off
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        [claimed] = Job.objects.claim("w1", lease_seconds=60)
+        self.assertTrue(claimed.fail("boom again", retry_delay=30))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_worker_backs_off_exponentially(self):
+        job = Job.objects.create(kind="test_failing", payload={}, attempts=1, max_attempts=5)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+        worker = JobWorker(name="w1", lease_seconds=60)
+        worker.retry_delay = 10
+
+        delays = []
+        for _ in range(2):
+            [claimed] = Job.objects.claim("w1", lease_seconds=60)
+            started = timezone.now()
+            worker.execute(claimed)
+            job.refresh_from_db()
+            delays.append((job.run_at - started).total_seconds())
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        # Attempts 2 and 3 wait RETRY_DELAY * 2 and * 4
+        self.assertAlmostEqual(delays[0], 20, delta=1)
+        self.assertAlmostEqual(delays[1], 40, delta=1)
@@ -0,0 +1,94 @@
+import threading
+import time
+import uuid
+
+from django.test import SimpleTestCase
+
+from utils.persistence import MessageWriter
+from utils.stores import InMemoryConversationStore, Message
+
+
+class FlakyStore(InMemoryConversationStore):
+    """
+    In-memory store whose writes fail while they include a message with content in `failing`,
+    or for the first `failures` writes.
+    """
+
+    def __init__(self, failing=(), failures=0):
+        super().__init__()
+        self.failing = set(failing)
+        self.failures = failures
+        self.attempts = 0
+
+    def append_messages(self, messages):
+        self.attempts += 1
+        if self.failures or self.failing.intersection(message.content for message in messages):
+            self.failures = max(self.failures - 1, 0)
+            raise RuntimeError("database is locked")
+        super().append_messages(messages)
+
+
+class MessageWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.store = FlakyStore()
+        self.first = self.store.create_conversation(uuid.uuid4())
+        self.second = self.store.create_conversation(uuid.uuid4())
+
+    def batch(self, conversation_id, *contents):
+        return [Message(conversation_id, "user", content) for content in contents]
+
+    def contents(self, conversation_id):
+        return [message.content for message in self.store.history(conversation_id)]
+
+    def test_sync_write_sets_ids_before_returning(self):
+        saved = []
+        MessageWriter(durability="sync").write(self.batch(self.first, "hi", "hello"), saved.extend, self.store)
+        self.assertEqual(self.contents(self.first), ["hi", "hello"])
+        self.assertTrue(all(message.id is not None for message in saved))
+
+    def test_async_write_flushes_in_order_on_drain(self):
+        writer = MessageWriter(durability="async")
+        saved = []
+        for i in range(5):
+            writer.write(self.batch(self.first, f"q{i}", f"a{i}"), saved.extend, self.store)
+        writer.drain()
+        self.assertEqual(self.contents(self.first), [f"{kind}{i}" for i in range(5) for kind in "qa"])
+        self.assertEqual(len(saved), 10)
+        self.assertFalse(writer.has_pending(self.first))
+
+    def test_failed_write_is_retried(self):
+        self.store.failures = 2
+        writer = MessageWriter(durability="async", retries=3, retry_delay=0.001)
+        writer.write(self.batch(self.first, "hi"), store=self.store)
+        writer.drain()
+        self.assertEqual(self.contents(self.first), ["hi"])
+        self.assertEqual(self.store.attempts, 3)
+
+    def test_dropped_batch_drops_the_conversations_later_batches(self):
+        self.store.failing = {"broken"}
+        writer = MessageWriter(durability="async", retries=1, retry_delay=0.001)
+        gate = threading.Event()
+        # Hold the flusher so the batches below are written as one group
+        writer.write([Message(self.second, "user", "first")], lambda messages: gate.wait(), self.store)
+        writer.write(self.batch(self.first, "q1", "broken"), store=self.store)
+        writer.write(self.batch(self.second, "q2"), store=self.store)
+        writer.write(self.batch(self.first, "q3"), store=self.store)
+        gate.set()
+        writer.drain()
+        self.assertEqual(self.contents(self.first), [])
+        self.assertEqual(self.contents(self.second), ["first", "q2"])
+        self.assertFalse(writer.has_pending(self.first))
+
+        # Once nothing of the conversation is queued, its new batches are written again
+        writer.write(self.batch(self.first, "q4"), store=self.store)
+        writer.drain()
+        self.assertEqual(self.contents(self.first), ["q4"])
+
+    def test_retries_stop_at_the_retry_budget(self):
+        self.store.failing = {"broken"}
+        writer = MessageWriter(durability="async", retries=10, retry_delay=0.05, retry_budget=0.1)
+        started = time.monotonic()
+        writer.write(self.batch(self.first, "broken"), store=self.store)
+        writer.drain()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.store.attempts, 2)
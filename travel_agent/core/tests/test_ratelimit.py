@@ -0,0 +1,40 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from travel_agent.core.tests.helpers import wait_until
+from utils.ratelimit import ProviderLimiter, RateLimitExceeded
+
+
+class ProviderLimiterTests(SimpleTestCase):
+    def test_interactive_calls_are_granted_before_background_ones(self):
+        limiter = ProviderLimiter("test", max_concurrency=1, max_wait=2)
+        held = limiter.acquire()
+        granted = []
+
+        def call(priority):
+            with limiter.acquire(priority=priority):
+                granted.append(priority)
+
+        threads = []
+        for priority in ("background", "interactive"):
+            threads.append(threading.Thread(target=call, args=(priority,)))
+            threads[-1].start()
+            wait_until(lambda: limiter.stats()["waiting"] == len(threads))
+        held.release()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(granted, ["interactive", "background"])
+
+    def test_calls_queued_past_max_wait_are_rejected(self):
+        limiter = ProviderLimiter("test", max_concurrency=1, max_wait=0.05)
+        held = limiter.acquire()
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire()
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+        # The rejected call does not hold up the queue
+        held.release()
+        with limiter.acquire():
+            self.assertEqual(limiter.stats()["in_flight"], 1)
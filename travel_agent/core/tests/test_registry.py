@@ -0,0 +1,64 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from travel_agent.core.models import TableVersion, ToolMethod
+from travel_agent.core.signals import (
+    TOOL_REGISTRY_VERSION, bump_tool_registry_version, get_tool_registry_version,
+)
+from travel_agent.core.tests.helpers import create_places_method
+from utils import registry as registry_module
+from utils.registry import ToolRegistry, get_cached_registry
+
+
+class ToolRegistryTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        for name in ("_cached_registry", "_cached_version"):
+            patch = mock.patch.object(registry_module, name, None)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_cached_registry_is_reused_until_a_tool_method_changes(self):
+        registry = get_cached_registry()
+        self.assertIs(get_cached_registry(), registry)
+
+        method = ToolMethod.objects.get(name="search_places")
+        method.description = "Find places."
+        method.save()
+        rebuilt = get_cached_registry()
+        self.assertIsNot(rebuilt, registry)
+        self.assertEqual(rebuilt.get_tool_registry()["search_places"]["description"], "Find places.")
+        self.assertIn("- search_places: Find places.", rebuilt.get_tool_descriptions())
+
+        method.delete()
+        self.assertNotIn("search_places", get_cached_registry().get_tool_registry())
+
+    def test_bulk_changes_need_an_explicit_bump(self):
+        registry = get_cached_registry()
+        ToolMethod.objects.filter(name="search_places").update(description="Find places.")
+        self.assertIs(get_cached_registry(), registry)
+
+        bump_tool_registry_version()
+        self.assertEqual(get_cached_registry().get_tool_registry()["search_places"]["description"], "Find places.")
+
+    def test_version_counts_changes(self):
+        version = get_tool_registry_version()
+        TableVersion.objects.bump(TOOL_REGISTRY_VERSION)
+        TableVersion.objects.bump(TOOL_REGISTRY_VERSION)
+        self.assertEqual(get_tool_registry_version(), version + 2)
+        self.assertEqual(TableVersion.objects.current("unknown"), 0)
+
+    def test_schemas_accept_descriptions_and_full_parameter_schemas(self):
+        schemas = {schema["function"]["name"]: schema["function"] for schema in ToolRegistry().get_tool_schemas()}
+        self.assertEqual(schemas["search_places"]["parameters"], {
+            "type": "object",
+            "properties": {"query": {"type": "string", "description": "query string: e.g. pizza in New York"}},
+            "required": ["query"],
+        })
+        self.assertEqual(schemas["search_flights"]["parameters"]["properties"]["adults"]["type"], "integer")
+
+    def test_methods_of_unknown_tools_fail_validation(self):
+        ToolMethod.objects.create(name="book_hotel", description="Book a hotel.", parameters={}, tool_class="HotelTool")
+        with self.assertRaisesMessage(ValueError, "Tool class 'HotelTool' for method 'book_hotel' is not defined."):
+            ToolRegistry().get_tool_registry()
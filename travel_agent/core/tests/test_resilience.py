@@ -0,0 +1,142 @@
+import asyncio
+import threading
+
+import httpx
+import openai
+from django.test import SimpleTestCase
+
+from travel_agent.core.tests.helpers import wait_until
+from utils.resilience import LLMResilience, _hedges
+
+
+class LLMResilienceTests(SimpleTestCase):
+    def connection_error(self):
+        return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+    def rate_limit_error(self, code):
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        return openai.RateLimitError(
+            "Too many requests", response=httpx.Response(429, request=request), body={"code": code},
+        )
+
+    def flaky(self, failures, result="reply"):
+        """
+        Return a request failing with a connection error `failures` times, then returning `result`.
+        """
+        calls = []
+
+        def request(timeout):
+            calls.append(timeout)
+            if len(calls) <= failures:
+                raise self.connection_error()
+            return result
+        return request, calls
+
+    def resilience(self, **kwargs):
+        resilience = LLMResilience(**kwargs)
+        resilience.backoff_base = 0
+        return resilience
+
+    def test_retries_transient_errors(self):
+        request, calls = self.flaky(failures=2)
+        self.assertEqual(self.resilience(retry_steps=["answer"], max_attempts=3).call("answer", request), "reply")
+        self.assertEqual(len(calls), 3)
+
+    def test_gives_up_after_max_attempts(self):
+        request, calls = self.flaky(failures=3)
+        with self.assertRaises(openai.APIConnectionError):
+            self.resilience(retry_steps=["answer"], max_attempts=3).call("answer", request)
+        self.assertEqual(len(calls), 3)
+
+    def test_steps_not_retried_fail_at_once(self):
+        request, calls = self.flaky(failures=1)
+        with self.assertRaises(openai.APIConnectionError):
+            self.resilience(retry_steps=[], max_attempts=3).call("routing", request)
+        self.assertEqual(len(calls), 1)
+
+    def test_retries_rate_limits_but_not_exhausted_quota(self):
+        resilience = self.resilience(retry_steps=["answer"], max_attempts=3)
+        for code, attempts in [("rate_limit_exceeded", 3), ("insufficient_quota", 1)]:
+            calls = []
+
+            def request(timeout):
+                calls.append(timeout)
+                raise self.rate_limit_error(code)
+
+            with self.subTest(code=code), self.assertRaises(openai.RateLimitError):
+                resilience.call("answer", request)
+            self.assertEqual(len(calls), attempts)
+
+    def test_hedge_wins_over_a_slow_request(self):
+        resilience = self.resilience(retry_steps=[], hedge_steps=["answer"], min_samples=1)
+        resilience._latencies(("answer", False)).observe(0.01)
+        release = threading.Event()
+        calls = []
+
+        def request(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(2)
+                return "primary"
+            return "hedge"
+
+        won = _hedges.value(step="answer", outcome="won")
+        discarded = []
+        try:
+            self.assertEqual(resilience.call("answer", request, on_discard=discarded.append), "hedge")
+            self.assertEqual(discarded, [])
+        finally:
+            release.set()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(_hedges.value(step="answer", outcome="won"), won + 1)
+        # The slow request still finishes, and its reply is handed over for its usage
+        wait_until(lambda: discarded == ["primary"])
+
+    def test_async_hedge_lets_the_slow_request_finish(self):
+        resilience = self.resilience(retry_steps=[], hedge_steps=["answer"], min_samples=1)
+        resilience._latencies(("answer", False)).observe(0.01)
+        discarded = []
+
+        async def main():
+            calls = []
+            release = asyncio.Event()
+
+            async def request(timeout):
+                calls.append(timeout)
+                if len(calls) == 1:
+                    await release.wait()
+                    return "primary"
+                return "hedge"
+
+            result = await resilience.acall("answer", request, on_discard=discarded.append)
+            self.assertEqual(discarded, [])
+            release.set()
+            for _ in range(3):
+                await asyncio.sleep(0)
+            return result
+
+        self.assertEqual(asyncio.run(main()), "hedge")
+        self.assertEqual(discarded, ["primary"])
+
+    def test_cancelled_hedged_call_cancels_both_requests(self):
+        resilience = self.resilience(retry_steps=[], hedge_steps=["answer"], min_samples=1)
+        resilience._latencies(("answer", False)).observe(0.01)
+        cancelled = []
+
+        async def request(timeout):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def main():
+            task = asyncio.ensure_future(resilience.acall("answer", request))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0)
+
+        asyncio.run(main())
+        self.assertEqual(cancelled, [True, True])
@@ -0,0 +1,101 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from utils.benchmark import FakeChatGPT, Latency
+from utils.response_cache import ResponseCache
+
+POLICIES = {
+    "routing": {"TTL": 60, "THRESHOLD": 0.5, "HISTORY_TAIL": 1, "STATELESS_ONLY": False},
+    "answer": {"TTL": 60, "THRESHOLD": 1.0, "HISTORY_TAIL": 1, "STATELESS_ONLY": True},
+}
+
+
+def user(content):
+    return [{"role": "user", "content": content}]
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache(enabled=True, max_entries=4, dimensions=256, policies=POLICIES)
+
+    def remember(self, step, prompt, history, value, **kwargs):
+        lookup = self.cache.lookup(step, prompt, history, **kwargs)
+        self.assertFalse(lookup.hit)
+        lookup.store(value)
+
+    def test_exact_hit_ignores_case_punctuation_and_stopwords(self):
+        self.remember("routing", "prompt", user("Pizza in New York?"), "search_places")
+        lookup = self.cache.lookup("routing", "prompt", user("pizza  in new york"))
+        self.assertTrue(lookup.hit)
+        self.assertEqual(lookup.value, "search_places")
+
+    def test_semantic_hit_above_the_threshold(self):
+        self.remember("routing", "prompt", user("best pizza restaurants in new york"), "search_places")
+        self.assertTrue(self.cache.lookup("routing", "prompt", user("best pizza restaurants in new york city")).hit)
+        self.assertFalse(self.cache.lookup("routing", "prompt", user("museums open late in paris")).hit)
+
+    def test_threshold_of_one_disables_semantic_hits(self):
+        self.remember("answer", "prompt", user("best pizza restaurants in new york"), "Try Joe's.")
+        self.assertFalse(self.cache.lookup("answer", "prompt", user("best pizza restaurants in new york city")).hit)
+        self.assertTrue(self.cache.lookup("answer", "prompt", user("best pizza restaurants in new york")).hit)
+
+    def test_prompt_and_extra_scope_the_entries(self):
+        self.remember("routing", "prompt", user("pizza in new york"), "search_places")
+        self.assertFalse(self.cache.lookup("routing", "other prompt", user("pizza in new york")).hit)
+        self.assertFalse(self.cache.lookup("routing", "prompt", user("pizza in new york"), extra={"type": "json"}).hit)
+        self.assertFalse(self.cache.lookup("answer", "prompt", user("pizza in new york")).hit)
+
+    def test_steps_without_a_policy_and_a_disabled_cache_are_not_cached(self):
+        lookup = self.cache.lookup("summary", "prompt", user("pizza"))
+        lookup.store("value")
+        self.assertFalse(self.cache.lookup("summary", "prompt", user("pizza")).hit)
+        self.assertFalse(self.cache.lookup(None, "prompt", user("pizza")).hit)
+
+        disabled = ResponseCache(enabled=False, policies=POLICIES)
+        disabled.lookup("routing", "prompt", user("pizza")).store("value")
+        self.assertFalse(disabled.lookup("routing", "prompt", user("pizza")).hit)
+
+    def test_stateless_only_bypasses_conversations(self):
+        history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}] + user("pizza")
+        self.cache.lookup("answer", "prompt", history).store("value")
+        self.assertFalse(self.cache.lookup("answer", "prompt", history).hit)
+        self.assertFalse(self.cache.lookup("answer", "prompt", user("pizza")).hit)
+
+    def test_entries_expire_after_their_ttl(self):
+        with mock.patch("utils.response_cache.time.monotonic", return_value=1000.0):
+            self.remember("routing", "prompt", user("pizza in new york"), "search_places")
+        with mock.patch("utils.response_cache.time.monotonic", return_value=1059.0):
+            self.assertTrue(self.cache.lookup("routing", "prompt", user("pizza in new york")).hit)
+        with mock.patch("utils.response_cache.time.monotonic", return_value=1061.0):
+            self.assertFalse(self.cache.lookup("routing", "prompt", user("pizza in new york")).hit)
+            self.assertFalse(self.cache.lookup("routing", "prompt", user("pizza in new york city")).hit)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for city in ("boston", "denver", "austin", "seattle"):
+            self.remember("answer", "prompt", user(f"pizza in {city}"), city)
+        self.assertTrue(self.cache.lookup("answer", "prompt", user("pizza in boston")).hit)
+        self.remember("answer", "prompt", user("pizza in chicago"), "chicago")
+        self.assertFalse(self.cache.lookup("answer", "prompt", user("pizza in denver")).hit)
+        for city in ("boston", "austin", "seattle", "chicago"):
+            self.assertTrue(self.cache.lookup("answer", "prompt", user(f"pizza in {city}")).hit)
+
+    def test_evicted_rows_are_reused_for_semantic_matching(self):
+        for i in range(10):
+            self.remember("routing", "prompt", user(f"query number {i} about topic {i}"), i)
+        self.assertEqual(len(self.cache._row_keys), 4)
+        lookup = self.cache.lookup("routing", "prompt", user("query number 9 about topic 9 please"))
+        self.assertEqual((lookup.hit, lookup.value), (True, 9))
+
+
+class ChatGPTResponseCacheTests(SimpleTestCase):
+    def test_cached_reply_skips_the_api(self):
+        cache = ResponseCache(enabled=True, policies=POLICIES)
+        llm = FakeChatGPT(latency=Latency(), response_cache=cache)
+        first = llm.query("prompt", user("pizza in new york"), cache_step="answer")
+        second = llm.query("prompt", user("Pizza in New York!"), cache_step="answer")
+        self.assertEqual(first, second)
+        self.assertEqual(len(llm.completions.calls), 1)
+
+        llm.query("prompt", user("pizza in new york"))  # No step: never cached
+        self.assertEqual(len(llm.completions.calls), 2)
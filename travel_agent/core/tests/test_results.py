@@ -0,0 +1,82 @@
+from django.test import SimpleTestCase
+
+from utils.results import ToolResultEncoder, is_tool_result, tool_error, tool_result
+
+ROWS = [
+    {"name": f"Cafe {i}", "rating": 4.5 - i / 10, "open_now": i % 2 == 0, "types": ["cafe", "bakery"]}
+    for i in range(8)
+]
+
+
+class ToolResultTests(SimpleTestCase):
+    def test_total_defaults_to_the_row_count(self):
+        self.assertEqual(tool_result("search_places", ROWS[:3])["total"], 3)
+        self.assertEqual(tool_result("search_places", ROWS[:3], total=40)["total"], 40)
+
+    def test_has_more_leaves_the_total_unknown(self):
+        result = tool_result("search_places", ROWS[:3], has_more=True)
+        self.assertIsNone(result["total"])
+        self.assertTrue(result["has_more"])
+
+    def test_is_tool_result(self):
+        self.assertTrue(is_tool_result(tool_result("search_places", [])))
+        self.assertTrue(is_tool_result(tool_error("search_places", "timeout")))
+        self.assertFalse(is_tool_result("Found 3 places"))
+        self.assertFalse(is_tool_result({"rows": []}))
+
+
+class ToolResultEncoderTests(SimpleTestCase):
+    def setUp(self):
+        self.encoder = ToolResultEncoder(top_k=3, max_stored_rows=5, fields={})
+        self.result = tool_result("search_places", ROWS, total=20, query="coffee in Boston")
+
+    def test_encodes_a_table_of_the_top_rows(self):
+        lines = self.encoder.encode(self.result).split("\n")
+        self.assertEqual(lines[0], "search_places(query=coffee in Boston): 3 of 20 results")
+        self.assertEqual(lines[1], "name|rating|open_now|types")
+        self.assertEqual(lines[2], "Cafe 0|4.5|yes|cafe,bakery")
+        self.assertEqual(lines[3], "Cafe 1|4.4|no|cafe,bakery")
+        self.assertEqual(len(lines), 5)
+
+    def test_top_k_can_be_overridden_per_call(self):
+        self.assertEqual(len(self.encoder.encode(self.result, top_k=1).split("\n")), 3)
+
+    def test_projects_the_configured_fields(self):
+        encoder = ToolResultEncoder(top_k=2, fields={"search_places": ["name", "rating"]})
+        lines = encoder.encode(self.result).split("\n")
+        self.assertEqual(lines[1:], ["name|rating", "Cafe 0|4.5", "Cafe 1|4.4"])
+
+    def test_escapes_separators_and_newlines(self):
+        result = tool_result("search_places", [{"name": "Tea | Coffee\nBar", "rating": None}])
+        self.assertEqual(self.encoder.encode(result).split("\n")[2], "Tea / Coffee Bar|")
+
+    def test_columns_cover_every_row(self):
+        result = tool_result("search_places", [{"name": "A"}, {"name": "B", "phone": "555"}])
+        self.assertEqual(self.encoder.encode(result).split("\n")[1:], ["name|phone", "A|", "B|555"])
+
+    def test_unknown_total(self):
+        result = tool_result("search_places", ROWS[:2], has_more=True)
+        self.assertEqual(self.encoder.encode(result).split("\n")[0], "search_places: 2 results, more available")
+
+    def test_empty_and_failed_results(self):
+        self.assertEqual(self.encoder.encode(tool_result("search_places", [], query="x")), "search_places(query=x): no results")
+        self.assertEqual(
+            self.encoder.encode(tool_error("search_places", "timeout", query="x")),
+            "search_places(query=x): error: timeout",
+        )
+
+    def test_plain_results_are_returned_as_text(self):
+        self.assertEqual(self.encoder.encode("Found 3 places"), "Found 3 places")
+
+    def test_trim_keeps_max_stored_rows(self):
+        trimmed = self.encoder.trim(self.result)
+        self.assertEqual(trimmed["rows"], ROWS[:5])
+        self.assertEqual(trimmed["total"], 20)
+        self.assertEqual(len(self.result["rows"]), 8)  # The original is left alone
+        small = tool_result("search_places", ROWS[:2])
+        self.assertIs(self.encoder.trim(small), small)
+
+    def test_summarize(self):
+        self.assertEqual(self.encoder.summarize(self.result), "Tool result: search_places (8 of 20 results)")
+        self.assertEqual(self.encoder.summarize(tool_error("search_places", "timeout")), "Tool result: search_places failed")
+        self.assertEqual(self.encoder.summarize("raw"), "Tool result: raw")
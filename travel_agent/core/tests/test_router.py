@@ -0,0 +1,114 @@
+from django.test import SimpleTestCase, TestCase
+
+from travel_agent.core.models import RoutingDecision
+from utils.router import NO_TOOL, ToolRouter, fit_router_model, routing_features
+
+TOOLS = {
+    "search_places": "Search for places such as restaurants, museums and hotels.",
+    "search_flights": "Search flight offers between two airports on a given date.",
+}
+CITIES = ["boston", "denver", "austin", "seattle", "chicago"]
+EXAMPLES = (
+    [(f"best pizza restaurants in {city}", "", "search_places") for city in CITIES]
+    + [(f"museums to visit in {city}", "", "search_places") for city in CITIES]
+    + [(f"cheap flights from {city} to london", "", "search_flights") for city in CITIES]
+    + [(f"plane tickets to {city} next week", "", "search_flights") for city in CITIES]
+    + [(phrase, "", NO_TOOL) for phrase in ("thanks", "thank you so much", "hello there", "goodbye", "ok great")]
+    + [(f"what about {city}", "best pizza restaurants in boston", "search_places") for city in CITIES]
+)
+
+
+def trained_router(**kwargs):
+    router = ToolRouter(**{"enabled": True, "recording": False, "threshold": 0.5, "min_examples": 10, **kwargs})
+    router.model = fit_router_model(TOOLS, EXAMPLES, keywords={})
+    return router
+
+
+class RouterModelTests(SimpleTestCase):
+    def test_routing_features_mark_the_context(self):
+        self.assertEqual(
+            routing_features("What about Denver?", "pizza in Boston"),
+            ["what", "about", "denver", "what about", "about denver", "prev:pizza", "prev:boston", "prev:pizza boston"],
+        )
+
+    def test_predicts_the_tool_of_similar_messages(self):
+        model = fit_router_model(TOOLS, EXAMPLES, keywords={})
+        self.assertEqual(model.predict("pizza restaurants in miami")[0], "search_places")
+        self.assertEqual(model.predict("cheap flights to miami")[0], "search_flights")
+        self.assertEqual(model.predict("thank you")[0], NO_TOOL)
+
+    def test_follow_ups_are_routed_like_their_context(self):
+        model = fit_router_model(TOOLS, EXAMPLES, keywords={})
+        self.assertEqual(model.predict("what about miami", "best pizza restaurants in boston")[0], "search_places")
+
+    def test_unknown_messages_have_no_prediction(self):
+        model = fit_router_model(TOOLS, EXAMPLES, keywords={})
+        self.assertEqual(model.predict("zzz qqq"), (None, 0.0))
+
+    def test_examples_of_removed_tools_are_ignored(self):
+        model = fit_router_model(TOOLS, EXAMPLES + [("rent a car in boston", "", "search_cars")], keywords={})
+        self.assertNotIn("search_cars", model.labels)
+        self.assertEqual(model.examples, len(EXAMPLES))
+
+    def test_keywords_seed_the_labels(self):
+        model = fit_router_model({"search_places": TOOLS["search_places"]}, [], keywords={"none": ["thanks"]})
+        self.assertEqual(model.labels, [NO_TOOL, "search_places"])
+        self.assertEqual(model.predict("thanks")[0], NO_TOOL)
+
+    def test_nothing_to_choose_between(self):
+        self.assertIsNone(fit_router_model({"search_places": TOOLS["search_places"]}, [], keywords={}))
+
+
+class ToolRouterTests(SimpleTestCase):
+    def test_confident_decisions_are_local(self):
+        decided, tool, confidence = trained_router().route("pizza restaurants in miami", TOOLS)
+        self.assertEqual((decided, tool), (True, "search_places"))
+        self.assertGreaterEqual(confidence, 0.5)
+        self.assertEqual(trained_router().route("thank you", TOOLS)[:2], (True, None))
+
+    def test_decisions_below_the_threshold_fall_back(self):
+        router = trained_router()
+        _, _, confidence = router.route("pizza restaurants in miami", TOOLS)
+        router.threshold = confidence + 0.01
+        self.assertEqual(router.route("pizza restaurants in miami", TOOLS), (False, None, confidence))
+
+    def test_too_few_examples_fall_back(self):
+        self.assertFalse(trained_router(min_examples=len(EXAMPLES) + 1).route("pizza restaurants in miami", TOOLS)[0])
+
+    def test_disabled_router_never_decides(self):
+        router = trained_router()
+        router.enabled = False
+        self.assertEqual(router.route("pizza restaurants in miami", TOOLS), (False, None, 0.0))
+        self.assertEqual(router.predict("pizza restaurants in miami", TOOLS), (None, 0.0))
+
+    def test_changed_tools_fall_back_until_retrained(self):
+        router = trained_router()
+        router._start_worker = lambda: None  # Training is covered by ToolRouterLoggingTests
+        tools = {**TOOLS, "search_cars": "Rent a car."}
+        self.assertFalse(router.route("pizza restaurants in miami", tools)[0])
+        self.assertTrue(router._retrain)
+        self.assertEqual(router.predict("pizza restaurants in miami", tools), (None, 0.0))
+
+
+class ToolRouterLoggingTests(TestCase):
+    def test_llm_decisions_are_logged_and_trained_on(self):
+        router = ToolRouter(enabled=True, threshold=0.5, min_examples=10, log_batch=1000, retrain_every=1000)
+        for text, context, tool in EXAMPLES:
+            router.record(text, tool or None, "llm", context=context)
+        router.flush()
+        self.assertEqual(RoutingDecision.objects.filter(source="llm").count(), len(EXAMPLES))
+
+        router.train(TOOLS)
+        self.assertEqual(router.model.examples, len(EXAMPLES))
+        decided, tool, _ = router.route("museums to visit in miami", TOOLS)
+        self.assertEqual((decided, tool), (True, "search_places"))
+        router.flush()
+        local = RoutingDecision.objects.get(source="local")
+        self.assertEqual((local.text, local.tool), ("museums to visit in miami", "search_places"))
+        self.assertIsNotNone(local.confidence)
+
+    def test_nothing_is_logged_without_recording(self):
+        router = ToolRouter(enabled=False, recording=False)
+        router.record("pizza in boston", "search_places", "llm")
+        router.flush()
+        self.assertFalse(RoutingDecision.objects.exists())
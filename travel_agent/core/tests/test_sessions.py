@@ -0,0 +1,107 @@
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from travel_agent.core.tests.helpers import create_places_method, fake_agent, fake_llm
+from utils.sessions import AgentSessionCache, _events
+
+
+class FakeAgent:
+    def __init__(self):
+        self.refreshes = []
+
+    def refresh(self, check_history=True, llm=None):
+        self.refreshes.append((check_history, llm))
+
+
+class AgentSessionCacheTests(SimpleTestCase):
+    def checkout(self, sessions, session_id, llm=None):
+        with sessions.checkout(session_id, FakeAgent, llm=llm) as agent:
+            return agent
+
+    def test_hits_reuse_and_refresh_the_agent(self):
+        sessions = AgentSessionCache("test-hits", verify=True)
+        hits = _events.value(cache="test-hits", event="hit")
+        agent = self.checkout(sessions, "a")
+        self.assertEqual(agent.refreshes, [])
+
+        llm = object()
+        self.assertIs(self.checkout(sessions, "a", llm=llm), agent)
+        self.assertEqual(agent.refreshes, [(True, llm)])
+        self.assertEqual(_events.value(cache="test-hits", event="hit"), hits + 1)
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        sessions = AgentSessionCache("test", max_sessions=2)
+        first = self.checkout(sessions, "a")
+        self.checkout(sessions, "b")
+        self.checkout(sessions, "a")
+        self.checkout(sessions, "c")  # Evicts b
+        self.assertIs(self.checkout(sessions, "a"), first)
+        self.assertEqual(sessions._entries.keys(), {"a", "c"})
+
+    def test_idle_sessions_are_evicted(self):
+        sessions = AgentSessionCache("test", idle_timeout=60)
+        with mock.patch("utils.sessions.time.monotonic", return_value=1000.0):
+            agent = self.checkout(sessions, "a")
+        with mock.patch("utils.sessions.time.monotonic", return_value=1061.0):
+            self.assertIsNot(self.checkout(sessions, "a"), agent)
+
+    def test_a_failed_turn_drops_the_agent(self):
+        sessions = AgentSessionCache("test")
+        agent = self.checkout(sessions, "a")
+        with self.assertRaises(RuntimeError), sessions.checkout("a", FakeAgent):
+            raise RuntimeError("LLM call failed")
+        self.assertIsNot(self.checkout(sessions, "a"), agent)
+
+    def test_sessions_in_use_are_not_evicted(self):
+        sessions = AgentSessionCache("test", max_sessions=1)
+        with sessions.checkout("a", FakeAgent) as agent:
+            # b is the most recently used session, but the only one not in use
+            self.checkout(sessions, "b")
+            self.assertEqual(list(sessions._entries), ["a"])
+        self.assertIs(self.checkout(sessions, "a"), agent)
+
+    def test_turns_of_a_session_are_serialized_on_one_agent(self):
+        sessions = AgentSessionCache("test")
+        built, inside, overlaps = [], [], []
+
+        def factory():
+            built.append(1)
+            time.sleep(0.01)
+            return FakeAgent()
+
+        def turn():
+            with sessions.checkout("a", factory) as agent:
+                if inside:
+                    overlaps.append(1)
+                inside.append(agent)
+                time.sleep(0.005)
+                inside.remove(agent)
+
+        threads = [threading.Thread(target=turn) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(built), overlaps), (1, []))
+
+
+class CachedAgentTests(TestCase):
+    def test_cached_agent_sees_messages_written_by_other_workers(self):
+        create_places_method()
+        session_id = uuid.uuid4()
+        sessions = AgentSessionCache("test", verify=True)
+        with sessions.checkout(session_id, lambda: fake_agent(session_id=session_id)) as agent:
+            agent.process_user_input("Thanks, that helps a lot!")
+
+        # Another worker answers a turn of the same session
+        fake_agent(session_id=session_id).process_user_input("Is Lisbon expensive for tourists?")
+
+        llm = fake_llm()
+        with sessions.checkout(session_id, lambda: fake_agent(session_id=session_id), llm=llm) as cached:
+            self.assertIs(cached, agent)
+            self.assertIs(cached.llm, llm)
+            self.assertEqual(len(cached.conversation_history), 4)
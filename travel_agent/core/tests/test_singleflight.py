@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+from django.test import SimpleTestCase
+
+from travel_agent.core.tests.helpers import wait_until
+from utils.singleflight import SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_waiters_share_the_leaders_result(self):
+        group = SingleFlight("test", enabled=True)
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait(2)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(group.do("key", call))) for _ in range(3)]
+        threads[0].start()
+        wait_until(lambda: calls)
+        for thread in threads[1:]:
+            thread.start()
+        wait_until(lambda: group.stats()["coalesced"] == 2)
+        release.set()
+        for thread in threads:
+            thread.join(2)
+
+        self.assertEqual(results, ["result"] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(group.stats()["in_flight"], 0)
+
+    def test_waiters_share_the_leaders_error(self):
+        group = SingleFlight("test", enabled=True)
+
+        async def main():
+            started = asyncio.Event()
+
+            async def failing():
+                started.set()
+                await asyncio.sleep(0.05)
+                raise ValueError("boom")
+
+            leader = asyncio.ensure_future(group.ado("key", failing))
+            await started.wait()
+            waiter = asyncio.ensure_future(group.ado("key", failing))
+            return await asyncio.gather(leader, waiter, return_exceptions=True)
+
+        leader, waiter = asyncio.run(main())
+        self.assertIsInstance(leader, ValueError)
+        self.assertIs(waiter, leader)
+
+    def test_waiter_takes_over_when_the_leader_is_cancelled(self):
+        group = SingleFlight("test", enabled=True)
+
+        async def main():
+            started = asyncio.Event()
+
+            async def slow():
+                started.set()
+                await asyncio.sleep(10)
+                return "leader"
+
+            async def fast():
+                return "waiter"
+
+            leader = asyncio.ensure_future(group.ado("key", slow))
+            await started.wait()
+            waiter = asyncio.ensure_future(group.ado("key", fast))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await waiter, leader.cancelled()
+
+        self.assertEqual(asyncio.run(main()), ("waiter", True))
+        self.assertEqual(group.stats()["in_flight"], 0)
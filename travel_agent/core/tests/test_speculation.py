@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, TestCase
+
+from travel_agent.core.tests.helpers import create_places_method, fake_agent
+from utils.speculation import Speculation, ToolSpeculator, _outcomes
+
+TOOLS = {"search_places": "Search for places.", "search_flights": "Search flights."}
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def outcomes(tool="search_places"):
+    return {outcome: _outcomes.value(tool=tool, outcome=outcome) for outcome in ("hit", "wasted", "cancelled")}
+
+
+def predicting(tool, confidence):
+    return SimpleNamespace(predict=lambda text, tools, context="": (tool, confidence))
+
+
+class ChooseTests(SimpleTestCase):
+    def test_disabled_speculator_never_speculates(self):
+        speculator = ToolSpeculator(enabled=False, policy="always", tools=["search_places"])
+        self.assertIsNone(speculator.choose("pizza in boston", TOOLS, predicting("search_places", 1.0)))
+
+    def test_always_policy_picks_the_first_available_tool(self):
+        speculator = ToolSpeculator(enabled=True, policy="always", tools=["search_hotels", "search_places"])
+        self.assertEqual(speculator.choose("hello", TOOLS, predicting(None, 1.0)), "search_places")
+        self.assertIsNone(speculator.choose("hello", {"search_flights": ""}, predicting(None, 1.0)))
+
+    def test_router_policy_needs_a_confident_prediction_of_an_allowed_tool(self):
+        speculator = ToolSpeculator(enabled=True, policy="router", min_confidence=0.6, tools=["search_places"])
+        self.assertEqual(speculator.choose("pizza", TOOLS, predicting("search_places", 0.7)), "search_places")
+        self.assertIsNone(speculator.choose("pizza", TOOLS, predicting("search_places", 0.5)))
+        self.assertIsNone(speculator.choose("flights", TOOLS, predicting("search_flights", 0.9)))
+        self.assertIsNone(speculator.choose("thanks", TOOLS, predicting(None, 0.9)))
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            ToolSpeculator(policy="sometimes")
+
+
+class SpeculationTests(SimpleTestCase):
+    def test_claimed_result_is_a_hit(self):
+        future = Future()
+        future.set_result("places")
+        before = outcomes()
+        self.assertEqual(Speculation("search_places", "pizza", future).result(fallback=lambda: "again"), "places")
+        self.assertEqual(outcomes()["hit"], before["hit"] + 1)
+
+    def test_failed_call_runs_the_fallback(self):
+        future = Future()
+        future.set_exception(TimeoutError("Places API timed out"))
+        before = outcomes()
+        self.assertEqual(Speculation("search_places", "pizza", future).result(fallback=lambda: "again"), "again")
+        self.assertEqual(outcomes()["wasted"], before["wasted"] + 1)
+
+    def test_discard_cancels_a_pending_call(self):
+        before = outcomes()
+        future = Future()
+        Speculation("search_places", "pizza", future).discard()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(outcomes()["cancelled"], before["cancelled"] + 1)
+
+    def test_discard_of_a_finished_call_is_wasted(self):
+        before = outcomes()
+        future = Future()
+        future.set_exception(TimeoutError())
+        Speculation("search_places", "pizza", future).discard()
+        self.assertEqual(outcomes()["wasted"], before["wasted"] + 1)
+
+    def test_matches(self):
+        speculation = Speculation("search_places", "pizza", Future())
+        self.assertTrue(speculation.matches("search_places", "pizza"))
+        self.assertFalse(speculation.matches("search_places", "sushi"))
+        self.assertFalse(speculation.matches("search_flights", "pizza"))
+
+
+class SpeculateTests(SimpleTestCase):
+    def setUp(self):
+        self.speculator = ToolSpeculator(enabled=True, policy="always")
+        self.addCleanup(self.speculator.shutdown)
+
+    def test_runs_in_a_worker_thread_with_the_callers_context(self):
+        def search(query):
+            return query, request_id.get(), threading.current_thread().name
+
+        token = request_id.set("req-1")
+        try:
+            speculation = self.speculator.speculate("search_places", search, "pizza")
+        finally:
+            request_id.reset(token)
+        query, seen, thread = speculation.result(fallback=lambda: None)
+        self.assertEqual((query, seen), ("pizza", "req-1"))
+        self.assertTrue(thread.startswith("tool-speculation"))
+
+    def test_async_speculation(self):
+        async def asearch(query):
+            return f"async {query}"
+
+        async def fallback():
+            return "again"
+
+        async def run():
+            native = self.speculator.aspeculate("search_places", None, asearch, "pizza")
+            threaded = self.speculator.aspeculate("search_places", lambda query: f"sync {query}", None, "sushi")
+            return await native.aresult(fallback), await threaded.aresult(fallback)
+
+        self.assertEqual(asyncio.run(run()), ("async pizza", "sync sushi"))
+
+
+class AgentSpeculationTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.agent = fake_agent()
+        self.agent.speculator = ToolSpeculator(enabled=True, policy="always", tools=["search_places"])
+        self.addCleanup(self.agent.speculator.shutdown)
+        self.places = self.agent.tool_registry["search_places"]["method"].__self__
+
+    def test_routed_tool_uses_the_speculative_result(self):
+        before = outcomes()
+        self.agent.process_user_input("Can you find good restaurants in Boston?")
+        self.assertEqual(outcomes()["hit"], before["hit"] + 1)
+        self.assertEqual(len(self.places.calls), 1)
+        history = self.agent.store.history(self.agent.conversation_id)
+        self.assertEqual(history[1].tool_result["tool"], "search_places")
+
+    def test_turn_without_the_tool_discards_it(self):
+        before = outcomes()
+        self.agent.process_user_input("Thanks, that helps a lot!")
+        after = outcomes()
+        self.assertEqual(after["hit"], before["hit"])
+        self.assertEqual(after["wasted"] + after["cancelled"], before["wasted"] + before["cancelled"] + 1)
+        self.assertEqual(len(self.agent.store.history(self.agent.conversation_id)), 2)
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import uuid
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from travel_agent.core.models import LLMUsage
+from utils.stores import (
+    InMemoryConversationStore,
+    Message,
+    OrmConversationStore,
+    SQLiteConversationStore,
+    create_conversation_store,
+)
+
+USAGE = {"step": "respond", "tool": "", "model": "gpt-4o-mini", "prompt_tokens": 120, "completion_tokens": 30}
+
+
+class ConversationStoreContract:
+    """
+    Behavior every ConversationStore backend must share; mixed into one TestCase per backend.
+    """
+
+    def setUp(self):
+        self.store = self.make_store()
+        self.session_id = uuid.uuid4()
+        self.conversation_id = self.store.create_conversation(self.session_id)
+
+    def append(self, *contents, conversation_id=None):
+        messages = [Message(conversation_id or self.conversation_id, "user", content) for content in contents]
+        self.store.append_messages(messages)
+        return messages
+
+    def usage_rows(self):
+        return LLMUsage.objects.filter(conversation_id=self.conversation_id).count()
+
+    def test_conversations_are_looked_up_by_session(self):
+        self.assertEqual(self.store.get_conversation_id(self.session_id), self.conversation_id)
+        self.assertEqual(self.store.get_conversation_id(str(self.session_id)), self.conversation_id)
+        self.assertIsNone(self.store.get_conversation_id(uuid.uuid4()))
+        self.assertIsNone(self.store.get_conversation_id("not-a-uuid"))
+
+    def test_get_or_create_reuses_the_conversation(self):
+        self.assertEqual(self.store.get_or_create_conversation(self.session_id), self.conversation_id)
+        other = self.store.get_or_create_conversation(uuid.uuid4())
+        self.assertNotEqual(other, self.conversation_id)
+
+    def test_append_sets_ids_and_created_at_in_order(self):
+        messages = self.append("hi", "hello", "bye")
+        ids = [message.id for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(message.created_at is not None for message in messages))
+        self.assertEqual(self.store.latest_message_id(self.conversation_id), ids[-1])
+
+    def test_history_is_oldest_first_and_per_conversation(self):
+        other = self.store.create_conversation(uuid.uuid4())
+        self.append("q1", "a1")
+        self.append("elsewhere", conversation_id=other)
+        self.append("q2", "a2")
+        self.assertEqual([m.content for m in self.store.history(self.conversation_id)], ["q1", "a1", "q2", "a2"])
+        self.assertEqual([m.content for m in self.store.history(other)], ["elsewhere"])
+
+    def test_history_pages_with_limit_before_and_after(self):
+        messages = self.append(*(f"m{i}" for i in range(10)))
+        ids = [message.id for message in messages]
+        self.assertEqual([m.id for m in self.store.history(self.conversation_id, limit=3)], ids[-3:])
+        self.assertEqual([m.id for m in self.store.history(self.conversation_id, limit=3, before=ids[5])], ids[2:5])
+        self.assertEqual([m.id for m in self.store.history(self.conversation_id, limit=3, after=ids[5])], ids[6:9])
+        self.assertEqual([m.id for m in self.store.history(self.conversation_id, after=0)], ids)
+
+    def test_history_round_trips_tool_results(self):
+        result = {"flights": [{"price": "120.50", "stops": 0}]}
+        self.store.append_messages([Message(self.conversation_id, "assistant", "", tool_result=result)])
+        (message,) = self.store.history(self.conversation_id)
+        self.assertEqual(message.tool_result, result)
+
+    def test_latest_message_id_of_an_empty_conversation(self):
+        self.assertIsNone(self.store.latest_message_id(self.conversation_id))
+
+    def test_summary_only_moves_forward(self):
+        self.assertEqual(tuple(self.store.summary(self.conversation_id)), ("", None))
+        self.assertTrue(self.store.save_summary(self.conversation_id, "first", 5))
+        self.assertFalse(self.store.save_summary(self.conversation_id, "stale", 3))
+        self.assertFalse(self.store.save_summary(self.conversation_id, "same", 5))
+        self.assertEqual(tuple(self.store.summary(self.conversation_id)), ("first", 5))
+        self.assertTrue(self.store.save_summary(self.conversation_id, "second", 8))
+        self.assertEqual(tuple(self.store.summary(self.conversation_id)), ("second", 8))
+
+    def test_usage_is_written_with_its_message(self):
+        self.store.append_messages([Message(self.conversation_id, "assistant", "hello", usage=[USAGE, USAGE])])
+        self.assertEqual(self.usage_rows(), 2)
+
+    def test_async_methods_match_the_sync_ones(self):
+        messages = self.append("q1", "a1")
+
+        async def read():
+            return (
+                await self.store.aget_or_create_conversation(self.session_id),
+                await self.store.ahistory(self.conversation_id),
+                await self.store.alatest_message_id(self.conversation_id),
+                await self.store.asummary(self.conversation_id),
+            )
+
+        conversation_id, history, latest, summary = asyncio.run(read())
+        self.assertEqual(conversation_id, self.conversation_id)
+        self.assertEqual([m.id for m in history], [m.id for m in messages])
+        self.assertEqual(latest, messages[-1].id)
+        self.assertEqual(tuple(summary), ("", None))
+
+
+class InMemoryConversationStoreTests(ConversationStoreContract, SimpleTestCase):
+    def make_store(self):
+        return InMemoryConversationStore()
+
+    def usage_rows(self):
+        # The memory store keeps usage on the messages only
+        return sum(len(message.usage or []) for message in self.store.history(self.conversation_id))
+
+    def test_create_rejects_an_existing_session(self):
+        with self.assertRaises(ValueError):
+            self.store.create_conversation(self.session_id)
+
+
+class OrmConversationStoreTests(ConversationStoreContract, TransactionTestCase):
+    # Committed for real: the async methods run in another thread, which would not see a test transaction
+    serialized_rollback = True  # Restore the tools seeded by the migrations for the other tests
+
+    def make_store(self):
+        return OrmConversationStore()
+
+
+class SQLiteConversationStoreTests(ConversationStoreContract, TestCase):
+    """
+    Runs the store on a temporary database file with the schema of the (in-memory) test database.
+    """
+
+    def make_store(self):
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        self.addCleanup(os.remove, self.path)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'")
+            schema = [row[0] for row in cursor.fetchall()]
+        target = sqlite3.connect(self.path)
+        target.executescript(";\n".join(schema))
+        target.close()
+        store = SQLiteConversationStore(name=self.path)
+        self.addCleanup(store.close)
+        return store
+
+    def usage_rows(self):
+        row = self.store.connection.execute(
+            "SELECT COUNT(*) FROM core_llmusage WHERE conversation_id = ?", (self.conversation_id,)
+        ).fetchone()
+        return row[0]
+
+    def test_reads_what_the_other_connections_wrote(self):
+        messages = self.append("hi")
+        other = SQLiteConversationStore(name=self.path)
+        self.addCleanup(other.close)
+        self.assertEqual(other.get_conversation_id(self.session_id), self.conversation_id)
+        self.assertEqual([m.id for m in other.history(self.conversation_id)], [messages[0].id])
+
+    def test_failed_batch_is_rolled_back(self):
+        messages = [Message(self.conversation_id, "user", "hi"), Message(self.conversation_id, "user", None)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.store.append_messages(messages)
+        self.assertEqual(self.store.history(self.conversation_id), [])
+        self.assertIsNone(messages[0].id)
+
+
+class CreateConversationStoreTests(SimpleTestCase):
+    def test_backends(self):
+        self.assertIsInstance(create_conversation_store("memory"), InMemoryConversationStore)
+        self.assertIsInstance(create_conversation_store("orm"), OrmConversationStore)
+        with self.assertRaises(ValueError):
+            create_conversation_store("redis")
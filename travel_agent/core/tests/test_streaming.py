@@ -0,0 +1,86 @@
+import json
+import uuid
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from travel_agent.core.tests.helpers import create_places_method, fake_agent, fake_llm, fake_registry
+from utils.stores import get_conversation_store
+
+
+def parse_events(body):
+    """
+    Split a text/event-stream body into (event, data) pairs.
+    """
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class AskStreamTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.session_id = uuid.uuid4()
+        get_conversation_store().create_conversation(self.session_id)
+        self.registry = fake_registry()
+        patch = mock.patch("travel_agent.core.views.ChatGPT", fake_llm)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.patch_agent(self.build_agent)
+
+    def build_agent(self, llm, session_id):
+        return fake_agent(llm, self.registry, session_id=session_id)
+
+    def patch_agent(self, factory):
+        patch = mock.patch("travel_agent.core.views.TravelAgent", factory)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def ask(self, query, session_id=None):
+        response = self.client.post(
+            reverse("ask_stream"),
+            json.dumps({"query": query, "session_id": str(session_id or self.session_id)}),
+            content_type="application/json",
+        )
+        return response, parse_events(b"".join(response.streaming_content).decode())
+
+    def test_streams_progress_then_tokens_then_the_reply(self):
+        response, events = self.ask("Can you find good restaurants in Boston?")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        names = [name for name, _ in events]
+        self.assertEqual(names[:3], ["routing", "tool_started", "tool_finished"])
+        self.assertEqual(events[1][1], {"tool": "search_places"})
+        self.assertEqual(names[-1], "done")
+        self.assertGreater(names.count("token"), 1)
+
+        tokens = "".join(data["content"] for name, data in events if name == "token")
+        done = events[-1][1]
+        self.assertEqual(done["message"], tokens)
+        self.assertEqual(done["context"]["llm_calls"], 2)
+
+        history = get_conversation_store().history(get_conversation_store().get_conversation_id(self.session_id))
+        self.assertEqual([message.sender for message in history], ["user", "assistant", "assistant"])
+        self.assertIsNotNone(history[1].tool_result)
+        self.assertEqual(history[-1].content, tokens)
+
+    def test_replies_without_a_tool_skip_the_tool_events(self):
+        _, events = self.ask("Thanks, that helps a lot!")
+        self.assertEqual([name for name, _ in events if name != "token"], ["routing", "done"])
+
+    def test_errors_are_sent_as_an_event(self):
+        def failing_agent(llm, session_id):
+            raise RuntimeError("database is locked")
+
+        self.patch_agent(failing_agent)
+        response, events = self.ask("Hello", session_id=uuid.uuid4())
+        self.assertEqual(response.status_code, 200)  # Headers went out before the agent was built
+        self.assertEqual(events, [("error", {"error": "An unexpected error occurred: database is locked"})])
+
+    def test_requires_query_and_session(self):
+        response = self.client.post(reverse("ask_stream"), json.dumps({"query": "Hi"}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,62 @@
+import uuid
+
+from django.test import TestCase
+
+from utils.stores import Message, OrmConversationStore
+from utils.summary import ConversationSummarizer
+
+
+class FakeSummaryLLM:
+    """
+    Stands in for ChatGPT, recording the transcript lines of each summary call.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def query(self, prompt, conversation_history, **kwargs):
+        transcript = conversation_history[0]["content"].split("New messages:\n", 1)[1]
+        self.batches.append(transcript.splitlines())
+        return f"summary {len(self.batches)}"
+
+
+class ConversationSummaryTests(TestCase):
+    def setUp(self):
+        self.store = OrmConversationStore()
+        self.conversation_id = self.store.get_or_create_conversation(uuid.uuid4())
+
+    def append(self, count, start=0):
+        messages = [Message(self.conversation_id, "user", f"message {i}") for i in range(start, start + count)]
+        self.store.append_messages(messages)
+        return [message.id for message in messages]
+
+    def summarizer(self, llm):
+        return ConversationSummarizer(llm, store=self.store, keep_recent=4, min_new_messages=3, batch_messages=10)
+
+    def test_catches_up_from_the_watermark_in_batches(self):
+        ids = self.append(30)
+        llm = FakeSummaryLLM()
+        result = self.summarizer(llm).update(self.conversation_id)
+
+        # 26 messages precede the 4 kept verbatim: 2 batches of 10, then 6 (at least MIN_NEW_MESSAGES)
+        self.assertEqual([len(batch) for batch in llm.batches], [10, 10, 6])
+        self.assertEqual(llm.batches[0][0], "user: message 0")
+        self.assertEqual((result["summarized"], result["through"]), (26, ids[25]))
+        self.assertEqual(self.store.summary(self.conversation_id), ("summary 3", ids[25]))
+
+    def test_folds_each_message_once(self):
+        ids = self.append(10)
+        self.summarizer(FakeSummaryLLM()).update(self.conversation_id)  # Folds messages 0-5
+
+        llm = FakeSummaryLLM()
+        self.assertFalse(self.summarizer(llm).update(self.conversation_id)["updated"])
+        ids += self.append(5, start=10)
+        result = self.summarizer(llm).update(self.conversation_id)
+        self.assertEqual(llm.batches, [[f"user: message {i}" for i in range(6, 11)]])
+        self.assertEqual(result["through"], ids[10])
+
+    def test_stale_watermark_is_not_moved_back(self):
+        ids = self.append(10)
+        self.assertTrue(self.store.save_summary(self.conversation_id, "newer", ids[8]))
+        self.assertFalse(self.store.save_summary(self.conversation_id, "older", ids[5]))
+        self.assertEqual(self.store.summary(self.conversation_id), ("newer", ids[8]))
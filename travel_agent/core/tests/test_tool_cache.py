@@ -0,0 +1,115 @@
+import asyncio
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import SimpleTestCase, override_settings
+
+from utils.cache import ToolResultCache, _events, make_cache_key, normalize_query
+
+SHARED_CACHE = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tool-cache-tests"},
+}
+
+
+class CacheKeyTests(SimpleTestCase):
+    def test_free_text_queries_share_keys_across_phrasings(self):
+        self.assertEqual(normalize_query("Find some restaurants near Boston!"), "restaurants boston")
+        self.assertEqual(
+            make_cache_key("search_places", {"query": "restaurants near Boston"}),
+            make_cache_key("search_places", {"query": "Restaurants in boston"}),
+        )
+        self.assertNotEqual(
+            make_cache_key("search_places", {"query": "restaurants near me"}),
+            make_cache_key("search_places", {"query": "restaurants"}),
+        )
+
+    def test_other_arguments_are_keyed_as_given(self):
+        flights = {"origin": "BOS", "destination": "LHR", "departure_date": "2026-12-01", "adults": 1}
+        self.assertEqual(
+            make_cache_key("search_flights", flights),
+            make_cache_key("search_flights", dict(reversed(list(flights.items())))),
+        )
+        self.assertNotEqual(
+            make_cache_key("search_flights", flights),
+            make_cache_key("search_flights", {**flights, "adults": 2}),
+        )
+        self.assertNotEqual(
+            make_cache_key("search_flights", flights),
+            make_cache_key("search_places", flights),
+        )
+
+
+class ToolResultCacheTests(SimpleTestCase):
+    def cache(self, **kwargs):
+        return ToolResultCache(**{"ttls": {"search_places": 60}, "backend": "", **kwargs})
+
+    def fetcher(self, *results):
+        calls = []
+        results = iter(results)
+
+        def fetch():
+            calls.append(1)
+            return next(results)
+        return fetch, calls
+
+    def test_hits_skip_the_fetch_until_the_entry_expires(self):
+        cache = self.cache()
+        fetch, calls = self.fetcher("first", "second")
+        with mock.patch("utils.cache.time.monotonic", return_value=100.0):
+            self.assertEqual(cache.get_or_fetch("search_places", {"query": "bars"}, fetch), "first")
+            self.assertEqual(cache.get_or_fetch("search_places", {"query": "bars"}, fetch), "first")
+        with mock.patch("utils.cache.time.monotonic", return_value=161.0):
+            self.assertEqual(cache.get_or_fetch("search_places", {"query": "bars"}, fetch), "second")
+        self.assertEqual(len(calls), 2)
+
+    def test_tools_without_a_ttl_are_not_cached(self):
+        cache = self.cache()
+        fetch, calls = self.fetcher("first", "second")
+        cache.get_or_fetch("search_flights", {"origin": "BOS"}, fetch)
+        self.assertEqual(cache.get_or_fetch("search_flights", {"origin": "BOS"}, fetch), "second")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self.cache(max_entries=2)
+        evictions = _events.value(tool="search_places", event="eviction")
+        for query in ("bars", "cafes", "bars", "parks"):
+            cache.get_or_fetch("search_places", {"query": query}, lambda: query)
+        self.assertEqual(_events.value(tool="search_places", event="eviction"), evictions + 1)
+
+        fetch, calls = self.fetcher("cafes again")
+        self.assertEqual(cache.get_or_fetch("search_places", {"query": "cafes"}, fetch), "cafes again")
+        self.assertEqual(cache.get_or_fetch("search_places", {"query": "parks"}, fetch), "parks")
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_workers_share_entries_through_the_backend(self):
+        fetch, calls = self.fetcher("result")
+        self.cache(backend="shared").get_or_fetch("search_places", {"query": "museums"}, fetch)
+
+        other_worker = self.cache(backend="shared")
+        hits = _events.value(tool="search_places", event="persistent_hit")
+        self.assertEqual(other_worker.get_or_fetch("search_places", {"query": "museums"}, fetch), "result")
+        self.assertEqual(_events.value(tool="search_places", event="persistent_hit"), hits + 1)
+        self.assertEqual(len(calls), 1)
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_backend_errors_fall_back_to_fetching(self):
+        cache = self.cache(backend="shared")
+        errors = _events.value(tool="search_places", event="error")
+        with mock.patch.object(cache.backend, "get", side_effect=DatabaseError), \
+                mock.patch.object(cache.backend, "set", side_effect=DatabaseError):
+            self.assertEqual(cache.get_or_fetch("search_places", {"query": "zoos"}, lambda: "result"), "result")
+        self.assertEqual(_events.value(tool="search_places", event="error"), errors + 2)
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_async_lookups_share_entries_with_sync_ones(self):
+        cache = self.cache(backend="shared")
+        cache.get_or_fetch("search_places", {"query": "parks"}, lambda: "result")
+        cache.clear()  # Leave only the shared tier
+
+        async def fetch():
+            raise AssertionError("Should have been a hit")
+
+        async def main():
+            return await cache.aget_or_fetch("search_places", {"query": "parks near"}, fetch)
+
+        self.assertEqual(asyncio.run(main()), "result")
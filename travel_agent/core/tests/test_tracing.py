@@ -0,0 +1,174 @@
+import asyncio
+import io
+from contextlib import redirect_stdout
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from utils.metrics import MetricsRegistry, metrics
+from utils.tracing import _span_metrics, span, start_trace, traced
+
+
+def span_count(name):
+    return _span_metrics()[0]._series.get((name,), {}).get("count", 0)
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_renders_counters_in_the_exposition_format(self):
+        counter = self.registry.counter("requests_total", "Requests.", ("view", "status"))
+        counter.inc(view="ask", status=200)
+        counter.inc(2, view="ask", status=200)
+        counter.inc(view='say "hi"\n', status=500)
+        self.assertEqual(counter.value(view="ask", status=200), 3)
+        self.assertEqual(self.registry.render().split("\n"), [
+            "# HELP requests_total Requests.",
+            "# TYPE requests_total counter",
+            'requests_total{view="ask",status="200"} 3',
+            'requests_total{view="say \\"hi\\"\\n",status="500"} 1',
+            "",
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+        self.assertEqual(self.registry.render().split("\n")[2:-1], [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            "latency_seconds_sum 4.25",
+            "latency_seconds_count 4",
+        ])
+
+    def test_labels_must_match(self):
+        counter = self.registry.counter("requests_total", "Requests.", ("view",))
+        with self.assertRaises(ValueError):
+            counter.inc(status=200)
+
+    def test_metrics_are_registered_once(self):
+        counter = self.registry.counter("requests_total", "Requests.")
+        self.assertIs(self.registry.counter("requests_total", "Requests."), counter)
+        with self.assertRaises(ValueError):
+            self.registry.histogram("requests_total", "Requests.")
+
+
+class TracingTests(SimpleTestCase):
+    def test_spans_nest_and_are_collected_by_the_trace(self):
+        with start_trace() as trace:
+            with span("agent.turn", session="abc"):
+                with span("llm.query"):
+                    pass
+                with span("llm.query"):
+                    pass
+        self.assertEqual([(s.name, s.depth) for s in trace.spans], [("llm.query", 1), ("llm.query", 1), ("agent.turn", 0)])
+        self.assertIs(trace.spans[0].parent, trace.spans[2])
+        self.assertEqual(trace.spans[2].attributes, {"session": "abc"})
+        self.assertIn("  llm.query", trace.format().split("\n")[1])
+
+    def test_server_timing_groups_spans_by_name_and_parent(self):
+        with start_trace() as trace:
+            with span("agent.turn"):
+                with span("llm.query"):
+                    pass
+                with span("llm.query"):
+                    pass
+        entries = [entry.split(";")[0::2] for entry in trace.server_timing().split(", ")]
+        self.assertEqual(entries, [["llm.query", 'desc="2x in agent.turn"'], ["agent.turn"], ["total"]])
+
+    def test_errors_are_recorded_and_raised(self):
+        errors = _span_metrics()[1]
+        before = errors.value(span="tool.call", error="KeyError")
+        with start_trace() as trace, self.assertRaises(KeyError):
+            with span("tool.call"):
+                raise KeyError("query")
+        self.assertEqual(trace.spans[0].error, "KeyError")
+        self.assertEqual(errors.value(span="tool.call", error="KeyError"), before + 1)
+
+    def test_spans_outside_a_trace_only_record_metrics(self):
+        before = span_count("test.untraced")
+        with span("test.untraced"):
+            pass
+        self.assertEqual(span_count("test.untraced"), before + 1)
+
+    def test_traced_functions_generators_and_coroutines(self):
+        @traced("test.function")
+        def function():
+            return 1
+
+        @traced("test.generator")
+        def generator():
+            yield from range(3)
+
+        @traced("test.coroutine")
+        async def coroutine():
+            return 2
+
+        @traced("test.async_generator")
+        async def async_generator():
+            for i in range(2):
+                yield i
+
+        async def consume():
+            return await coroutine(), [item async for item in async_generator()]
+
+        with start_trace() as trace:
+            self.assertEqual(function(), 1)
+            self.assertEqual(list(generator()), [0, 1, 2])
+            self.assertEqual(asyncio.run(consume()), (2, [0, 1]))
+        self.assertEqual(
+            [s.name for s in trace.spans], ["test.function", "test.generator", "test.coroutine", "test.async_generator"],
+        )
+
+    def test_disabled_tracing_records_nothing(self):
+        with mock.patch("utils.tracing._config", {"ENABLED": False}), start_trace() as trace:
+            with span("test.disabled") as current:
+                self.assertIsNone(current)
+        self.assertEqual(trace.spans, [])
+
+
+class TracingMiddlewareTests(SimpleTestCase):
+    def requests(self, view, status):
+        counter = metrics._metrics.get("agent_http_requests_total")  # Registered by the first request
+        return counter.value(view=view, method="GET", status=status) if counter else 0
+
+    def test_server_timing_header_and_request_metrics(self):
+        before = self.requests("history", 400)
+        response = self.client.get(reverse("history"))
+        self.assertEqual(response.status_code, 400)
+        self.assertRegex(response["Server-Timing"], r"total;dur=\d+\.\d$")
+        self.assertEqual(self.requests("history", 400), before + 1)
+
+    def test_unmatched_requests(self):
+        before = self.requests("unmatched", 404)
+        self.client.get("/no/such/page/")
+        self.assertEqual(self.requests("unmatched", 404), before + 1)
+
+    @override_settings(TRACING={"LOG_SLOW_MS": 0, "SERVER_TIMING": False})
+    def test_slow_requests_are_logged(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            response = self.client.get(reverse("history"))
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertIn("Slow request GET /core/history/", output.getvalue())
+
+    def test_async_requests_are_traced(self):
+        response = asyncio.run(self.async_client.get(reverse("metrics")))
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+
+class MetricsViewTests(SimpleTestCase):
+    def test_serves_the_metrics(self):
+        self.client.get(reverse("history"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE agent_http_requests_total counter", body)
+        self.assertIn('agent_http_requests_total{view="history",method="GET",status="400"}', body)
+
+    def test_rejects_other_methods(self):
+        self.assertEqual(self.client.post(reverse("metrics")).status_code, 405)
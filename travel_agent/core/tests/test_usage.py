@@ -0,0 +1,105 @@
+import uuid
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from travel_agent.core.models import Conversation, LLMUsage
+from travel_agent.core.tests.helpers import create_places_method, fake_agent
+from utils.usage import estimate_cost, summarize_usage
+
+PRICING = {
+    "gpt-4o": {"PROMPT": 2.50, "COMPLETION": 10.00},
+    "gpt-4o-mini": {"PROMPT": 0.15, "COMPLETION": 0.60},
+}
+
+
+class CostTests(SimpleTestCase):
+    def test_models_match_the_longest_pricing_prefix(self):
+        self.assertAlmostEqual(estimate_cost("gpt-4o-2024-08-06", 1_000_000, 100_000, PRICING), 3.5)
+        self.assertAlmostEqual(estimate_cost("gpt-4o-mini-2024-07-18", 1_000_000, 100_000, PRICING), 0.21)
+
+    def test_unknown_models_cost_nothing(self):
+        self.assertEqual(estimate_cost("llama-3", 1000, 1000, PRICING), 0.0)
+        self.assertEqual(estimate_cost(None, 1000, 1000, PRICING), 0.0)
+
+    def test_summarize_usage(self):
+        rows = [
+            {"step": "routing", "model": "gpt-4o", "prompt_tokens": 1000, "completion_tokens": 10},
+            {"step": "answer", "model": "gpt-4o", "prompt_tokens": 2000, "completion_tokens": 200, "calls": 3},
+            {"step": "routing", "model": "gpt-4o-mini", "prompt_tokens": 1000, "completion_tokens": 10},
+        ]
+        total = summarize_usage(rows, pricing=PRICING)
+        self.assertEqual(
+            {key: total[key] for key in ("calls", "prompt_tokens", "completion_tokens", "total_tokens")},
+            {"calls": 5, "prompt_tokens": 4000, "completion_tokens": 220, "total_tokens": 4220},
+        )
+        self.assertAlmostEqual(total["cost_usd"], 0.009756)
+        by_step = summarize_usage(rows, key="step", pricing=PRICING)
+        self.assertEqual([(group["step"], group["calls"]) for group in by_step], [("routing", 2), ("answer", 3)])
+        self.assertEqual(summarize_usage([], pricing=PRICING)["calls"], 0)
+
+
+class AgentUsageTests(TestCase):
+    def setUp(self):
+        create_places_method()
+        self.agent = fake_agent()
+
+    def usage(self):
+        return list(LLMUsage.objects.filter(conversation_id=self.agent.conversation_id).order_by("id"))
+
+    def test_tool_turn_records_its_calls_against_the_tool(self):
+        self.agent.process_user_input("Can you find good restaurants in Boston?")
+        routing, answer = self.usage()
+        self.assertEqual((routing.step, routing.tool), ("routing", "search_places"))
+        self.assertEqual((answer.step, answer.tool), ("answer", "search_places"))
+        self.assertTrue(all(row.prompt_tokens > 0 and row.completion_tokens > 0 for row in (routing, answer)))
+        # The routing call is attributed to the tool result, the answer call to the reply
+        result, reply = self.agent.store.history(self.agent.conversation_id)[1:]
+        self.assertEqual((routing.message_id, answer.message_id), (result.id, reply.id))
+
+    def test_turn_without_tool(self):
+        self.agent.process_user_input("Thanks, that helps a lot!")
+        self.assertEqual([(row.step, row.tool) for row in self.usage()], [("routing", ""), ("answer", "")])
+
+
+class UsageViewTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create()
+        self.other = Conversation.objects.create()
+        for conversation, step, model, tokens in [
+            (self.conversation, "routing", "gpt-3.5-turbo", 1000),
+            (self.conversation, "answer", "gpt-3.5-turbo", 3000),
+            (self.other, "answer", "gpt-4o", 2000),
+        ]:
+            LLMUsage.objects.create(
+                conversation=conversation, step=step, model=model, prompt_tokens=tokens, completion_tokens=100,
+            )
+
+    def get(self, **params):
+        return self.client.get(reverse("usage"), params)
+
+    def test_groups_by_session(self):
+        body = self.get().json()
+        self.assertEqual(body["group_by"], "session")
+        sessions = {group["session_id"]: group["calls"] for group in body["groups"]}
+        self.assertEqual(sessions, {str(self.conversation.session_id): 2, str(self.other.session_id): 1})
+        self.assertEqual(body["total"]["total_tokens"], 6300)
+        self.assertGreater(body["total"]["cost_usd"], 0)
+
+    def test_groups_by_step_for_one_session(self):
+        body = self.get(group_by="step", session_id=str(self.conversation.session_id)).json()
+        self.assertEqual([(group["step"], group["prompt_tokens"]) for group in body["groups"]], [("answer", 3000), ("routing", 1000)])
+        self.assertEqual(body["total"]["calls"], 2)
+
+    def test_reporting_window(self):
+        LLMUsage.objects.filter(conversation=self.other).update(created_at=timezone.now() - timedelta(days=10))
+        self.assertEqual(self.get(days=7).json()["total"]["calls"], 2)
+        self.assertEqual(self.get(days=30).json()["total"]["calls"], 3)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(group_by="model").status_code, 400)
+        self.assertEqual(self.get(days="week").status_code, 400)
+        self.assertEqual(self.get(session_id=str(uuid.uuid4())).status_code, 400)
+        self.assertEqual(self.client.post(reverse("usage")).status_code, 405)
@@ -1,7 +1,13 @@
 from django.urls import path
-from .views import ask, start_session
+from .views import ask, ask_async, ask_stream, ask_stream_async, history, job, start_session, usage
 
 urlpatterns = [
     path('ask/', ask, name='ask'),
-    path('start_session/', start_session, name='start_session')
+    path('ask/stream/', ask_stream, name='ask_stream'),
+    path('ask/async/', ask_async, name='ask_async'),
+    path('ask/stream/async/', ask_stream_async, name='ask_stream_async'),
+    path('start_session/', start_session, name='start_session'),
+    path('history/', history, name='history'),
+    path('usage/', usage, name='usage'),
+    path('jobs/<uuid:job_id>/', job, name='job'),
 ]
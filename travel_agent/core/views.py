@@ -1,10 +1,17 @@
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
-from travel_agent.core.models import Conversation
-from utils.agent import TravelAgent
-from utils.llm import ChatGPT
+from travel_agent.core.models import Conversation, Job, LLMUsage
+from utils.agent import AsyncTravelAgent, TravelAgent
+from utils.llm import AsyncChatGPT, ChatGPT
+from utils.metrics import metrics as metrics_registry
+from utils.ratelimit import RateLimitExceeded
+from utils.sessions import agent_sessions, async_agent_sessions
+from utils.stores import get_conversation_store
+from utils.usage import summarize_usage
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from datetime import timedelta
 import json
 import uuid
 
@@ -18,12 +25,138 @@ def start_session(request):
         session_id = uuid.uuid4()
         
         # Create a new conversation in the database
-        Conversation.objects.create(session_id=session_id)
+        get_conversation_store().create_conversation(session_id)
         
         return JsonResponse({"session_id": str(session_id)}, status=201)
     
     return JsonResponse({"error": "Invalid request method"}, status=405)
 
+def metrics(request):
+    """
+    Expose this process's latency histograms and counters in the Prometheus text exposition format.
+    """
+    if request.method == "GET":
+        return HttpResponse(metrics_registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
+# Grouping of the usage report -> (LLMUsage queryset method, key of its rows, key in the response)
+USAGE_GROUPINGS = {
+    "session": ("by_session", "conversation__session_id", "session_id"),
+    "day": ("by_day", "day", "day"),
+    "tool": ("by_tool", "tool", "tool"),
+    "step": ("by_step", "step", "step"),
+}
+
+def usage(request):
+    """
+    Report LLM token usage and estimated cost.
+
+    Query parameters: `group_by` (session, day, tool or step; default session), `days` (reporting
+    window, default 30) and optionally `session_id` to report on a single session.
+    """
+    if request.method == "GET":
+        group_by = request.GET.get("group_by", "session")
+        if group_by not in USAGE_GROUPINGS:
+            return JsonResponse({"error": f"'group_by' must be one of {', '.join(USAGE_GROUPINGS)}."}, status=400)
+        try:
+            days = max(1, int(request.GET.get("days", 30)))
+        except ValueError:
+            return JsonResponse({"error": "'days' must be an integer."}, status=400)
+
+        queryset = LLMUsage.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+        session_id = request.GET.get("session_id")
+        if session_id:
+            conversation_id = get_conversation_store().get_conversation_id(session_id)
+            if conversation_id is None:
+                return JsonResponse({"error": "Invalid session_id."}, status=400)
+            queryset = queryset.filter(conversation_id=conversation_id)
+
+        method, key, name = USAGE_GROUPINGS[group_by]
+        rows = list(getattr(queryset, method)())
+        groups = []
+        for group in summarize_usage(rows, key=key):
+            value = group.pop(key)
+            groups.append({name: str(value) if value is not None else None, **group})
+        return JsonResponse({
+            "group_by": group_by,
+            "days": days,
+            "groups": groups,
+            "total": summarize_usage(rows),
+        }, status=200)
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
+def history(request):
+    """
+    Return a page of a session's messages, oldest first.
+
+    Query parameters: `session_id`, `limit` (default 50, at most 200) and `before`, the id of the
+    oldest message already fetched. Pass the returned `next_before` as `before` to page backwards.
+    """
+    if request.method == "GET":
+        session_id = request.GET.get("session_id")
+        if not session_id:
+            return JsonResponse({"error": "'session_id' is required."}, status=400)
+
+        try:
+            limit = max(1, min(int(request.GET.get("limit", 50)), 200))
+            before = int(request.GET["before"]) if request.GET.get("before") else None
+        except ValueError:
+            return JsonResponse({"error": "'limit' and 'before' must be integers."}, status=400)
+
+        store = get_conversation_store()
+        conversation_id = store.get_conversation_id(session_id)
+        if conversation_id is None:
+            return JsonResponse({"error": "Invalid session_id."}, status=400)
+
+        # Fetch one extra row to learn whether an older page exists
+        rows = store.history(conversation_id, limit=limit + 1, before=before)
+        has_more = len(rows) > limit
+        rows = rows[1:] if has_more else rows
+
+        messages = [
+            {
+                "id": row.id,
+                "role": row.sender,
+                "content": row.content,
+                "is_tool_result": row.tool_id is not None,
+                "result": row.tool_result,
+                "created_at": row.created_at.isoformat(),
+            }
+            for row in rows
+        ]
+        return JsonResponse({
+            "messages": messages,
+            "next_before": rows[0].id if has_more else None,
+        }, status=200)
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
+def job(request, job_id):
+    """
+    Report a background job's status and, once it has succeeded, its result. Poll it with the job
+    ids listed under `context.jobs` in the reply of the turn that deferred a tool call.
+    """
+    if request.method == "GET":
+        try:
+            job = Job.objects.get(pk=job_id)
+        except Job.DoesNotExist:
+            return JsonResponse({"error": "Job not found."}, status=404)
+
+        return JsonResponse({
+            "id": str(job.pk),
+            "kind": job.kind,
+            "status": job.status,
+            "result": job.result,
+            "error": job.error or None,
+            "attempts": job.attempts,
+            "created_at": job.created_at.isoformat(),
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }, status=200)
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
 @csrf_exempt
 def ask(request):
     """
@@ -39,19 +172,138 @@ def ask(request):
             if not user_input or not session_id:
                 return JsonResponse({"error": "Both 'query' and 'session_id' are required."}, status=400)
 
-            # Initialize LLM and TravelAgent
+            # Reuse the session's live TravelAgent, or build one on a miss
             llm = ChatGPT()
-            travel_agent = TravelAgent(llm, session_id)
-
-            # Use the TravelAgent to process the input
-            response = travel_agent.process_user_input(user_input)
-            return JsonResponse({"message": response}, status=200)
+            with agent_sessions.checkout(
+                session_id, lambda: TravelAgent(llm, session_id), llm=llm
+            ) as travel_agent:
+                # Use the TravelAgent to process the input
+                response = travel_agent.process_user_input(user_input)
+                return JsonResponse({"message": response, "context": travel_agent.get_turn_context_report()}, status=200)
         
         except json.JSONDecodeError:
             return JsonResponse({"error": "Invalid JSON input."}, status=400)
         except Conversation.DoesNotExist:
             return JsonResponse({"error": "Invalid session_id."}, status=400)
+        except RateLimitExceeded as e:
+            return JsonResponse({"error": str(e)}, status=503)
         except Exception as e:
             return JsonResponse({"error": f"An unexpected error occurred: {str(e)}"}, status=500)
     
     return JsonResponse({"error": "Invalid request method"}, status=405)
+
+
+def _sse(event, data):
+    """
+    Encode a single Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@csrf_exempt
+def ask_stream(request):
+    """
+    Streaming variant of `ask`: responds with Server-Sent Events so the client sees routing
+    and tool progress immediately, followed by the assistant's reply token by token.
+    """
+    if request.method == "POST":
+        try:
+            body = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON input."}, status=400)
+
+        user_input = body.get("query", "")
+        session_id = body.get("session_id", None)
+
+        if not user_input or not session_id:
+            return JsonResponse({"error": "Both 'query' and 'session_id' are required."}, status=400)
+
+        def event_stream():
+            try:
+                # Check out the agent inside the stream so headers go out before any DB or LLM work
+                llm = ChatGPT()
+                with agent_sessions.checkout(
+                    session_id, lambda: TravelAgent(llm, session_id), llm=llm
+                ) as travel_agent:
+                    for event in travel_agent.process_user_input_stream(user_input):
+                        name = event.pop("event")
+                        yield _sse(name, event)
+            except Exception as e:
+                yield _sse("error", {"error": f"An unexpected error occurred: {str(e)}"})
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Disable proxy buffering so events are flushed immediately
+        return response
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
+@csrf_exempt
+async def ask_async(request):
+    """
+    Async variant of `ask` for the ASGI entry point. If the client disconnects, Django cancels
+    this view and the in-flight LLM and tool requests are cancelled with it.
+    """
+    if request.method == "POST":
+        try:
+            # Parse the request body
+            body = json.loads(request.body)
+            user_input = body.get("query", "")
+            session_id = body.get("session_id", None)
+
+            if not user_input or not session_id:
+                return JsonResponse({"error": "Both 'query' and 'session_id' are required."}, status=400)
+
+            llm = AsyncChatGPT()
+            async with async_agent_sessions.acheckout(
+                session_id, lambda: AsyncTravelAgent.create(llm, session_id), llm=llm
+            ) as travel_agent:
+                response = await travel_agent.process_user_input(user_input)
+                return JsonResponse({"message": response, "context": travel_agent.get_turn_context_report()}, status=200)
+
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON input."}, status=400)
+        except Conversation.DoesNotExist:
+            return JsonResponse({"error": "Invalid session_id."}, status=400)
+        except RateLimitExceeded as e:
+            return JsonResponse({"error": str(e)}, status=503)
+        except Exception as e:
+            return JsonResponse({"error": f"An unexpected error occurred: {str(e)}"}, status=500)
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
+
+@csrf_exempt
+async def ask_stream_async(request):
+    """
+    Async variant of `ask_stream`. A client disconnect cancels the event stream, and with it
+    the upstream LLM stream; the partial reply is not saved.
+    """
+    if request.method == "POST":
+        try:
+            body = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON input."}, status=400)
+
+        user_input = body.get("query", "")
+        session_id = body.get("session_id", None)
+
+        if not user_input or not session_id:
+            return JsonResponse({"error": "Both 'query' and 'session_id' are required."}, status=400)
+
+        async def event_stream():
+            try:
+                llm = AsyncChatGPT()
+                async with async_agent_sessions.acheckout(
+                    session_id, lambda: AsyncTravelAgent.create(llm, session_id), llm=llm
+                ) as travel_agent:
+                    async for event in travel_agent.process_user_input_stream(user_input):
+                        name = event.pop("event")
+                        yield _sse(name, event)
+            except Exception as e:
+                yield _sse("error", {"error": f"An unexpected error occurred: {str(e)}"})
+
+        response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    return JsonResponse({"error": "Invalid request method"}, status=405)
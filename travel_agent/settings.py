@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'travel_agent.core.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -74,6 +75,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'travel_agent.wsgi.application'
+ASGI_APPLICATION = 'travel_agent.asgi.application'
 
 
 # Database
@@ -83,9 +85,218 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # IMMEDIATE transactions take the write lock up front and wait up to 'timeout' seconds for it
+            # instead of failing with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,
+        },
     }
 }
 
+# Put SQLite databases in WAL mode when connecting, so readers and the writer proceed concurrently
+# (see travel_agent/core/signals.py). WAL mode is persistent: the database file is converted and
+# gets -wal/-shm files next to it, so only turn this on for deployments with their own database.
+SQLITE_WAL = False
+
+
+# Outbound HTTP clients
+# Long-lived, pooled clients shared by ChatGPT and the tools (see utils/clients.py)
+
+HTTP_CLIENTS = {
+    'POOL_SIZE': 20,
+    'KEEPALIVE_CONNECTIONS': 20,
+    'KEEPALIVE_EXPIRY': 30.0,
+    'CONNECT_TIMEOUT': 5.0,
+    'READ_TIMEOUT': 60.0,
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The tool_results table is shared by all workers; create it with `python manage.py createcachetable`
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tool_results': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'tool_result_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Tool result caching (see utils/cache.py): an in-process LRU in front of the tool_results cache
+TOOL_CACHE = {
+    'MAX_ENTRIES': 512,
+    'BACKEND': 'tool_results',
+    'TTLS': {
+        'search_places': 6 * 60 * 60,
+        'search_flights': 10 * 60,  # Fares and availability change quickly
+    },
+    # Free-text arguments keyed by their normalized form; IATA codes, dates etc. are keyed as given
+    'NORMALIZE': {
+        'search_places': ['query'],
+    },
+}
+
+
+# Agent
+# 'classic' asks for a tool name first (answered by the local router when it is confident, see TOOL_ROUTER,
+# while SPECULATIVE_TOOLS may run the tool meanwhile) and makes a second call to answer;
+# 'function_calling' (opt-in) routes and answers in a single LLM call using native tool schemas.
+
+AGENT_ROUTING_MODE = 'classic'
+
+# Most recent messages loaded into an agent's history; older ones would not fit the token budget anyway
+AGENT_HISTORY_LIMIT = 100
+
+# Token budget for the context sent with each LLM call (see utils/context.py)
+CONTEXT_BUILDER = {
+    'TOKEN_BUDGET': 4000,
+    'RESPONSE_RESERVE': 500,
+    'TOOL_RESULT_MAX_TOKENS': 200,
+}
+
+# Opt-in cache of LLM replies shared by all sessions of a worker (see utils/response_cache.py). Routing
+# decisions are reused for near-duplicate messages; answers only for first turns, which have no history.
+LLM_RESPONSE_CACHE = {
+    'ENABLED': False,
+    'MAX_ENTRIES': 2048,
+}
+
+# Prices used to estimate the cost of LLM calls in the usage report (see utils/usage.py), in USD per
+# million tokens, matched on the model name prefix reported by the API
+LLM_PRICING = {
+    'gpt-3.5-turbo': {'PROMPT': 0.50, 'COMPLETION': 1.50},
+    'gpt-4o': {'PROMPT': 2.50, 'COMPLETION': 10.00},
+}
+
+# Local tool router (see utils/router.py): a classifier trained on the LLM's past routing decisions that
+# skips the LLM routing call when it is at least 'THRESHOLD' confident. Opt-in: the LLM's decisions are
+# logged meanwhile, so check with `python manage.py evaluate_router` that it is accurate before enabling it.
+TOOL_ROUTER = {
+    'ENABLED': False,
+    'THRESHOLD': 0.85,
+    'MIN_EXAMPLES': 20,
+    'RETRAIN_EVERY': 50,
+    'KEYWORDS': {
+        'search_places': [
+            'restaurants near', 'places to eat', 'where to eat', 'hotels in', 'museums in', 'things to do in',
+            'coffee shops', 'bars near', 'attractions in', 'parks near',
+        ],
+        'search_flights': [
+            'flights from', 'flight to', 'fly from', 'cheapest flight', 'plane tickets', 'airfare to',
+        ],
+        'none': ['hi', 'hello', 'thanks', 'thank you', 'goodbye', 'who are you', 'what can you do'],
+    },
+}
+
+# Identical tool calls, and LLM calls of the 'LLM_STEPS' steps, that are in flight at the same time in a
+# worker share one upstream request (see utils/singleflight.py); counted in agent_singleflight_calls_total
+REQUEST_COALESCING = {
+    'ENABLED': True,
+    'LLM_STEPS': ['routing', 'tool_routing'],
+}
+
+# Client-side limits on outbound calls per provider, shared by every thread of a worker (see utils/ratelimit.py).
+# Keep them a little below the account's limits divided by the number of workers. Calls over the limits
+# queue, interactive ones ahead of background work, for at most 'MAX_WAIT' seconds; then the request fails
+# with 503. None disables a limit.
+RATE_LIMITS = {
+    'openai': {'REQUESTS_PER_MINUTE': 500, 'TOKENS_PER_MINUTE': 200_000, 'MAX_CONCURRENCY': 50, 'MAX_WAIT': 20.0},
+    'google_places': {'REQUESTS_PER_MINUTE': 600, 'MAX_CONCURRENCY': 20, 'MAX_WAIT': 10.0},
+    'amadeus': {'REQUESTS_PER_MINUTE': 600, 'MAX_CONCURRENCY': 10, 'MAX_WAIT': 10.0},
+}
+
+# Timeouts, retries and hedging of LLM requests (see utils/resilience.py). Timeouts and hedge delays adapt to
+# the rolling latencies of each step; 'HEDGE_STEPS' duplicate a request that is slower than the step's usual
+# p95 and take the first reply, at the cost of the extra calls
+LLM_RESILIENCE = {
+    'RETRY_STEPS': ['routing', 'tool_routing', 'answer'],
+    'MAX_ATTEMPTS': 3,
+    'HEDGE_STEPS': [],
+    'HEDGE_QUANTILE': 0.95,
+    'MAX_TIMEOUT': 60.0,
+}
+
+# Rolling conversation summary (see utils/summary.py): once 'MIN_NEW_MESSAGES' messages besides the latest
+# 'KEEP_RECENT' are past the summary, a background job folds them into it. LLM calls then get the summary plus
+# the messages after it, so prompts stop growing with the conversation. Requires `run_jobs` workers.
+CONVERSATION_SUMMARY = {
+    'ENABLED': False,
+    'KEEP_RECENT': 8,
+    'MIN_NEW_MESSAGES': 6,
+    'MAX_TOKENS': 300,
+    'BATCH_MESSAGES': 40,
+}
+
+# Background jobs (see utils/jobs.py), run by `python manage.py run_jobs` workers. Calls of the
+# 'BACKGROUND_TOOLS' are deferred to a job: the turn is answered at once and the tool's result is added to
+# the conversation when the job completes; poll /core/jobs/<id>/ for it. Failed jobs are retried with backoff.
+# Flight searches take seconds, so they run in the background; the agent runs them inline when its
+# conversation store is not shared with the workers (CONVERSATION_STORE['BACKEND'] = 'memory').
+JOB_QUEUE = {
+    'BACKGROUND_TOOLS': ['search_flights'],
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 10.0,
+    'LEASE_SECONDS': 120.0,
+    'CONCURRENCY': 4,
+}
+
+# Speculative tool calls (see utils/speculation.py): in classic routing, start the tool the local router
+# expects (at least 'MIN_CONFIDENCE' sure) while the LLM routing call runs, and drop its result if routing
+# disagrees. Only read-only 'TOOLS' are speculated on; outcomes are counted in agent_tool_speculations_total.
+SPECULATIVE_TOOLS = {
+    'ENABLED': False,
+    'POLICY': 'router',
+    'MIN_CONFIDENCE': 0.5,
+    'TOOLS': ['search_places'],
+}
+
+# Tool results are stored as JSON and rendered into prompts as compact tables (see utils/results.py):
+# the best 'TOP_K' rows, projected onto each tool's 'FIELDS'
+TOOL_RESULTS = {
+    'TOP_K': 5,
+    'MAX_STORED_ROWS': 10,
+    'FIELDS': {
+        'search_places': ['name', 'rating', 'ratings', 'address', 'open_now', 'types'],
+        'search_flights': ['price', 'currency', 'carriers', 'departs', 'arrives', 'duration', 'stops'],
+    },
+}
+
+# How a turn's messages are written (see utils/persistence.py): buffered and written in one batch at the
+# end of the turn ('WRITE_BEHIND'), either before the response is returned ('sync') or by a background
+# flusher thread ('async', faster but a crash can lose the latest turn)
+MESSAGE_PERSISTENCE = {
+    'WRITE_BEHIND': True,
+    'DURABILITY': 'sync',
+}
+
+# Where conversations and messages are stored (see utils/stores.py): 'orm' (Django models), 'sqlite'
+# (opt-in direct SQLite access tuned for concurrent writers, same tables as the ORM but its own
+# connections, so no model signals) or 'memory' (per process)
+CONVERSATION_STORE = {
+    'BACKEND': 'orm',
+    'BUSY_TIMEOUT': 5000,
+}
+
+# Spans around agent steps, LLM calls, tool HTTP calls and DB writes (see utils/tracing.py), returned in
+# a Server-Timing header and aggregated into the latency histograms served at /metrics
+TRACING = {
+    'ENABLED': True,
+    'SERVER_TIMING': True,
+    'LOG_SLOW_MS': None,
+}
+
+# Live agents kept in memory per worker between turns (see utils/sessions.py)
+AGENT_SESSION_CACHE = {
+    'MAX_SESSIONS': 256,
+    'IDLE_TIMEOUT': 15 * 60,
+    'VERIFY': True,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
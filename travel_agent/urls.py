@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from travel_agent.core.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('core/', include('travel_agent.core.urls'))
+    path('core/', include('travel_agent.core.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -1,139 +1,1191 @@
-from utils.registry import ToolRegistry
-from travel_agent.core.models import Conversation, ConversationMessage, ToolMethod
+import json
+import logging
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from utils.cache import make_cache_key
+from travel_agent.core.models import Job
+from utils.context import ContextBuilder, count_tokens, history_entry
+from utils.cursors import ToolCursor
+from utils.jobs import get_job_queue_config, job_handler, new_job
+from utils.llm import ChatGPT
+from utils.persistence import message_writer
+from utils.registry import get_cached_registry
+from utils.results import ToolResultEncoder, is_tool_result, tool_error
+from utils.router import get_tool_router
+from utils.singleflight import get_singleflight
+from utils.speculation import get_tool_speculator
+from utils.stores import Message, get_conversation_store
+from utils.summary import get_summary_config
+from utils.tracing import traced
+from utils.usage import summarize_usage
+
+logger = logging.getLogger(__name__)
 
 
 class TravelAgent:
-    def __init__(self, llm, session_id):
+    def __init__(self, llm, session_id, store=None, registry=None):
+        """
+        :param store: ConversationStore to use; defaults to the process-wide store.
+        :param registry: ToolRegistry to use; defaults to the process-wide cached registry.
+        """
+        self._init_state(llm, session_id, registry or get_cached_registry(), store)
+        self.conversation_id = self._get_or_create_conversation()
+        self.conversation_history = self._load_conversation_history()
+        self._load_summary()
+
+    def _init_state(self, llm, session_id, registry, store=None):
+        """
+        Initialize the state shared by the sync and async agents.
+        """
         self.llm = llm
         self.session_id = session_id
-        self.tool_registry = ToolRegistry().get_tool_registry()
-        self.conversation = self._get_or_create_conversation()
-        self.conversation_history = self._load_conversation_history()
+        self.store = store or get_conversation_store()
+        self.routing_mode = getattr(settings, "AGENT_ROUTING_MODE", "classic")
+        self.history_limit = getattr(settings, "AGENT_HISTORY_LIMIT", None)  # Most recent messages loaded per session
+        self.context_builder = ContextBuilder()
+        self.result_encoder = ToolResultEncoder()
+        self.router = get_tool_router()
+        self.speculator = get_tool_speculator()
+        self.tool_calls = get_singleflight("tools")  # Coalesces identical tool calls across sessions
+        # Tools run as background jobs; only possible when the job workers can see the conversation
+        self.background_tools = set(get_job_queue_config()["BACKGROUND_TOOLS"]) if self.store.shared else set()
+        self.pending_jobs = []  # Jobs deferred in the current turn, enqueued when it ends
+        self.turn_jobs = []  # Ids of the jobs deferred in the current turn
+        self.cursors = {}  # Tool name -> ToolCursor over the results of the session's latest call of the tool
+        # Rolling summary of the messages up to id summary_through, updated by jobs (see utils/summary.py)
+        summary_config = get_summary_config()
+        self.summarize = summary_config["ENABLED"] and self.store.shared
+        self.summary_threshold = summary_config["KEEP_RECENT"] + summary_config["MIN_NEW_MESSAGES"]
+        self.summary = ""
+        self.summary_through = None
+        self.summary_stale = False  # The summary may have moved since it was loaded
+        self.turn_context_tokens = []
+        self.turn_usage = []  # Token usage of the current turn's LLM calls
+        # Usage of LLM calls not yet attributed to a message; hedged duplicates report theirs from other threads
+        self.pending_usage = deque()
+        self.turn_tool = None  # First tool used in the current turn
+        self.turn_start = 0  # Index in conversation_history of the current turn's user message
+        self.last_message_id = None  # Id of the latest message known to be written to the database
+        self.message_writer = message_writer
+        self.pending_messages = []  # Messages of the current turn not yet handed to the writer
+        self._load_tools(registry)
+
+    def _load_tools(self, registry):
+        """
+        Bind the registry's tools and render the system prompt from their descriptions.
+        """
+        self.registry = registry
+        self.tool_registry = registry.get_tool_registry()
+        self.tool_descriptions = registry.get_tool_descriptions()
+        self.tool_schemas = registry.get_tool_schemas()
+        self.routing_tools = {name: info["description"] for name, info in self.tool_registry.items()}
         self.system_prompt = self._generate_system_prompt()
 
     def _get_or_create_conversation(self):
         """
-        Retrieve or create a Conversation object based on the session_id.
+        Retrieve or create the conversation of the session_id and return its id.
         """
-        conversation, _ = Conversation.objects.get_or_create(session_id=self.session_id)
-        return conversation
+        return self.store.get_or_create_conversation(self.session_id)
 
-    def _load_conversation_history(self):
+    def _message_text(self, message):
         """
-        Load the conversation history for the current session as a list of messages.
+        Return the text of a message as sent to the LLM; structured tool results are rendered here.
         """
-        messages = self.conversation.messages.order_by("created_at")
-        return [{"role": msg.sender, "content": msg.content} for msg in messages]
+        if message.tool_result is not None:
+            return f"Tool result: {self.result_encoder.encode(message.tool_result)}"
+        return message.content
 
-    def _save_message(self, sender, content, tool=None):
+    def _message_entry(self, message):
         """
-        Save a message to the conversation.
+        Convert a Message (or a history row returned by the store) into a conversation history entry.
         """
-        return ConversationMessage.objects.create(
-            conversation=self.conversation,
-            sender=sender,
-            content=content,
-            tool=tool,
+        return history_entry(
+            message.sender, self._message_text(message), tokens=message.token_count, tool=message.tool_id is not None,
+            message=message,
         )
 
+    def _new_message(self, sender, content, tool_id=None, tool_result=None):
+        """
+        Build an unsaved Message of the conversation, counting the tokens it will take in a prompt.
+        """
+        message = Message(self.conversation_id, sender, content, tool_id=tool_id, tool_result=tool_result)
+        message.token_count = count_tokens(self._message_text(message))
+        return message
+
+    def _prepare_tool_result(self, result):
+        """
+        Split a tool's return value into what is stored and what is sent to the LLM.
+
+        :return: Tuple of (message content, structured result to store or None, rendered result).
+        """
+        if not is_tool_result(result):
+            return f"Tool result: {result}", None, str(result)
+        result = self.result_encoder.trim(result)
+        return self.result_encoder.summarize(result), result, self.result_encoder.encode(result)
+
+    def _history_from_messages(self, messages):
+        """
+        Convert messages, oldest first, into history entries.
+        """
+        history = [self._message_entry(msg) for msg in messages]
+        self.last_message_id = messages[-1].id if messages else None
+        return history
+
+    def _load_conversation_history(self):
+        """
+        Load the most recent conversation history for the current session as a list of messages.
+        """
+        return self._history_from_messages(self.store.history(self.conversation_id, limit=self.history_limit))
+
+    def _load_summary(self):
+        """
+        Load the conversation's rolling summary and the id of the last message it covers.
+        """
+        if self.summarize:
+            self.summary, self.summary_through = self.store.summary(self.conversation_id)
+        self.summary_stale = False
+
+    def refresh(self, check_history=True, llm=None):
+        """
+        Bring a reused agent up to date before its next turn: switch to the request's `llm` if
+        given, rebind the tools if the registry was rebuilt and, when `check_history` is set,
+        reload the history if messages were added
+        elsewhere (e.g. by another worker) since this agent last saw the conversation. The check
+        is skipped while this worker still has messages of the conversation queued for writing.
+        The conversation's summary is reloaded along with the history, and after this agent
+        requested an update of it.
+        """
+        if llm is not None:
+            self.llm = llm
+        registry = get_cached_registry()
+        if registry is not self.registry:
+            self._load_tools(registry)
+        if (
+            check_history
+            and not self.message_writer.has_pending(self.conversation_id)
+            and self.store.latest_message_id(self.conversation_id) != self.last_message_id
+        ):
+            self.conversation_history = self._load_conversation_history()
+            self.summary_stale = True
+        if self.summary_stale:
+            self._load_summary()
+
+    def _append_to_history(self, message):
+        """
+        Append a message to the in-memory history, keeping it in step with the database.
+        """
+        self.conversation_history.append(self._message_entry(message))
+
+    def _record_usage(self, usage):
+        """
+        Collect the token usage of an LLM call (the `on_usage` callback of ChatGPT). A hedged
+        duplicate may report after its turn has ended; its usage then goes with the next turn's.
+        """
+        self.pending_usage.append(usage)
+
+    def _take_pending_usage(self):
+        """
+        Remove and return the collected usage, with the turn's tool.
+        """
+        usage = []
+        while self.pending_usage:
+            usage.append({**self.pending_usage.popleft(), "tool": self.turn_tool or ""})
+        return usage
+
+    def _attach_usage(self, message):
+        """
+        Attribute the usage of the LLM calls made since the previous assistant message to `message`,
+        so it is written with it.
+        """
+        if message.sender != "assistant" or not self.pending_usage:
+            return
+        message.usage = self._take_pending_usage()
+        self.turn_usage.extend(message.usage)
+
+    def _attach_leftover_usage(self):
+        """
+        Attribute the usage of LLM calls not followed by an assistant message (a failed turn) to the
+        turn's last buffered message, so tokens spent on failures are still accounted for.
+        """
+        if self.pending_usage and self.pending_messages:
+            message = self.pending_messages[-1]
+            usage = self._take_pending_usage()
+            message.usage = (message.usage or []) + usage
+            self.turn_usage.extend(usage)
+
+    def _save_message(self, sender, content, tool_id=None, tool_result=None):
+        """
+        Record a message of the conversation and append it to the in-memory history.
+
+        With write-behind persistence the message is buffered and written together with the rest
+        of the turn's messages when the turn ends; otherwise it is written immediately.
+        """
+        message = self._new_message(sender, content, tool_id=tool_id, tool_result=tool_result)
+        self._attach_usage(message)
+        self.pending_messages.append(message)
+        self._append_to_history(message)
+        if not self.message_writer.write_behind:
+            self._flush_messages()
+        return message
+
+    def _flush_messages(self):
+        """
+        Hand the buffered messages to the writer as one batch.
+        """
+        messages, self.pending_messages = self.pending_messages, []
+        if messages:
+            self.message_writer.write(messages, on_saved=self._on_messages_saved, store=self.store)
+
+    def _on_messages_saved(self, messages):
+        """
+        Record the id of the latest written message (called by the writer, possibly from its thread).
+        """
+        self.last_message_id = messages[-1].id
+
     def _generate_system_prompt(self):
         """
         Generate a system prompt dynamically with the tool registry.
         """
-        tool_descriptions = "\n".join(
-            [f"- {name}: {info['description']}" for name, info in self.tool_registry.items()]
-        )
         return f"""
         You are an advanced AI travel assistant named Spotradius. Your primary goal is to assist users 
         in planning and managing their travel in a seamless and engaging way.
 
         Tools available:
-        {tool_descriptions}
+        {self.tool_descriptions}
 
         Use the tools thoughtfully to provide enhanced responses. If tool results are already available 
         in the conversation history, incorporate them naturally into your answers. Keep your answers concise
         and informative, and maintain a conversational tone throughout the interaction.
         """
 
-    def identify_tool(self):
+    def _build_context(self, prompt, tools=None, tool_messages=None):
         """
-        Determine if the user's input would benefit from using a tool.
+        Fit the conversation history into the token budget for an LLM call with `prompt`,
+        recording the call's token report for the current turn.
+
+        Tool results of the current turn are left out: they are passed in the prompt itself, or as
+        `tool_messages` after the history with function calling. So are the messages covered by the
+        conversation's summary, which is sent in their place.
+        """
+        history = [
+            entry for index, entry in enumerate(self.conversation_history)
+            if not (entry["tool"] and index >= self.turn_start) and not self._summarized(entry)
+        ]
+        messages, report = self.context_builder.build(
+            prompt, history, tools=tools, summary=self.summary or None, tool_messages=tool_messages,
+        )
+        self.turn_context_tokens.append(report)
+        return messages
+
+    def _summarized(self, entry):
+        """
+        Return whether the history entry's message is covered by the conversation's summary.
         """
-        prompt = f"""
+        message = entry.get("message")
+        return (
+            self.summary_through is not None
+            and message is not None
+            and message.id is not None
+            and message.id <= self.summary_through
+        )
+
+    def _summary_jobs(self):
+        """
+        Return the conversation's summary jobs that are queued or running.
+        """
+        return Job.objects.filter(
+            kind="summary", conversation_id=self.conversation_id, status__in=(Job.QUEUED, Job.RUNNING)
+        )
+
+    def _summary_due(self):
+        """
+        Return whether enough messages are past the summary to update it.
+        """
+        if not self.summarize or self.summary_stale:
+            return False
+        unsummarized = sum(1 for entry in self.conversation_history if not self._summarized(entry))
+        return unsummarized >= self.summary_threshold
+
+    def _request_summary(self):
+        """
+        Schedule a job updating the conversation's summary once it is due, unless one is pending.
+        """
+        if not self._summary_due():
+            return
+        self.summary_stale = True
+        if not self._summary_jobs().exists():
+            self.pending_jobs.append(new_job("summary", {}, conversation_id=self.conversation_id))
+
+    def get_turn_context_report(self):
+        """
+        Summarize the tokens sent to the LLM during the current turn.
+        """
+        return {
+            "llm_calls": len(self.turn_context_tokens),
+            "context_tokens": sum(report["total_tokens"] for report in self.turn_context_tokens),
+            "calls": self.turn_context_tokens,
+            "usage": summarize_usage(self.turn_usage),
+            "jobs": self.turn_jobs,
+        }
+
+    def _start_turn(self):
+        """
+        Reset the per-turn token report and mark where the new turn starts in the history.
+        """
+        self.turn_context_tokens = []
+        self.turn_usage = []
+        self.turn_tool = None
+        self.turn_jobs = []
+        self.turn_start = len(self.conversation_history)
+
+    def _end_turn(self):
+        """
+        Persist the turn's buffered messages, including after a failed turn, then enqueue its jobs
+        (including a summary update, if due).
+        """
+        self._attach_leftover_usage()
+        self._flush_messages()
+        self._request_summary()
+        jobs, self.pending_jobs = self.pending_jobs, []
+        if jobs:
+            Job.objects.bulk_create(jobs)
+
+    def _build_tool_prompt(self):
+        """
+        Build the prompt used to decide whether a tool should be used.
+        """
+        return f"""
         {self.system_prompt}
 
         Based on the conversation so far, determine if any of the available tools would help answer the user's latest query.
         Respond with a JSON object in the format:
         {{ "tool": "<tool_name>" }}
         If no tool is needed, respond with: {{}}
-        Conversation so far: {self.conversation_history}
         """
 
+    def _parse_tool_response(self, response):
+        """
+        Extract the tool name from the LLM's tool identification response, a JSON object such as
+        {"tool": "search_places"}; None if it names no tool or is malformed.
+        """
+        try:
+            tool_name = json.loads(response).get("tool")
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            logger.warning("Unparseable tool identification response %r: %s", response, e)
+            return None
+        return tool_name if isinstance(tool_name, str) else None
+
+    def _routing_context(self):
+        """
+        Return the user message of the previous turn, routed along with the current one so that
+        follow-ups (e.g. "what about Denver?") are understood; "" on the first turn.
+        """
+        for entry in reversed(self.conversation_history[: self.turn_start]):
+            if entry["role"] == "user" and not entry["tool"]:
+                return entry["content"]
+        return ""
+
+    def _record_routing(self, tool_name, started=None):
+        """
+        Log the LLM's routing decision for the current turn as a training example of the local router.
+        """
+        if tool_name is None or tool_name in self.tool_registry:
+            latency_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+            self.router.record(
+                self.conversation_history[self.turn_start]["content"], tool_name, "llm",
+                context=self._routing_context(), latency_ms=latency_ms,
+            )
+
+    @traced("agent.identify_tool")
+    def identify_tool(self):
+        """
+        Determine if the user's input would benefit from using a tool.
+
+        Messages the local router classifies confidently are decided without an LLM call; the
+        others are decided by the LLM, whose decision trains the router.
+        """
+        decided, tool_name, _ = self.router.route(
+            self.conversation_history[self.turn_start]["content"], self.routing_tools, self._routing_context()
+        )
+        if decided:
+            return tool_name
+
+        started = time.perf_counter()
+        prompt = self._build_tool_prompt()
         response = self.llm.query(
             prompt=prompt,
-            conversation_history=self.conversation_history,
+            conversation_history=self._build_context(prompt),
+            cache_step="routing",
+            on_usage=self._record_usage,
             response_format={"type": "json_object"},
         )
+        tool_name = self._parse_tool_response(response)
+        self._record_routing(tool_name, started)
+        return tool_name
 
+    def _parse_tool_arguments(self, tool_call, user_input):
+        """
+        Decode a tool call's JSON arguments, falling back to the raw user input as the query.
+        """
         try:
-            response = eval(response)  # Convert response string to dictionary
-            return response.get("tool", None)
-        except (SyntaxError, ValueError) as e:
-            print(f"Error parsing tool identification response: {e}")
+            arguments = json.loads(tool_call["arguments"] or "{}")
+            if isinstance(arguments, dict):
+                return arguments
+        except json.JSONDecodeError as e:
+            print(f"Error parsing tool call arguments: {e}")
+        return {"query": user_input}
+
+    def _check_tool_arguments(self, tool_name, tool_info, arguments):
+        """
+        Check the LLM's arguments of a tool call against the parameters of the tool's ToolMethod.
+        Undeclared arguments (hallucinated or misspelled) are dropped; missing ones make the call
+        fail with an error result for the LLM rather than a TypeError failing the turn.
+
+        :return: Tuple of (arguments to call the tool with, error result or None).
+        """
+        parameters = tool_info["parameters"]
+        unknown = sorted(set(arguments) - set(parameters))
+        if unknown:
+            print(f"Ignoring unknown arguments of tool '{tool_name}': {', '.join(unknown)}")
+            arguments = {name: value for name, value in arguments.items() if name in parameters}
+        missing = [name for name in parameters if name not in arguments]
+        if missing:
+            return arguments, tool_error(tool_name, f"Missing arguments: {', '.join(missing)}", **arguments)
+        return arguments, None
+
+    def _tool_call_messages(self, content, tool_calls, tool_results):
+        """
+        Build the messages replaying a function-calling turn to the LLM: the assistant message with
+        its tool calls, then one "tool" message per call with its rendered result.
+        """
+        messages = [{
+            "role": "assistant",
+            "content": content,
+            "tool_calls": [
+                {
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call["arguments"]},
+                }
+                for call in tool_calls
+            ],
+        }]
+        messages.extend(
+            {"role": "tool", "tool_call_id": call["id"], "content": result}
+            for call, result in zip(tool_calls, tool_results)
+        )
+        return messages
+
+    def _speculate_tool(self, user_input):
+        """
+        Start the tool the speculator expects routing to pick for `user_input`, if any.
+        """
+        tool_name = self.speculator.choose(user_input, self.routing_tools, self.router, self._routing_context())
+        if tool_name is None:
             return None
+        return self.speculator.speculate(tool_name, self.tool_registry[tool_name]["method"], user_input)
+
+    def _identify_tool_speculatively(self, user_input):
+        """
+        Run `identify_tool` while the expected tool runs speculatively (see utils/speculation.py).
+
+        :return: The routed tool name, and the speculation if it ran that tool (None otherwise).
+        """
+        speculation = self._speculate_tool(user_input)
+        try:
+            tool_name = self.identify_tool()
+        except BaseException:
+            if speculation is not None:
+                speculation.discard()
+            raise
+        if speculation is not None and not speculation.matches(tool_name, user_input):
+            speculation.discard()
+            speculation = None
+        return tool_name, speculation
+
+    def _defer_tool(self, tool_name, query, arguments):
+        """
+        Schedule the tool call as a background job, enqueued when the turn ends, and return the
+        note the LLM gets in place of the tool's result.
+        """
+        job = new_job(
+            "tool_call",
+            {"session_id": str(self.session_id), "tool": tool_name, "query": query, "arguments": arguments},
+            conversation_id=self.conversation_id,
+        )
+        self.pending_jobs.append(job)
+        self.turn_jobs.append(str(job.pk))
+        return (
+            f"The {tool_name} tool is still running in the background (job {job.pk}). Tell the user "
+            f"its results will be added to this conversation as soon as they are ready."
+        )
+
+    def _continued_cursor(self, tool_name, arguments):
+        """
+        Return the cursor whose next results the tool call asks for (see utils/cursors.py), if any.
+        """
+        cursor = self.cursors.get(tool_name)
+        return cursor if cursor is not None and cursor.continues(tool_name, arguments) else None
+
+    def _open_cursor(self, tool_name, iter_method, arguments, result):
+        """
+        Open a cursor past the rows of a paginated tool's result, so a follow-up call continues from there.
+
+        :param iter_method: The tool's row generator (see `ToolRegistry.load_registry`), or None.
+        """
+        if iter_method is None or not is_tool_result(result) or "rows" not in result:
+            return
+        shown = min(len(result["rows"]), self.result_encoder.top_k)
+        self.cursors[tool_name] = ToolCursor(tool_name, arguments, iter_method(**arguments), offset=shown)
 
-    def use_tool(self, tool_name, query):
+    @traced("agent.use_tool")
+    def use_tool(self, tool_name, query=None, arguments=None, speculation=None):
         """
-        Use a tool, save its result, and return the result for integration into the response.
+        Use a tool, save its result, and return the rendered result for integration into the response.
+        Identical calls in flight in other sessions of the worker are joined rather than repeated
+        (see utils/singleflight.py). Calls of the background tools are deferred to a job instead
+        (see utils/jobs.py). "Show me more" follow-ups of a paginated tool return its next
+        results (see utils/cursors.py).
+
+        :param query: Raw query string passed as the tool's only argument (classic routing).
+        :param arguments: Dict of typed keyword arguments for the tool (function calling), checked
+                          against the tool's parameters.
+        :param speculation: Speculation already running this call, whose result is used instead.
         """
         tool_info = self.tool_registry.get(tool_name)
         if not tool_info:
             return f"Error: Tool '{tool_name}' not found."
+        self.turn_tool = self.turn_tool or tool_name
+
+        if arguments is not None:
+            arguments, error = self._check_tool_arguments(tool_name, tool_info, arguments)
+            if error is not None:
+                return self._save_tool_result(tool_info, error)
+
+        call_arguments = arguments if arguments is not None else {"query": query}
+        cursor = self._continued_cursor(tool_name, call_arguments)
+        if cursor is not None:
+            if speculation is not None:
+                speculation.discard()
+            return self._save_tool_result(tool_info, cursor.take(self.result_encoder.top_k))
+
+        if speculation is None and tool_name in self.background_tools:
+            return self._defer_tool(tool_name, query, arguments)
 
         tool_method = tool_info["method"]
-        tool_result = tool_method(query)
+        if arguments is not None:
+            def call():
+                return self.tool_calls.do(make_cache_key(tool_name, arguments), lambda: tool_method(**arguments))
+        else:
+            def call():
+                return self.tool_calls.do(make_cache_key(tool_name, {"query": query}), lambda: tool_method(query))
+        # A failed speculative call is run again the regular way
+        result = speculation.result(fallback=call) if speculation is not None else call()
+        self._open_cursor(tool_name, tool_info.get("iter_method"), call_arguments, result)
+        return self._save_tool_result(tool_info, result)
 
-        # Save tool result to the conversation
-        tool_instance = ToolMethod.objects.filter(name=tool_name).first()
+    def _save_tool_result(self, tool_info, result):
+        """
+        Save a tool's result to the conversation and return its rendering for the LLM.
+        """
+        # Save the structured result to the conversation; the LLM gets its compact rendering
+        content, tool_result, rendered = self._prepare_tool_result(result)
         self._save_message(
             sender="assistant",
-            content=f"Tool result: {tool_result}",
-            tool=tool_instance,
+            content=content,
+            tool_id=tool_info["tool_id"],
+            tool_result=tool_result,
         )
 
-        return tool_result
+        return rendered
 
-    def respond_conversationally(self, tool_result=None):
+    def _build_response_prompt(self, tool_result=None):
         """
-        Generate a conversational response, optionally incorporating tool results.
+        Build the prompt used to generate the assistant's conversational reply.
         """
-        prompt = f"""
+        return f"""
         {self.system_prompt}
 
         Tool result: {tool_result if tool_result else "None"}
 
         """
 
+    @traced("agent.respond_conversationally")
+    def respond_conversationally(self, tool_result=None, tool_messages=None):
+        """
+        Generate a conversational response, optionally incorporating tool results.
+
+        :param tool_result: Rendered tool result, passed in the prompt (classic routing).
+        :param tool_messages: Tool call and result messages of the turn (function calling, see `_tool_call_messages`).
+        """
+        prompt = self.system_prompt if tool_messages else self._build_response_prompt(tool_result)
         response = self.llm.query(
             prompt=prompt,
-            conversation_history=self.conversation_history,
+            conversation_history=self._build_context(prompt, tool_messages=tool_messages),
+            cache_step="answer",
+            on_usage=self._record_usage,
         )
 
         self._save_message(sender="assistant", content=response)
         return response
 
+    @traced("agent.stream_response")
+    def stream_response(self, tool_result=None, tool_messages=None):
+        """
+        Stream a conversational response token by token, saving the full message once complete.
+        Takes the arguments of `respond_conversationally`.
+        """
+        tokens = []
+        prompt = self.system_prompt if tool_messages else self._build_response_prompt(tool_result)
+        for token in self.llm.stream_query(
+            prompt=prompt,
+            conversation_history=self._build_context(prompt, tool_messages=tool_messages),
+            cache_step="answer",
+            on_usage=self._record_usage,
+        ):
+            tokens.append(token)
+            yield token
+
+        self._save_message(sender="assistant", content="".join(tokens))
+
+    def _respond_with_function_calling(self, user_input):
+        """
+        Route and answer in one LLM call: the model either replies directly or requests tool
+        calls, in which case the tools run and a second call composes the reply from the tool
+        calls and their results, sent back as "tool" messages.
+        """
+        content, tool_calls = self.llm.query_with_tools(
+            prompt=self.system_prompt,
+            conversation_history=self._build_context(self.system_prompt, tools=self.tool_schemas),
+            cache_step="tool_routing",
+            on_usage=self._record_usage,
+            tools=self.tool_schemas,
+        )
+        self._record_routing(tool_calls[0]["name"] if tool_calls else None)
+        if not tool_calls:
+            self._save_message(sender="assistant", content=content)
+            return content
+
+        tool_results = [
+            str(self.use_tool(call["name"], arguments=self._parse_tool_arguments(call, user_input)))
+            for call in tool_calls
+        ]
+        return self.respond_conversationally(tool_messages=self._tool_call_messages(content, tool_calls, tool_results))
+
+    def complete_background_tool(self, tool_name, query=None, arguments=None):
+        """
+        Run a tool call deferred by an earlier turn, then add its result and a reply presenting it
+        to the conversation. Called by the job worker.
+        """
+        self._start_turn()
+        try:
+            tool_result = self.use_tool(tool_name, query=query, arguments=arguments)
+            return self.respond_conversationally(tool_result=str(tool_result))
+        finally:
+            self._end_turn()
+
     def process_user_input(self, user_input):
         """
         Main method to process user input and determine the appropriate response.
         """
-        self._save_message(sender="user", content=user_input)
-        self.conversation_history.append({"role": "user", "content": user_input})
+        self._start_turn()
+        try:
+            self._save_message(sender="user", content=user_input)
+            return self._respond(user_input)
+        finally:
+            self._end_turn()
 
-        # Decide whether a tool is needed
-        tool_name = self.identify_tool()
+    def _respond(self, user_input):
+        """
+        Decide whether a tool is needed and generate the reply to the latest user message.
+        """
+        if self.routing_mode == "function_calling":
+            return self._respond_with_function_calling(user_input)
+
+        # Decide whether a tool is needed, running the likely tool meanwhile
+        tool_name, speculation = self._identify_tool_speculatively(user_input)
         if tool_name:
-            tool_result = self.use_tool(tool_name, query=user_input)
+            tool_result = self.use_tool(tool_name, query=user_input, speculation=speculation)
             # Incorporate tool result into the response
             return self.respond_conversationally(tool_result=tool_result)
         else:
-            return self.respond_conversationally()
\ No newline at end of file
+            return self.respond_conversationally()
+
+    def _stream_with_function_calling(self, user_input):
+        """
+        Streaming variant of `_respond_with_function_calling`, yielding the same events as
+        `process_user_input_stream`. A direct answer streams from the routing call itself.
+        """
+        tokens = []
+        tool_calls = []
+        for kind, value in self.llm.stream_query_with_tools(
+            prompt=self.system_prompt,
+            conversation_history=self._build_context(self.system_prompt, tools=self.tool_schemas),
+            cache_step="tool_routing",
+            on_usage=self._record_usage,
+            tools=self.tool_schemas,
+        ):
+            if kind == "token":
+                tokens.append(value)
+                yield {"event": "token", "content": value}
+            else:
+                tool_calls = value
+
+        self._record_routing(tool_calls[0]["name"] if tool_calls else None)
+        if not tool_calls:
+            message = "".join(tokens)
+            self._save_message(sender="assistant", content=message)
+            yield {"event": "done", "message": message, "context": self.get_turn_context_report()}
+            return
+
+        tool_results = []
+        for call in tool_calls:
+            yield {"event": "tool_started", "tool": call["name"]}
+            arguments = self._parse_tool_arguments(call, user_input)
+            tool_results.append(str(self.use_tool(call["name"], arguments=arguments)))
+            yield {"event": "tool_finished", "tool": call["name"]}
+
+        content = "".join(tokens) or None
+        tokens = []
+        for token in self.stream_response(tool_messages=self._tool_call_messages(content, tool_calls, tool_results)):
+            tokens.append(token)
+            yield {"event": "token", "content": token}
+
+        yield {"event": "done", "message": "".join(tokens), "context": self.get_turn_context_report()}
+
+    def process_user_input_stream(self, user_input):
+        """
+        Streaming variant of `process_user_input`.
+
+        Yields progress events as dicts with an "event" key: "routing" before the tool decision,
+        "tool_started"/"tool_finished" around a tool call, one "token" per content delta of the
+        reply, and a final "done" event carrying the complete message.
+        """
+        self._start_turn()
+        try:
+            self._save_message(sender="user", content=user_input)
+            yield from self._respond_stream(user_input)
+        finally:
+            self._end_turn()
+
+    def _respond_stream(self, user_input):
+        """
+        Streaming variant of `_respond`, yielding the events of `process_user_input_stream`.
+        """
+        yield {"event": "routing"}
+        if self.routing_mode == "function_calling":
+            yield from self._stream_with_function_calling(user_input)
+            return
+
+        tool_name, speculation = self._identify_tool_speculatively(user_input)
+
+        tool_result = None
+        if tool_name:
+            yield {"event": "tool_started", "tool": tool_name}
+            tool_result = self.use_tool(tool_name, query=user_input, speculation=speculation)
+            yield {"event": "tool_finished", "tool": tool_name}
+
+        tokens = []
+        for token in self.stream_response(tool_result=tool_result):
+            tokens.append(token)
+            yield {"event": "token", "content": token}
+
+        yield {"event": "done", "message": "".join(tokens), "context": self.get_turn_context_report()}
+
+
+class AsyncTravelAgent(TravelAgent):
+    """
+    Async twin of TravelAgent for the ASGI entry point.
+
+    Uses an async LLM client (see `AsyncChatGPT`), async ORM calls and async tool methods, so a
+    single process can serve many in-flight conversations. Cancelling the task that awaits
+    `process_user_input` cancels the in-flight LLM or tool request with it.
+
+    Construct instances with `await AsyncTravelAgent.create(llm, session_id)`.
+    """
+
+    def __init__(self, llm, session_id, registry, conversation_id, messages, store=None):
+        self._init_state(llm, session_id, registry, store)
+        self.conversation_id = conversation_id
+        self.conversation_history = self._history_from_messages(messages)
+
+    @classmethod
+    async def create(cls, llm, session_id, store=None):
+        """
+        Load the tool registry and conversation for the session, then build the agent.
+        """
+        store = store or get_conversation_store()
+        registry = await sync_to_async(get_cached_registry)()
+        conversation_id = await store.aget_or_create_conversation(session_id)
+        messages = await store.ahistory(conversation_id, limit=getattr(settings, "AGENT_HISTORY_LIMIT", None))
+        agent = cls(llm, session_id, registry, conversation_id, messages, store)
+        await agent._load_summary()
+        return agent
+
+    async def refresh(self, check_history=True, llm=None):
+        """
+        Async version of `TravelAgent.refresh`. Pass the request's `llm`: the AsyncOpenAI client
+        of the one the agent was built with belongs to the event loop of an earlier request.
+        """
+        if llm is not None:
+            self.llm = llm
+        registry = await sync_to_async(get_cached_registry)()
+        if registry is not self.registry:
+            self._load_tools(registry)
+        if (
+            check_history
+            and not self.message_writer.has_pending(self.conversation_id)
+            and await self.store.alatest_message_id(self.conversation_id) != self.last_message_id
+        ):
+            messages = await self.store.ahistory(self.conversation_id, limit=self.history_limit)
+            self.conversation_history = self._history_from_messages(messages)
+            self.summary_stale = True
+        if self.summary_stale:
+            await self._load_summary()
+
+    async def _load_summary(self):
+        """
+        Async version of `TravelAgent._load_summary`.
+        """
+        if self.summarize:
+            self.summary, self.summary_through = await self.store.asummary(self.conversation_id)
+        self.summary_stale = False
+
+    async def _request_summary(self):
+        """
+        Async version of `TravelAgent._request_summary`.
+        """
+        if not self._summary_due():
+            return
+        self.summary_stale = True
+        if not await self._summary_jobs().aexists():
+            self.pending_jobs.append(new_job("summary", {}, conversation_id=self.conversation_id))
+
+    async def _save_message(self, sender, content, tool_id=None, tool_result=None):
+        """
+        Async version of `TravelAgent._save_message`.
+        """
+        message = self._new_message(sender, content, tool_id=tool_id, tool_result=tool_result)
+        self._attach_usage(message)
+        self.pending_messages.append(message)
+        self._append_to_history(message)
+        if not self.message_writer.write_behind:
+            await self._flush_messages()
+        return message
+
+    async def _flush_messages(self):
+        """
+        Hand the buffered messages to the writer, writing them from a thread if durability is 'sync'.
+        """
+        messages, self.pending_messages = self.pending_messages, []
+        if not messages:
+            return
+        if self.message_writer.durability == "sync":
+            await sync_to_async(self.message_writer.write)(
+                messages, on_saved=self._on_messages_saved, store=self.store
+            )
+        else:
+            self.message_writer.write(messages, on_saved=self._on_messages_saved, store=self.store)
+
+    async def _end_turn(self):
+        """
+        Async version of `TravelAgent._end_turn`.
+        """
+        self._attach_leftover_usage()
+        await self._flush_messages()
+        await self._request_summary()
+        jobs, self.pending_jobs = self.pending_jobs, []
+        if jobs:
+            await Job.objects.abulk_create(jobs)
+
+    @traced("agent.identify_tool")
+    async def identify_tool(self):
+        """
+        Async version of `TravelAgent.identify_tool`.
+        """
+        decided, tool_name, _ = self.router.route(
+            self.conversation_history[self.turn_start]["content"], self.routing_tools, self._routing_context()
+        )
+        if decided:
+            return tool_name
+
+        started = time.perf_counter()
+        prompt = self._build_tool_prompt()
+        response = await self.llm.query(
+            prompt=prompt,
+            conversation_history=self._build_context(prompt),
+            cache_step="routing",
+            on_usage=self._record_usage,
+            response_format={"type": "json_object"},
+        )
+        tool_name = self._parse_tool_response(response)
+        self._record_routing(tool_name, started)
+        return tool_name
+
+    def _speculate_tool(self, user_input):
+        """
+        Async version of `TravelAgent._speculate_tool`, starting the tool as a task of the event loop.
+        """
+        tool_name = self.speculator.choose(user_input, self.routing_tools, self.router, self._routing_context())
+        if tool_name is None:
+            return None
+        tool_info = self.tool_registry[tool_name]
+        return self.speculator.aspeculate(tool_name, tool_info["method"], tool_info.get("async_method"), user_input)
+
+    async def _identify_tool_speculatively(self, user_input):
+        """
+        Async version of `TravelAgent._identify_tool_speculatively`.
+        """
+        speculation = self._speculate_tool(user_input)
+        try:
+            tool_name = await self.identify_tool()
+        except BaseException:
+            if speculation is not None:
+                speculation.discard()
+            raise
+        if speculation is not None and not speculation.matches(tool_name, user_input):
+            speculation.discard()
+            speculation = None
+        return tool_name, speculation
+
+    @traced("agent.use_tool")
+    async def use_tool(self, tool_name, query=None, arguments=None, speculation=None):
+        """
+        Use a tool, save its result, and return the rendered result for integration into the response.
+
+        Tools providing an async method (e.g. `asearch_places`) are awaited directly; others run in
+        a worker thread so they do not block the event loop.
+        """
+        tool_info = self.tool_registry.get(tool_name)
+        if not tool_info:
+            return f"Error: Tool '{tool_name}' not found."
+        self.turn_tool = self.turn_tool or tool_name
+
+        if arguments is not None:
+            arguments, error = self._check_tool_arguments(tool_name, tool_info, arguments)
+            if error is not None:
+                return await self._save_tool_result(tool_info, error)
+
+        call_arguments = arguments if arguments is not None else {"query": query}
+        cursor = self._continued_cursor(tool_name, call_arguments)
+        if cursor is not None:
+            if speculation is not None:
+                speculation.discard()
+            if cursor.is_async:
+                result = await cursor.atake(self.result_encoder.top_k)
+            else:
+                result = await sync_to_async(cursor.take, thread_sensitive=False)(self.result_encoder.top_k)
+            return await self._save_tool_result(tool_info, result)
+
+        if speculation is None and tool_name in self.background_tools:
+            return self._defer_tool(tool_name, query, arguments)
+
+        tool_method = tool_info.get("async_method") or sync_to_async(tool_info["method"], thread_sensitive=False)
+        if arguments is not None:
+            def call():
+                return self.tool_calls.ado(make_cache_key(tool_name, arguments), lambda: tool_method(**arguments))
+        else:
+            def call():
+                return self.tool_calls.ado(make_cache_key(tool_name, {"query": query}), lambda: tool_method(query))
+        result = await (speculation.aresult(fallback=call) if speculation is not None else call())
+        self._open_cursor(
+            tool_name, tool_info.get("async_iter_method") or tool_info.get("iter_method"), call_arguments, result
+        )
+        return await self._save_tool_result(tool_info, result)
+
+    async def _save_tool_result(self, tool_info, result):
+        """
+        Async version of `TravelAgent._save_tool_result`.
+        """
+        # Save the structured result to the conversation; the LLM gets its compact rendering
+        content, tool_result, rendered = self._prepare_tool_result(result)
+        await self._save_message(
+            sender="assistant",
+            content=content,
+            tool_id=tool_info["tool_id"],
+            tool_result=tool_result,
+        )
+
+        return rendered
+
+    @traced("agent.respond_conversationally")
+    async def respond_conversationally(self, tool_result=None, tool_messages=None):
+        """
+        Generate a conversational response, optionally incorporating tool results.
+        """
+        prompt = self.system_prompt if tool_messages else self._build_response_prompt(tool_result)
+        response = await self.llm.query(
+            prompt=prompt,
+            conversation_history=self._build_context(prompt, tool_messages=tool_messages),
+            cache_step="answer",
+            on_usage=self._record_usage,
+        )
+
+        await self._save_message(sender="assistant", content=response)
+        return response
+
+    @traced("agent.stream_response")
+    async def stream_response(self, tool_result=None, tool_messages=None):
+        """
+        Stream a conversational response token by token, saving the full message once complete.
+        """
+        tokens = []
+        prompt = self.system_prompt if tool_messages else self._build_response_prompt(tool_result)
+        async for token in self.llm.stream_query(
+            prompt=prompt,
+            conversation_history=self._build_context(prompt, tool_messages=tool_messages),
+            cache_step="answer",
+            on_usage=self._record_usage,
+        ):
+            tokens.append(token)
+            yield token
+
+        await self._save_message(sender="assistant", content="".join(tokens))
+
+    async def _respond_with_function_calling(self, user_input):
+        """
+        Async version of `TravelAgent._respond_with_function_calling`.
+        """
+        content, tool_calls = await self.llm.query_with_tools(
+            prompt=self.system_prompt,
+            conversation_history=self._build_context(self.system_prompt, tools=self.tool_schemas),
+            cache_step="tool_routing",
+            on_usage=self._record_usage,
+            tools=self.tool_schemas,
+        )
+        self._record_routing(tool_calls[0]["name"] if tool_calls else None)
+        if not tool_calls:
+            await self._save_message(sender="assistant", content=content)
+            return content
+
+        tool_results = [
+            str(await self.use_tool(call["name"], arguments=self._parse_tool_arguments(call, user_input)))
+            for call in tool_calls
+        ]
+        return await self.respond_conversationally(
+            tool_messages=self._tool_call_messages(content, tool_calls, tool_results)
+        )
+
+    async def process_user_input(self, user_input):
+        """
+        Main method to process user input and determine the appropriate response.
+        """
+        self._start_turn()
+        try:
+            await self._save_message(sender="user", content=user_input)
+            return await self._respond(user_input)
+        finally:
+            await self._end_turn()
+
+    async def _respond(self, user_input):
+        """
+        Async version of `TravelAgent._respond`.
+        """
+        if self.routing_mode == "function_calling":
+            return await self._respond_with_function_calling(user_input)
+
+        tool_name, speculation = await self._identify_tool_speculatively(user_input)
+        if tool_name:
+            tool_result = await self.use_tool(tool_name, query=user_input, speculation=speculation)
+            return await self.respond_conversationally(tool_result=tool_result)
+        else:
+            return await self.respond_conversationally()
+
+    async def _stream_with_function_calling(self, user_input):
+        """
+        Async version of `TravelAgent._stream_with_function_calling`.
+        """
+        tokens = []
+        tool_calls = []
+        async for kind, value in self.llm.stream_query_with_tools(
+            prompt=self.system_prompt,
+            conversation_history=self._build_context(self.system_prompt, tools=self.tool_schemas),
+            cache_step="tool_routing",
+            on_usage=self._record_usage,
+            tools=self.tool_schemas,
+        ):
+            if kind == "token":
+                tokens.append(value)
+                yield {"event": "token", "content": value}
+            else:
+                tool_calls = value
+
+        self._record_routing(tool_calls[0]["name"] if tool_calls else None)
+        if not tool_calls:
+            message = "".join(tokens)
+            await self._save_message(sender="assistant", content=message)
+            yield {"event": "done", "message": message, "context": self.get_turn_context_report()}
+            return
+
+        tool_results = []
+        for call in tool_calls:
+            yield {"event": "tool_started", "tool": call["name"]}
+            arguments = self._parse_tool_arguments(call, user_input)
+            tool_results.append(str(await self.use_tool(call["name"], arguments=arguments)))
+            yield {"event": "tool_finished", "tool": call["name"]}
+
+        content = "".join(tokens) or None
+        tokens = []
+        async for token in self.stream_response(
+            tool_messages=self._tool_call_messages(content, tool_calls, tool_results)
+        ):
+            tokens.append(token)
+            yield {"event": "token", "content": token}
+
+        yield {"event": "done", "message": "".join(tokens), "context": self.get_turn_context_report()}
+
+    async def process_user_input_stream(self, user_input):
+        """
+        Async variant of `TravelAgent.process_user_input_stream`, yielding the same events.
+        """
+        self._start_turn()
+        try:
+            await self._save_message(sender="user", content=user_input)
+            async for event in self._respond_stream(user_input):
+                yield event
+        finally:
+            await self._end_turn()
+
+    async def _respond_stream(self, user_input):
+        """
+        Async version of `TravelAgent._respond_stream`.
+        """
+        yield {"event": "routing"}
+        if self.routing_mode == "function_calling":
+            async for event in self._stream_with_function_calling(user_input):
+                yield event
+            return
+
+        tool_name, speculation = await self._identify_tool_speculatively(user_input)
+
+        tool_result = None
+        if tool_name:
+            yield {"event": "tool_started", "tool": tool_name}
+            tool_result = await self.use_tool(tool_name, query=user_input, speculation=speculation)
+            yield {"event": "tool_finished", "tool": tool_name}
+
+        tokens = []
+        async for token in self.stream_response(tool_result=tool_result):
+            tokens.append(token)
+            yield {"event": "token", "content": token}
+
+        yield {"event": "done", "message": "".join(tokens), "context": self.get_turn_context_report()}
+
+
+@job_handler("tool_call")
+def run_tool_call(job):
+    """
+    Run a tool call deferred by an agent and fold its result into the conversation. The session's
+    live agents notice the new messages when they next verify their history.
+    """
+    agent = TravelAgent(ChatGPT(), job.payload["session_id"])
+    agent.background_tools = set()
+    message = agent.complete_background_tool(
+        job.payload["tool"], query=job.payload.get("query"), arguments=job.payload.get("arguments"),
+    )
+    agent.message_writer.drain()
+    return {"tool": job.payload["tool"], "message": message}
@@ -0,0 +1,466 @@
+import asyncio
+import json
+import math
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection
+
+from utils.agent import TravelAgent
+from utils.cache import ToolResultCache
+from utils.context import count_tokens
+from utils.llm import ChatGPT
+from utils.ratelimit import ProviderLimiter
+from utils.registry import ToolRegistry
+from utils.response_cache import ResponseCache
+from utils.router import ToolRouter
+from utils.speculation import ToolSpeculator
+from utils.tools import GooglePlacesTool
+
+# Defaults of the fake backends driven by the agent benchmark
+DEFAULT_AGENT_BENCHMARK = {
+    "LLM_LATENCY_MS": (0, 0),  # Mean and standard deviation of an LLM call's simulated latency
+    "TOOL_LATENCY_MS": (0, 0),  # Mean and standard deviation of a Places API call's simulated latency
+    "REPLY_WORDS": 60,  # Words in each fake LLM reply
+    "PLACES_RESULTS": 20,  # Places in each fake Places API response (the API's page size)
+}
+
+# Words in a user message that make the fake LLM route to search_places
+PLACES_TRIGGERS = ("restaurant", "museum", "hotel", "things to do", "coffee")
+
+CITIES = ["Boston", "Denver", "Chicago", "Lisbon", "Kyoto", "Austin", "Rome", "Seattle", "Montreal", "Oaxaca"]
+
+# User messages of the scripted conversations; the first group needs a tool, the second does not
+PLACES_MESSAGES = [
+    "Can you find good restaurants in {city}?",
+    "What museums should I visit in {city}?",
+    "Any hotels near downtown {city}?",
+    "What are some things to do in {city} this weekend?",
+    "Where can I get coffee in {city}?",
+]
+CHAT_MESSAGES = [
+    "What's the best time of year to visit {city}?",
+    "How many days should I spend in {city}?",
+    "Is {city} expensive for tourists?",
+    "Thanks, that helps a lot!",
+    "What should I pack for a trip to {city}?",
+]
+
+WORDS = (
+    "the city has plenty of great options for travelers and you could start with a walk through the old "
+    "town before lunch then visit a few local spots that are popular in the evening"
+).split()
+
+
+class Latency:
+    """
+    Simulated latency drawn from a log-normal distribution with the given mean and standard deviation.
+    """
+
+    def __init__(self, mean_ms=0, stdev_ms=0, rng=None):
+        self.mean_ms = mean_ms
+        self.stdev_ms = stdev_ms
+        self.rng = rng or random.Random(0)
+
+    def sample(self):
+        """
+        Return a latency in seconds.
+        """
+        if self.mean_ms <= 0:
+            return 0.0
+        if self.stdev_ms <= 0:
+            return self.mean_ms / 1000
+        sigma = math.sqrt(math.log(1 + (self.stdev_ms / self.mean_ms) ** 2))
+        return self.rng.lognormvariate(math.log(self.mean_ms) - sigma ** 2 / 2, sigma) / 1000
+
+
+def _latest_user_message(messages):
+    return next((message["content"] for message in reversed(messages) if message["role"] == "user"), "")
+
+
+class FakeCompletions:
+    """
+    Deterministic stand-in for the chat completions endpoint of the OpenAI client.
+
+    Messages mentioning a PLACES_TRIGGERS word are routed to search_places, both for classic routing
+    (JSON response format) and function calling; every other call gets a reply of `reply_words` words.
+    Each call is recorded with the size of its prompt.
+    """
+
+    def __init__(self, latency, reply_words, rng):
+        self.latency = latency
+        self.reply_words = reply_words
+        self.rng = rng
+        self.calls = []  # One dict per call: messages, chars, tokens, seconds
+
+    def _reply(self, messages, response_format=None, tools=None):
+        text = _latest_user_message(messages)
+        use_places = any(trigger in text.lower() for trigger in PLACES_TRIGGERS)
+        if response_format:
+            return SimpleNamespace(content=json.dumps({"tool": "search_places"} if use_places else {}), tool_calls=None)
+        if tools and use_places:
+            call = SimpleNamespace(
+                id=f"call_{len(self.calls)}",
+                function=SimpleNamespace(name="search_places", arguments=json.dumps({"query": text})),
+            )
+            return SimpleNamespace(content=None, tool_calls=[call])
+        words = [self.rng.choice(WORDS) for _ in range(self.reply_words)]
+        return SimpleNamespace(content=" ".join(words).capitalize() + ".", tool_calls=None)
+
+    def create(self, model=None, messages=None, response_format=None, tools=None, stream=False, **kwargs):
+        started = time.perf_counter()
+        self.calls.append({
+            "messages": len(messages),
+            "chars": sum(len(message["content"] or "") for message in messages),
+            "tokens": sum(count_tokens(message["content"]) for message in messages),
+        })
+        time.sleep(self.latency.sample())
+        message = self._reply(messages, response_format, tools)
+        self.calls[-1]["seconds"] = time.perf_counter() - started
+        usage = SimpleNamespace(
+            prompt_tokens=self.calls[-1]["tokens"],
+            completion_tokens=count_tokens(message.content or "") + sum(
+                count_tokens(call.function.arguments) for call in message.tool_calls or []
+            ),
+        )
+        if stream:
+            return self._stream(message, model or "", usage)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], model=model or "", usage=usage)
+
+    @staticmethod
+    def _stream(message, model, usage):
+        words = (message.content or "").split(" ")
+        for start in range(0, len(words) if message.content else 0, 4):
+            content = " ".join(words[start:start + 4]) + (" " if start + 4 < len(words) else "")
+            delta = SimpleNamespace(content=content, tool_calls=None)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], model=model, usage=None)
+        for index, call in enumerate(message.tool_calls or []):
+            delta = SimpleNamespace(
+                content=None,
+                tool_calls=[SimpleNamespace(index=index, id=call.id, function=call.function)],
+            )
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], model=model, usage=None)
+        yield SimpleNamespace(choices=[], model=model, usage=usage)
+
+
+class FakeChatGPT(ChatGPT):
+    """
+    ChatGPT backed by FakeCompletions instead of the OpenAI API, with its own (disabled) response cache
+    and no rate limits.
+    """
+
+    def __init__(self, latency=None, reply_words=None, seed=0, response_cache=None):
+        self.completions = FakeCompletions(
+            latency or Latency(*DEFAULT_AGENT_BENCHMARK["LLM_LATENCY_MS"]),
+            reply_words if reply_words is not None else DEFAULT_AGENT_BENCHMARK["REPLY_WORDS"],
+            random.Random(seed),
+        )
+        client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        super().__init__(
+            client=client,
+            response_cache=response_cache or ResponseCache(enabled=False),
+            limiter=ProviderLimiter("benchmark"),
+        )
+
+
+class FakeGooglePlacesTool(GooglePlacesTool):
+    """
+    GooglePlacesTool returning synthetic Places API responses, shaped like the real ones, instead of
+    calling the API. Raw responses are not cached, so every search pays the simulated latency.
+    """
+
+    def __init__(self, latency=None, results=None, seed=0):
+        super().__init__(cache=ToolResultCache(ttls={}, backend=""))
+        self.latency = latency or Latency(*DEFAULT_AGENT_BENCHMARK["TOOL_LATENCY_MS"])
+        self.results = results if results is not None else DEFAULT_AGENT_BENCHMARK["PLACES_RESULTS"]
+        self.rng = random.Random(seed)
+        self.calls = []  # Seconds spent in each fetch
+
+    def _response(self, query):
+        return {
+            "status": "OK",
+            "results": [
+                {
+                    "name": f"{query.title()} #{index + 1}",
+                    "place_id": uuid.UUID(int=self.rng.getrandbits(128)).hex,
+                    "rating": round(self.rng.uniform(3.0, 5.0), 1),
+                    "user_ratings_total": self.rng.randint(5, 5000),
+                    "formatted_address": f"{self.rng.randint(1, 999)} Main St, Springfield",
+                    "geometry": {"location": {"lat": self.rng.uniform(-90, 90), "lng": self.rng.uniform(-180, 180)}},
+                    "opening_hours": {"open_now": self.rng.random() < 0.7},
+                    "types": ["restaurant", "food", "point_of_interest", "establishment"],
+                    "photos": [{"height": 3024, "width": 4032, "photo_reference": "x" * 200}],
+                }
+                for index in range(self.results)
+            ],
+        }
+
+    def _fetch_places(self, query):
+        started = time.perf_counter()
+        time.sleep(self.latency.sample())
+        response = self._response(query)
+        self.calls.append(time.perf_counter() - started)
+        return response
+
+    async def _afetch_places(self, query):
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency.sample())
+        response = self._response(query)
+        self.calls.append(time.perf_counter() - started)
+        return response
+
+
+def script_conversation(turns, seed=0):
+    """
+    Return the user messages of a scripted conversation: a deterministic mix of place searches
+    (every third turn) and follow-up questions answered without a tool.
+    """
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        templates = PLACES_MESSAGES if turn % 3 == 0 else CHAT_MESSAGES
+        messages.append(rng.choice(templates).format(city=rng.choice(CITIES)))
+    return messages
+
+
+def summarize(values):
+    """
+    Return the mean, median, 95th percentile and maximum of a list of numbers.
+    """
+    if not values:
+        return {"mean": 0, "p50": 0, "p95": 0, "max": 0}
+    ordered = sorted(values)
+    return {
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": round(statistics.median(ordered), 3),
+        "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class StageTimer:
+    """
+    Accumulate the time spent in wrapped methods, per stage, for the current turn.
+    """
+
+    def __init__(self):
+        self.totals = {}
+
+    def reset(self):
+        totals, self.totals = self.totals, {}
+        return totals
+
+    def wrap(self, obj, name, stage):
+        """
+        Time every call of `obj.name` under `stage`; `stage` may be a callable of the call's kwargs.
+        """
+        method = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            key = stage(kwargs) if callable(stage) else stage
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.totals[key] = self.totals.get(key, 0.0) + (time.perf_counter() - started) * 1000
+
+        setattr(obj, name, timed)
+
+
+class QueryCounter:
+    """
+    Count the SQL statements issued by this thread, through the ORM and the SQLite conversation store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.count = 0
+
+    def _orm(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def _sqlite(self, statement):
+        self.count += 1
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self._orm)
+        self._wrapper.__enter__()
+        if hasattr(self.store, "connection"):
+            self.store.connection.set_trace_callback(self._sqlite)
+        return self
+
+    def __exit__(self, *exc_info):
+        if hasattr(self.store, "connection"):
+            self.store.connection.set_trace_callback(None)
+        self._wrapper.__exit__(*exc_info)
+
+    def take(self):
+        count, self.count = self.count, 0
+        return count
+
+
+class AgentBenchmark:
+    """
+    Drive `TravelAgent.process_user_input` over scripted conversations with fake LLM and Places
+    backends, and measure what the agent itself costs on top of them.
+
+    Each turn is split into stages that do not overlap: "context" (fitting the history into the
+    token budget), "routing" and "answer" (the LLM calls, including the simulated latency), "tool"
+    (the tool call, including the simulated API latency), "persist" (writing the turn's messages)
+    and "other" (everything else the agent does).
+    """
+
+    def __init__(self, store, llm_latency=None, tool_latency=None, reply_words=None, places_results=None,
+                 routing_mode=None, local_router=False, speculate=False, seed=0):
+        """
+        :param store: ConversationStore the agents write to.
+        :param llm_latency: Tuple of (mean, stdev) in milliseconds of an LLM call.
+        :param tool_latency: Tuple of (mean, stdev) in milliseconds of a Places API call.
+        :param routing_mode: "classic" or "function_calling"; settings.AGENT_ROUTING_MODE if None.
+        :param local_router: Let a local tool router, shared by the run's agents, skip LLM routing calls;
+                             off by default because it trains in the background, which makes runs
+                             non-deterministic.
+        :param speculate: Run the Places tool speculatively during classic routing calls (on every turn,
+                          whatever the router predicts).
+        """
+        self.store = store
+        self.llm_latency = llm_latency or DEFAULT_AGENT_BENCHMARK["LLM_LATENCY_MS"]
+        self.tool_latency = tool_latency or DEFAULT_AGENT_BENCHMARK["TOOL_LATENCY_MS"]
+        self.reply_words = reply_words
+        self.places_results = places_results
+        self.routing_mode = routing_mode or getattr(settings, "AGENT_ROUTING_MODE", "classic")
+        self.local_router = local_router
+        self.router = ToolRouter(enabled=local_router, recording=local_router)
+        self.speculator = ToolSpeculator(enabled=speculate, policy="always")
+        self.seed = seed
+        self.session_ids = []  # Sessions created, for cleanup
+
+    def _build_agent(self, simulate_latency=True):
+        rng = random.Random(self.seed)
+        llm = FakeChatGPT(
+            latency=Latency(*self.llm_latency, rng=rng) if simulate_latency else Latency(),
+            reply_words=self.reply_words,
+            seed=self.seed,
+        )
+        places = FakeGooglePlacesTool(
+            latency=Latency(*self.tool_latency, rng=rng) if simulate_latency else Latency(),
+            results=self.places_results,
+            seed=self.seed,
+        )
+        registry = ToolRegistry()
+        registry.tool_instances["GooglePlacesTool"] = places
+        registry.get_tool_registry()
+        registry.get_tool_descriptions()
+        registry.get_tool_schemas()
+
+        session_id = uuid.uuid4()
+        self.session_ids.append(session_id)
+        agent = TravelAgent(llm, session_id, store=self.store, registry=registry)
+        agent.routing_mode = self.routing_mode
+        agent.router = self.router
+        agent.speculator = self.speculator
+        return agent, llm
+
+    def run_conversation(self, turns, per_turn=False, memory=True):
+        """
+        Run one scripted conversation of `turns` turns and return its measurements.
+
+        :param per_turn: Include the measurements of every turn, to plot growth with history length.
+        :param memory: Replay the conversation without simulated latency under tracemalloc to measure
+                       peak memory; timings are taken in a separate pass, without tracing.
+        """
+        script = script_conversation(turns, seed=self.seed)
+        timer = StageTimer()
+        agent, llm = self._build_agent()
+        for name in ("query", "query_with_tools"):
+            timer.wrap(llm, name, lambda kwargs: "answer" if kwargs.get("cache_step") == "answer" else "routing")
+        timer.wrap(agent, "_build_context", "context")
+        timer.wrap(agent, "use_tool", "tool")
+        timer.wrap(agent, "_flush_messages", "persist")
+        timer.reset()
+
+        rows = []
+        with QueryCounter(self.store) as queries:
+            for text in script:
+                calls = len(llm.completions.calls)
+                started = time.perf_counter()
+                agent.process_user_input(text)
+                agent.message_writer.drain()
+                total = (time.perf_counter() - started) * 1000
+                stages = timer.reset()
+                # The tool stage times `use_tool`, which also builds and buffers the result message
+                stages["other"] = max(total - sum(stages.values()), 0.0)
+                turn_calls = llm.completions.calls[calls:]
+                rows.append({
+                    "total_ms": total,
+                    "stages_ms": stages,
+                    "db_queries": queries.take(),
+                    "llm_calls": len(turn_calls),
+                    "prompt_tokens": sum(call["tokens"] for call in turn_calls),
+                    "max_prompt_tokens": max((call["tokens"] for call in turn_calls), default=0),
+                    "prompt_chars": sum(call["chars"] for call in turn_calls),
+                    "history_messages": len(agent.conversation_history),
+                })
+
+        result = {
+            "turns": turns,
+            "wall_ms": round(sum(row["total_ms"] for row in rows), 3),
+            "turn_ms": summarize([row["total_ms"] for row in rows]),
+            "stages_ms": {
+                stage: summarize([row["stages_ms"].get(stage, 0.0) for row in rows])
+                for stage in ("context", "routing", "tool", "answer", "persist", "other")
+            },
+            "db_queries": {
+                **summarize([row["db_queries"] for row in rows]),
+                "total": sum(row["db_queries"] for row in rows),
+            },
+            "llm_calls": sum(row["llm_calls"] for row in rows),
+            "prompt_tokens": {**summarize([row["prompt_tokens"] for row in rows]), "last": rows[-1]["prompt_tokens"]},
+            "prompt_chars": {**summarize([row["prompt_chars"] for row in rows]), "last": rows[-1]["prompt_chars"]},
+        }
+        if memory:
+            result["memory_kb"] = self._measure_memory(script)
+        if per_turn:
+            result["per_turn"] = rows
+        return result
+
+    def _measure_memory(self, script):
+        """
+        Replay `script` without simulated latency under tracemalloc; return the peak and retained memory.
+        """
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            agent, _ = self._build_agent(simulate_latency=False)
+            for text in script:
+                agent.process_user_input(text)
+                agent.message_writer.drain()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {"peak": round((peak - baseline) / 1024, 1), "retained": round((current - baseline) / 1024, 1)}
+
+    def run(self, lengths, per_turn=False, memory=True):
+        """
+        Run a scripted conversation of each length in `lengths`; return the JSON-serializable report.
+        """
+        return {
+            "config": {
+                "llm_latency_ms": list(self.llm_latency),
+                "tool_latency_ms": list(self.tool_latency),
+                "reply_words": self.reply_words or DEFAULT_AGENT_BENCHMARK["REPLY_WORDS"],
+                "places_results": self.places_results or DEFAULT_AGENT_BENCHMARK["PLACES_RESULTS"],
+                "routing_mode": self.routing_mode,
+                "local_router": self.local_router,
+                "speculate": self.speculator.enabled,
+                "store": type(self.store).__name__,
+                "seed": self.seed,
+            },
+            "runs": [self.run_conversation(turns, per_turn=per_turn, memory=memory) for turns in lengths],
+        }
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+
+from utils.metrics import metrics
+
+# Defaults for settings.TOOL_CACHE
+DEFAULT_TOOL_CACHE = {
+    "MAX_ENTRIES": 512,  # Size of the in-process LRU tier
+    "BACKEND": "tool_results",  # Alias in settings.CACHES of the tier shared by all workers
+    "TTLS": {},  # Seconds to cache each tool's results; tools not listed are not cached
+    # Tool name -> its free-text query arguments, keyed by their normalized form (see `normalize_query`)
+    # so that near-identical phrasings share cache entries; all other arguments are keyed on their exact value
+    "NORMALIZE": {},
+}
+
+# Filler words that do not change what a place search returns ("restaurants near Boston" and
+# "restaurants in Boston" share a cache entry). "me" is kept: "near me" depends on where the user is.
+QUERY_STOPWORDS = {
+    "a", "an", "the", "in", "near", "nearby", "around", "at", "by", "close", "to",
+    "of", "for", "some", "any", "please", "find", "show",
+}
+
+_events = metrics.counter(
+    "agent_tool_cache_total",
+    "Tool result cache events: memory_hit, persistent_hit, miss, eviction (in-process tier) and error (shared tier).",
+    ("tool", "event"),
+)
+
+
+_config = None
+
+
+def get_tool_cache_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_TOOL_CACHE, **getattr(settings, "TOOL_CACHE", {})}
+    return _config
+
+
+def normalize_query(text):
+    """
+    Normalize a free-text query so that near-identical phrasings map to the same key.
+    """
+    words = re.findall(r"[a-z0-9]+", str(text).lower())
+    return " ".join(word for word in words if word not in QUERY_STOPWORDS)
+
+
+def query_features(text):
+    """
+    Return the unigram and bigram features of a normalized query (see `normalize_query`).
+    """
+    words = text.split()
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def make_cache_key(tool_name, arguments):
+    """
+    Build a cache key from the tool name and its arguments, the tool's NORMALIZE arguments in
+    their normalized form.
+    """
+    free_text = get_tool_cache_config()["NORMALIZE"].get(tool_name, ())
+    normalized = {
+        name: normalize_query(value) if name in free_text and isinstance(value, str) else value
+        for name, value in sorted(arguments.items())
+    }
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+    return f"tool:{tool_name}:{digest}"
+
+
+class ToolResultCache:
+    """
+    Two-tier cache for tool results.
+
+    Lookups go to an in-process LRU first and then to a Django cache backend (a database table by
+    default) so that every worker shares hits. Entries expire after a per-tool TTL.
+    """
+
+    def __init__(self, max_entries=None, ttls=None, backend=None):
+        config = get_tool_cache_config()
+        self.max_entries = max_entries if max_entries is not None else config["MAX_ENTRIES"]
+        self.ttls = ttls if ttls is not None else config["TTLS"]
+        self.backend_alias = backend if backend is not None else config["BACKEND"]
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    def get_ttl(self, tool_name):
+        return self.ttls.get(tool_name, 0)
+
+    def _get_memory(self, tool_name, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+        _events.inc(tool=tool_name, event="memory_hit")
+        return True, value
+
+    def _set_memory(self, key, value, ttl):
+        evicted = []
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        for evicted_key in evicted:
+            # Keys read "tool:<tool name>:<digest>" (see make_cache_key)
+            _events.inc(tool=evicted_key.split(":")[1], event="eviction")
+
+    def get_or_fetch(self, tool_name, arguments, fetch):
+        """
+        Return the cached result for the tool call, or call `fetch()` and cache what it returns.
+
+        :param tool_name: Name of the tool method, used for the key and to look up its TTL.
+        :param arguments: Dict of the tool call's arguments; string values are normalized.
+        :param fetch: Zero-argument callable producing the result on a miss.
+        """
+        ttl = self.get_ttl(tool_name)
+        if not ttl:
+            return fetch()
+
+        key = make_cache_key(tool_name, arguments)
+        hit, value = self._get_memory(tool_name, key)
+        if hit:
+            return value
+
+        backend = self.backend
+        if backend is not None:
+            try:
+                value = backend.get(key)
+            except DatabaseError:
+                # The shared tier is an optimization; fall back to fetching if it is unavailable
+                value = None
+                _events.inc(tool=tool_name, event="error")
+            if value is not None:
+                self._set_memory(key, value, ttl)
+                _events.inc(tool=tool_name, event="persistent_hit")
+                return value
+
+        _events.inc(tool=tool_name, event="miss")
+        value = fetch()
+        self._set_memory(key, value, ttl)
+        if backend is not None:
+            try:
+                backend.set(key, value, timeout=ttl)
+            except DatabaseError:
+                _events.inc(tool=tool_name, event="error")
+        return value
+
+    async def aget_or_fetch(self, tool_name, arguments, fetch):
+        """
+        Async version of `get_or_fetch`; `fetch` is a zero-argument coroutine function.
+        """
+        ttl = self.get_ttl(tool_name)
+        if not ttl:
+            return await fetch()
+
+        key = make_cache_key(tool_name, arguments)
+        hit, value = self._get_memory(tool_name, key)
+        if hit:
+            return value
+
+        backend = self.backend
+        if backend is not None:
+            try:
+                value = await backend.aget(key)
+            except DatabaseError:
+                value = None
+                _events.inc(tool=tool_name, event="error")
+            if value is not None:
+                self._set_memory(key, value, ttl)
+                _events.inc(tool=tool_name, event="persistent_hit")
+                return value
+
+        _events.inc(tool=tool_name, event="miss")
+        value = await fetch()
+        self._set_memory(key, value, ttl)
+        if backend is not None:
+            try:
+                await backend.aset(key, value, timeout=ttl)
+            except DatabaseError:
+                _events.inc(tool=tool_name, event="error")
+        return value
+
+    def clear(self):
+        """
+        Drop all in-memory entries. The shared tier expires on its own.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+_tool_cache = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache():
+    """
+    Return the process-wide ToolResultCache configured from settings.TOOL_CACHE.
+    """
+    global _tool_cache
+    if _tool_cache is None:
+        with _tool_cache_lock:
+            if _tool_cache is None:
+                _tool_cache = ToolResultCache()
+    return _tool_cache
@@ -0,0 +1,195 @@
+import asyncio
+import atexit
+import os
+import threading
+
+import httpx
+import openai
+import requests
+from amadeus import Client as AmadeusClient
+from django.conf import settings
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+load_dotenv()
+
+# Defaults for settings.HTTP_CLIENTS
+DEFAULT_HTTP_CLIENTS = {
+    "POOL_SIZE": 20,  # Maximum open connections per client
+    "KEEPALIVE_CONNECTIONS": 20,  # Idle connections kept open for reuse
+    "KEEPALIVE_EXPIRY": 30.0,  # Seconds an idle connection is kept open
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 60.0,
+}
+
+_clients = {}
+_async_clients = {}  # Event loop -> {name: async client opened on that loop}
+_lock = threading.Lock()
+
+
+def _config():
+    """
+    Return the HTTP client settings, falling back to the defaults for missing keys.
+    """
+    return {**DEFAULT_HTTP_CLIENTS, **getattr(settings, "HTTP_CLIENTS", {})}
+
+
+def get_request_timeout():
+    """
+    Return the (connect, read) timeout tuple to pass to `requests` calls.
+    """
+    config = _config()
+    return (config["CONNECT_TIMEOUT"], config["READ_TIMEOUT"])
+
+
+def _httpx_options():
+    """
+    Return the connection pool limits and timeouts shared by the httpx-based clients.
+    """
+    config = _config()
+    return {
+        "limits": httpx.Limits(
+            max_connections=config["POOL_SIZE"],
+            max_keepalive_connections=config["KEEPALIVE_CONNECTIONS"],
+            keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+        ),
+        "timeout": httpx.Timeout(config["READ_TIMEOUT"], connect=config["CONNECT_TIMEOUT"]),
+    }
+
+
+def _get_or_create(name, factory):
+    """
+    Return the process-wide client registered under `name`, creating it on first use.
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _drop_closed_loops():
+    """
+    Forget the async clients of event loops that have been closed, such as the per-request loops
+    of async views run under WSGI. Their connections can no longer be used or closed from another
+    loop; the sockets are closed as the clients and their transports are garbage collected.
+    """
+    for loop in [loop for loop in _async_clients if loop.is_closed()]:
+        del _async_clients[loop]
+
+
+def _get_or_create_async(name, factory):
+    """
+    Return the async client registered under `name` for the running event loop.
+
+    Async connections are bound to the loop that opened them, so clients are kept per loop. Under
+    an ASGI server there is a single loop for the life of the worker; clients of other loops
+    (e.g. async views run under WSGI, each on its own loop) live alongside it and are dropped
+    once their loop is closed, rather than piling up.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _drop_closed_loops()
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is None:
+            client = clients[name] = factory()
+    return client
+
+
+def get_openai_client():
+    """
+    Return the shared OpenAI client, backed by a keep-alive connection pool.
+    """
+    return _get_or_create(
+        "openai",
+        lambda: openai.OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,  # Retries go through the rate limiter (see utils/resilience.py)
+            http_client=openai.DefaultHttpxClient(**_httpx_options()),
+        ),
+    )
+
+
+def get_async_openai_client():
+    """
+    Return the shared AsyncOpenAI client for the running event loop.
+    """
+    return _get_or_create_async(
+        "openai",
+        lambda: openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,  # Retries go through the rate limiter (see utils/resilience.py)
+            http_client=openai.DefaultAsyncHttpxClient(**_httpx_options()),
+        ),
+    )
+
+
+def _create_http_session():
+    """
+    Create a requests Session whose adapters keep a pool of connections open per host.
+    """
+    config = _config()
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=config["POOL_SIZE"], pool_maxsize=config["POOL_SIZE"])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session():
+    """
+    Return the shared requests Session used by the synchronous tools.
+    """
+    return _get_or_create("http", _create_http_session)
+
+
+def get_async_http_client():
+    """
+    Return the shared httpx AsyncClient used by the async tools for the running event loop.
+    """
+    return _get_or_create_async("http", lambda: httpx.AsyncClient(**_httpx_options()))
+
+
+def get_amadeus_client():
+    """
+    Return the shared Amadeus client. Its OAuth access token is cached on the client and
+    refreshed shortly before it expires, so one token serves every request in the process.
+    """
+    return _get_or_create(
+        "amadeus",
+        lambda: AmadeusClient(
+            client_id=os.getenv("AMADEUS_API_KEY"),
+            client_secret=os.getenv("AMADEUS_API_SECRET"),
+        ),
+    )
+
+
+def close_clients():
+    """
+    Close the shared synchronous clients and their pooled connections.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if close:
+            close()
+
+
+async def aclose_clients():
+    """
+    Close the async clients opened on the running event loop, then the synchronous ones.
+    """
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        # httpx clients close with aclose(); AsyncOpenAI exposes an async close()
+        close = getattr(client, "aclose", None) or client.close
+        await close()
+    close_clients()
+
+
+atexit.register(close_clients)
@@ -0,0 +1,162 @@
+import json
+import math
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
+# Defaults for settings.CONTEXT_BUILDER
+DEFAULT_CONTEXT_BUILDER = {
+    "TOKEN_BUDGET": 4000,  # Tokens available for the system prompt, tool schemas and history
+    "RESPONSE_RESERVE": 500,  # Tokens kept free for the model's reply (ChatGPT.query max_tokens)
+    "TOOL_RESULT_MAX_TOKENS": 200,  # Older tool results are truncated to this size before anything is dropped
+}
+
+# Fixed per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Count the tokens in `text`, using tiktoken when installed and ~4 characters per token otherwise.
+    """
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is None:
+        return math.ceil(len(text) / 4)
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Shorten `text` to roughly `max_tokens` tokens, marking the cut.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    if tiktoken is None:
+        return text[: max_tokens * 4] + " ...[truncated]"
+    return _encoding.decode(_encoding.encode(text)[:max_tokens]) + " ...[truncated]"
+
+
+def history_entry(role, content, tokens=None, tool=False, message=None):
+    """
+    Build an in-memory conversation history entry.
+
+    Besides the chat message fields, entries carry their token count, whether they hold a tool
+    result and the message they were built from (whose `id` is set once it is written);
+    ContextBuilder strips these before the messages are sent to the LLM.
+    """
+    return {
+        "role": role,
+        "content": content,
+        "tokens": tokens if tokens is not None else count_tokens(content),
+        "tool": tool,
+        "message": message,
+    }
+
+
+class ContextBuilder:
+    """
+    Fit the conversation history into a token budget for one LLM call.
+
+    The latest message is always kept, and so is the summary of the conversation before the
+    history, if any. When the history does not fit, older tool results are truncated first, then
+    dropped, and only then are the oldest remaining messages dropped.
+    """
+
+    def __init__(self, token_budget=None, response_reserve=None, tool_result_max_tokens=None):
+        config = {**DEFAULT_CONTEXT_BUILDER, **getattr(settings, "CONTEXT_BUILDER", {})}
+        self.token_budget = token_budget if token_budget is not None else config["TOKEN_BUDGET"]
+        self.response_reserve = response_reserve if response_reserve is not None else config["RESPONSE_RESERVE"]
+        self.tool_result_max_tokens = (
+            tool_result_max_tokens if tool_result_max_tokens is not None else config["TOOL_RESULT_MAX_TOKENS"]
+        )
+
+    def build(self, prompt, history, tools=None, summary=None, tool_messages=None):
+        """
+        Select the history messages to send with `prompt`.
+
+        :param prompt: System prompt of the call.
+        :param history: Conversation history entries (see `history_entry`), oldest first.
+        :param tools: Optional tool schemas sent with the call, counted against the budget.
+        :param summary: Optional summary of the conversation preceding `history`, sent first.
+        :param tool_messages: Optional chat messages sent after the history as they are: the assistant's
+                              tool calls of the current turn and the tools' replies. Always kept and
+                              counted against the budget.
+        :return: Tuple of (messages, report). messages are plain {"role", "content"} dicts ready for
+                 `ChatGPT.query`; report summarizes the token accounting of the call.
+        """
+        prompt_tokens = count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+        if tools:
+            prompt_tokens += count_tokens(json.dumps(tools))
+        tool_tokens = sum(
+            count_tokens(message.get("content")) + count_tokens(json.dumps(message.get("tool_calls") or ""))
+            + MESSAGE_OVERHEAD_TOKENS
+            for message in tool_messages or []
+        )
+        summary_message = (
+            {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"} if summary else None
+        )
+        summary_tokens = count_tokens(summary_message["content"]) + MESSAGE_OVERHEAD_TOKENS if summary else 0
+        available = max(self.token_budget - self.response_reserve - prompt_tokens - summary_tokens - tool_tokens, 0)
+
+        entries = [dict(entry) for entry in history]
+        for entry in entries:
+            entry.setdefault("tokens", count_tokens(entry["content"]))
+            entry["cost"] = entry["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        total = sum(entry["cost"] for entry in entries)
+        truncated = dropped = 0
+
+        # The latest message is never truncated or dropped
+        older = entries[:-1]
+
+        # 1. Truncate older tool results
+        for entry in older:
+            if total <= available:
+                break
+            if entry.get("tool") and entry["tokens"] > self.tool_result_max_tokens:
+                entry["content"] = truncate_to_tokens(entry["content"], self.tool_result_max_tokens)
+                cost = count_tokens(entry["content"]) + MESSAGE_OVERHEAD_TOKENS
+                total -= entry["cost"] - cost
+                entry["cost"] = cost
+                truncated += 1
+
+        # 2. Drop older tool results, oldest first; 3. then the oldest remaining messages
+        for drop_tools_only in (True, False):
+            for entry in older:
+                if total <= available:
+                    break
+                if entry.get("dropped") or (drop_tools_only and not entry.get("tool")):
+                    continue
+                entry["dropped"] = True
+                total -= entry["cost"]
+                dropped += 1
+
+        messages = [
+            {"role": entry["role"], "content": entry["content"]}
+            for entry in entries
+            if not entry.get("dropped")
+        ]
+        if summary_message:
+            messages.insert(0, summary_message)
+        messages.extend(tool_messages or [])
+        report = {
+            "prompt_tokens": prompt_tokens,
+            "summary_tokens": summary_tokens,
+            "tool_tokens": tool_tokens,
+            "history_tokens": total,
+            "total_tokens": prompt_tokens + summary_tokens + tool_tokens + total,
+            "budget": self.token_budget,
+            "messages": len(messages),
+            "truncated": truncated,
+            "dropped": dropped,
+        }
+        return messages, report
@@ -0,0 +1,92 @@
+from utils.cache import normalize_query
+from utils.results import tool_result
+
+# Words of a follow-up query asking for further results of the latest search with the same tool
+# rather than starting a new one, e.g. "show me more", "any more?" or "next page please"
+MORE_RESULTS_WORDS = {"more", "next", "other", "others", "another", "else", "additional", "further"}
+
+# Words that may accompany them without making the follow-up a new search (besides the stopwords
+# of utils.cache.normalize_query)
+FOLLOW_UP_WORDS = {
+    "me", "us", "give", "get", "see", "list", "can", "could", "you", "i", "we", "want", "like", "would",
+    "what", "are", "there", "is", "do", "have", "got", "let", "results", "options", "ones", "page",
+    "places", "suggestions", "ideas", "them", "those", "these", "again", "with", "and", "or",
+}
+
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+class ToolCursor:
+    """
+    A session's position in the results of a paginated tool call.
+
+    Rows come from the tool's row generator (e.g. `GooglePlacesTool.iter_search_places`), which fetches
+    further pages only when the rows already fetched run out. Rows are kept once pulled, so each
+    slice is served from memory when possible and only the rows asked for are ever fetched.
+    """
+
+    def __init__(self, tool_name, arguments, rows, offset=0):
+        """
+        :param arguments: Arguments of the tool call, kept as context of the results.
+        :param rows: Iterator (or async iterator) of the call's result rows, best match first.
+        :param offset: Rows already shown, e.g. by the tool's regular result.
+        """
+        self.tool_name = tool_name
+        self.arguments = arguments
+        self.rows = rows
+        self.is_async = hasattr(rows, "__anext__")
+        self.fetched = []  # Rows pulled from the iterator so far
+        self.offset = offset
+        self.exhausted = False
+
+    def continues(self, tool_name, arguments):
+        """
+        Return whether a call of `tool_name` with `arguments` asks for the next results of this cursor,
+        i.e. is a follow-up such as "show me more" or "any more restaurants?": it asks for more, and
+        whatever else it says is part of the cursor's search. Repeating the search itself starts over.
+        """
+        if tool_name != self.tool_name or len(arguments) != 1:
+            return False
+        words = normalize_query(next(iter(arguments.values()))).split()
+        if not MORE_RESULTS_WORDS.intersection(words):
+            return False
+        topic = {
+            _stem(word) for value in self.arguments.values() if isinstance(value, str)
+            for word in normalize_query(value).split()
+        }
+        return all(
+            word in MORE_RESULTS_WORDS or word in FOLLOW_UP_WORDS or _stem(word) in topic for word in words
+        )
+
+    def _slice(self, size):
+        start = self.offset
+        self.offset = min(start + size, len(self.fetched))
+        rows = self.fetched[start:self.offset]
+        # How many rows remain is unknown until the iterator runs out
+        has_more = self.offset < len(self.fetched) or not self.exhausted
+        return tool_result(self.tool_name, rows, has_more=has_more, **self.arguments, offset=start)
+
+    def take(self, size):
+        """
+        Return the next `size` rows as a structured tool result, fetching more only if needed.
+        Its `has_more` flag tells whether further rows may follow.
+        """
+        while len(self.fetched) < self.offset + size and not self.exhausted:
+            try:
+                self.fetched.append(next(self.rows))
+            except StopIteration:
+                self.exhausted = True
+        return self._slice(size)
+
+    async def atake(self, size):
+        """
+        Async version of `take`, for cursors over an async iterator.
+        """
+        while len(self.fetched) < self.offset + size and not self.exhausted:
+            try:
+                self.fetched.append(await anext(self.rows))
+            except StopAsyncIteration:
+                self.exhausted = True
+        return self._slice(size)
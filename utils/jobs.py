@@ -0,0 +1,143 @@
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from travel_agent.core.models import Job
+from utils.metrics import metrics
+from utils.ratelimit import outbound_priority
+from utils.tracing import span
+
+# Defaults for settings.JOB_QUEUE
+DEFAULT_JOB_QUEUE = {
+    # Tools whose calls the agent runs as background jobs instead of waiting for them; the turn is answered
+    # with an interim message and the result is added to the conversation when the job completes
+    "BACKGROUND_TOOLS": [],
+    "MAX_ATTEMPTS": 3,
+    "RETRY_DELAY": 10.0,  # Seconds before the first retry of a failed job; doubled on each further attempt
+    "LEASE_SECONDS": 120.0,  # A running job whose worker stops renewing its lease for this long is run again
+    "CONCURRENCY": 4,  # Jobs each `run_jobs` worker runs at once
+    "POLL_INTERVAL": 1.0,  # Seconds an idle worker waits before looking for due jobs again
+}
+
+# Handlers of each job kind, registered with @job_handler
+JOB_HANDLERS = {}
+
+_jobs = metrics.counter(
+    "agent_jobs_total", "Background job attempts by outcome: succeeded, retried or failed.", ("kind", "outcome"),
+)
+_duration = metrics.histogram("agent_job_duration_seconds", "Duration of background job attempts.", ("kind",))
+
+_config = None
+
+
+def get_job_queue_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_JOB_QUEUE, **getattr(settings, "JOB_QUEUE", {})}
+    return _config
+
+
+def job_handler(kind):
+    """
+    Register the decorated function as the handler of jobs of `kind`. It is called with the Job
+    and returns the job's result, which must be JSON serializable; raising fails the attempt.
+    """
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+def new_job(kind, payload, conversation_id=None):
+    """
+    Build an unsaved job of `kind`, so callers can report its id before it is enqueued.
+    """
+    return Job(kind=kind, payload=payload, conversation_id=conversation_id,
+               max_attempts=get_job_queue_config()["MAX_ATTEMPTS"])
+
+
+class JobWorker:
+    """
+    Runs due jobs from the jobs table, as started by `python manage.py run_jobs`.
+
+    Jobs are leased rather than locked: a worker claims up to `concurrency` jobs, renews their
+    leases while they run, and records each attempt's outcome. If a worker dies, its jobs are
+    claimed again once their leases expire, so a handler may run more than once for a job and
+    must tolerate it. Failed attempts are retried with exponential backoff up to the job's
+    max_attempts. Outbound calls made by handlers queue behind interactive traffic.
+    """
+
+    def __init__(self, name=None, kinds=None, concurrency=None, lease_seconds=None, poll_interval=None):
+        config = get_job_queue_config()
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.kinds = kinds
+        self.concurrency = concurrency if concurrency is not None else config["CONCURRENCY"]
+        self.lease_seconds = lease_seconds if lease_seconds is not None else config["LEASE_SECONDS"]
+        self.poll_interval = poll_interval if poll_interval is not None else config["POLL_INTERVAL"]
+        self.retry_delay = config["RETRY_DELAY"]
+
+    def execute(self, job):
+        """
+        Run one attempt of `job` and record its outcome.
+        """
+        handler = JOB_HANDLERS.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for jobs of kind '{job.kind}'")
+            with outbound_priority("background"), span(f"job.{job.kind}", job=str(job.pk)):
+                result = handler(job)
+        except Exception as e:
+            print(f"Error running {job} (attempt {job.attempts}/{job.max_attempts}): {e}")
+            retry = handler is not None and job.attempts < job.max_attempts
+            if job.fail(str(e) or type(e).__name__, self.retry_delay * 2 ** (job.attempts - 1), retry=retry):
+                _jobs.inc(kind=job.kind, outcome="retried" if retry else "failed")
+            else:
+                print(f"Lost the lease on {job}; its outcome was not recorded")
+        else:
+            if job.complete(result):
+                _jobs.inc(kind=job.kind, outcome="succeeded")
+            else:
+                print(f"Lost the lease on {job}; its result was discarded")
+        finally:
+            _duration.observe(time.perf_counter() - started, kind=job.kind)
+            close_old_connections()
+
+    def _claim(self, limit):
+        try:
+            return Job.objects.claim(self.name, self.lease_seconds, kinds=self.kinds, limit=limit)
+        finally:
+            close_old_connections()
+
+    def run(self, once=False, stop=None):
+        """
+        Claim and run jobs until `stop` (a threading.Event) is set, finishing the running jobs
+        before returning.
+
+        :param once: Return as soon as no job is due or running instead of polling for more.
+        """
+        stop = stop or threading.Event()
+        running = {}  # Future -> Job
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as executor:
+            while not stop.is_set():
+                free = self.concurrency - len(running)
+                for job in self._claim(free) if free else []:
+                    running[executor.submit(self.execute, job)] = job
+                if not running:
+                    if once:
+                        break
+                    stop.wait(self.poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                if running and time.monotonic() - renewed >= self.lease_seconds / 3:
+                    Job.objects.renew(self.name, [job.pk for job in running.values()], self.lease_seconds)
+                    renewed = time.monotonic()
@@ -1,19 +1,179 @@
+import hashlib
+import json
+
 import openai
-import os
-from dotenv import load_dotenv
-load_dotenv()
 
-api_key = os.getenv("OPENAI_API_KEY")
+from utils.clients import get_async_openai_client, get_openai_client
+from utils.metrics import metrics
+from utils.ratelimit import get_rate_limiter, retry_after
+from utils.resilience import get_llm_resilience
+from utils.response_cache import get_response_cache
+from utils.singleflight import get_coalescing_config, get_singleflight
+from utils.tracing import traced
+from utils.usage import usage_entry
+
+_tokens = metrics.counter(
+    "agent_llm_tokens_total", "Tokens of LLM calls as reported by the API, hedged duplicates included.",
+    ("step", "model", "type"),
+)
+
+def _merge_tool_call_deltas(tool_calls, delta):
+    """
+    Accumulate the streamed fragments of tool calls into `tool_calls`, keyed by call index.
+    """
+    for call in delta.tool_calls or []:
+        entry = tool_calls.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+        if call.id:
+            entry["id"] = call.id
+        if call.function and call.function.name:
+            entry["name"] += call.function.name
+        if call.function and call.function.arguments:
+            entry["arguments"] += call.function.arguments
+
+
+class _PermittedStream:
+    """
+    A response stream holding a rate limiter Permit, released as soon as the stream is exhausted,
+    fails, is closed or is garbage collected, whether or not it was ever iterated.
+    """
+
+    def __init__(self, permit, stream):
+        self.permit = permit
+        self.stream = stream
+        self.chunks = aiter(stream) if hasattr(stream, "__aiter__") else iter(stream)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.permit.release()
+            raise
+
+    def close(self):
+        self.permit.release()
+        close = getattr(self.stream, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self):
+        self.permit.release()
+
+
+class _AsyncPermittedStream(_PermittedStream):
+    """
+    Async version of `_PermittedStream`.
+    """
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await anext(self.chunks)
+        except BaseException:
+            self.permit.release()
+            raise
+
+    async def aclose(self):
+        self.permit.release()
+        close = getattr(self.stream, "aclose", None) or getattr(self.stream, "close", None)
+        if close is not None:
+            await close()
+
 
 class ChatGPT:
-    def __init__(self, model="gpt-4o"):
+    def __init__(
+        self, model="gpt-4o", client=None, response_cache=None, singleflight=None, limiter=None, resilience=None,
+    ):
+        """
+        Initialize ChatGPT.
+
+        :param client: OpenAI client to use; defaults to the process-wide pooled client.
+        :param response_cache: ResponseCache for replies; defaults to the process-wide cache (off unless enabled).
+        :param singleflight: SingleFlight group coalescing identical calls; defaults to the process-wide "llm" group.
+        :param limiter: ProviderLimiter for OpenAI calls; defaults to the process-wide "openai" limiter.
+        :param resilience: LLMResilience setting timeouts, retries and hedging; defaults to the process-wide policy.
+        """
+        self.client = client or get_openai_client()
+        self.response_cache = response_cache or get_response_cache()
+        self.singleflight = singleflight or get_singleflight("llm")
+        self.limiter = limiter or get_rate_limiter("openai")
+        self.resilience = resilience or get_llm_resilience()
+
+    def _build_messages(self, prompt, conversation_history=None):
+        """
+        Combine the system prompt and conversation history into a list of chat messages.
+        """
+        messages = [{"role": "system", "content": prompt}]
+        if conversation_history:
+            messages.extend(conversation_history)
+        return messages
+
+    @staticmethod
+    def _estimate_tokens(request):
         """
-        Initialize ChatGPT with the provided API key.
+        Estimate the tokens a request counts against the tokens-per-minute limit the way OpenAI does:
+        ~4 characters per prompt token, plus max_tokens.
         """
-        self.api_key = api_key
-        openai.api_key = self.api_key
+        chars = sum(len(message.get("content") or "") for message in request["messages"])
+        return chars // 4 + request.get("max_tokens", 0)
 
-    def query(self, prompt, conversation_history=None, max_tokens=500, temperature=0.7, response_format=None):
+    def _create(self, **request):
+        """
+        Call the chat completions API within the OpenAI rate limits (see utils/ratelimit.py). A stream
+        holds its concurrency slot until it has been consumed, closed or dropped.
+        """
+        permit = self.limiter.acquire(tokens=self._estimate_tokens(request))
+        try:
+            response = self.client.chat.completions.create(**request)
+        except openai.RateLimitError as e:
+            permit.release()
+            self.limiter.pause(retry_after(e.response.headers))
+            raise
+        except BaseException:
+            permit.release()
+            raise
+        if not request.get("stream"):
+            permit.release()
+            return response
+        return _PermittedStream(permit, response)
+
+    def _request(self, step, on_usage=None, **request):
+        """
+        Make a chat completions request for the agent step `step` with the step's timeout, retries
+        and hedging (see utils/resilience.py). The usage of a hedged request whose reply is not used
+        is reported to `on_usage` when that reply arrives.
+        """
+        return self.resilience.call(
+            step, lambda timeout: self._create(timeout=timeout, **request), stream=request.get("stream", False),
+            on_discard=lambda response: self._report_usage(on_usage, step, response),
+        )
+
+    @staticmethod
+    def _request_key(step, request):
+        """
+        Key identical API requests of a step: same messages, parameters, tools and response format.
+        """
+        digest = hashlib.sha1(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+        return f"llm:{step}:{digest}"
+
+    def _coalesce(self, step, call, **request):
+        """
+        Return `call()`, sharing it with identical calls in flight if `step` is coalesced (see
+        settings.REQUEST_COALESCING). Only the caller that made the request gets its usage reported.
+        """
+        if step not in get_coalescing_config()["LLM_STEPS"]:
+            return call()
+        return self.singleflight.do(self._request_key(step, request), call)
+
+    @traced("llm.query")
+    def query(
+        self, prompt, conversation_history=None, max_tokens=500, temperature=0.7, response_format=None,
+        cache_step=None, on_usage=None,
+    ):
         """
         Query GPT-3.5 with a prompt and optional conversation history.
 
@@ -22,28 +182,420 @@ class ChatGPT:
         :param max_tokens: Maximum number of tokens in the output.
         :param temperature: Sampling temperature for diversity in responses.
         :param response_format: Dict to enforce specific response format (e.g., JSON object).
+        :param cache_step: Agent step making the call; selects the response cache policy (not cached if None).
+        :param on_usage: Optional callback invoked with the call's token usage (see `utils.usage.usage_entry`);
+                         not invoked when the reply comes from the response cache.
         :return: The response content as a string or structured JSON if response_format is specified.
         """
-        # Combine prompt and conversation history
-        messages = [{"role": "system", "content": prompt}]
-        if conversation_history:
-            messages.extend(conversation_history)
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=response_format)
+        if lookup.hit:
+            return lookup.value
+
+        messages = self._build_messages(prompt, conversation_history)
+        kwargs = {"response_format": response_format} if response_format else {}
+
+        def call():
+            # Call the OpenAI API
+            response = self._request(
+                cache_step,
+                on_usage=on_usage,
+                model="gpt-3.5-turbo",
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs,
+            )
+            self._report_usage(on_usage, cache_step, response)
+            return response.choices[0].message.content
+
+        content = self._coalesce(
+            cache_step, call, messages=messages, max_tokens=max_tokens, temperature=temperature, **kwargs
+        )
+        lookup.store(content)
+        return content
+
+    @traced("llm.stream_query")
+    def stream_query(
+        self, prompt, conversation_history=None, max_tokens=500, temperature=0.7, cache_step=None, on_usage=None
+    ):
+        """
+        Query GPT-3.5 like `query`, but yield the response content as it is generated.
+
+        :param prompt: System-level instructions or task definition.
+        :param conversation_history: List of conversation history messages.
+        :param max_tokens: Maximum number of tokens in the output.
+        :param temperature: Sampling temperature for diversity in responses.
+        :param cache_step: Agent step making the call; a cached reply is yielded as a single delta.
+        :param on_usage: Optional callback invoked with the call's token usage once the stream ends.
+        :return: Generator yielding content deltas (strings) in the order they are received.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history)
+        if lookup.hit:
+            yield lookup.value
+            return
+
+        messages = self._build_messages(prompt, conversation_history)
+
+        stream = self._request(
+            cache_step,
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        deltas = []
+        for chunk in stream:
+            # With include_usage, the last chunk carries the usage and no choices
+            self._report_usage(on_usage, cache_step, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                deltas.append(delta)
+                yield delta
+        lookup.store("".join(deltas))
+
+
+    @traced("llm.query_with_tools")
+    def query_with_tools(
+        self, prompt, conversation_history=None, tools=None, max_tokens=500, temperature=0.7, cache_step=None,
+        on_usage=None,
+    ):
+        """
+        Query GPT-3.5 with native function calling, letting the model either answer directly or
+        request tool calls in a single round trip.
+
+        :param prompt: System-level instructions or task definition.
+        :param conversation_history: List of conversation history messages.
+        :param tools: List of OpenAI tool schemas (see `ToolRegistry.get_tool_schemas`).
+        :param max_tokens: Maximum number of tokens in the output.
+        :param temperature: Sampling temperature for diversity in responses.
+        :param cache_step: Agent step making the call; selects the response cache policy (not cached if None).
+        :param on_usage: Optional callback invoked with the call's token usage.
+        :return: Tuple of (content, tool_calls). tool_calls is a list of {"id", "name", "arguments"} dicts,
+                 with arguments as a JSON string, and is empty when the model answered directly.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=tools)
+        if lookup.hit:
+            return lookup.value
+
+        messages = self._build_messages(prompt, conversation_history)
 
-        # Call the OpenAI API
-        if response_format:
-            response = openai.chat.completions.create(
+        kwargs = {"tools": tools} if tools else {}
+
+        def call():
+            response = self._request(
+                cache_step,
+                on_usage=on_usage,
                 model="gpt-3.5-turbo",
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                response_format=response_format,  # Use the response format
+                **kwargs,
             )
-        else:
-            response = openai.chat.completions.create(
+            self._report_usage(on_usage, cache_step, response)
+            return self._parse_tool_reply(response)
+
+        reply = self._coalesce(
+            cache_step, call, messages=messages, max_tokens=max_tokens, temperature=temperature, **kwargs
+        )
+        lookup.store(reply)
+        return reply
+
+    @traced("llm.stream_query_with_tools")
+    def stream_query_with_tools(
+        self, prompt, conversation_history=None, tools=None, max_tokens=500, temperature=0.7, cache_step=None,
+        on_usage=None,
+    ):
+        """
+        Streaming version of `query_with_tools`.
+
+        :return: Generator yielding ("token", delta) for each content delta, then a final
+                 ("tool_calls", tool_calls) with the tool calls assembled from the stream.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=tools)
+        if lookup.hit:
+            yield from self._replay_tool_reply(lookup.value)
+            return
+
+        messages = self._build_messages(prompt, conversation_history)
+
+        kwargs = {"tools": tools} if tools else {}
+        stream = self._request(
+            cache_step,
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+
+        tool_calls = {}
+        deltas = []
+        for chunk in stream:
+            # With include_usage, the last chunk carries the usage and no choices
+            self._report_usage(on_usage, cache_step, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                deltas.append(delta.content)
+                yield "token", delta.content
+            _merge_tool_call_deltas(tool_calls, delta)
+
+        tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+        lookup.store(("".join(deltas) or None, tool_calls))
+        yield "tool_calls", tool_calls
+
+    @staticmethod
+    def _report_usage(on_usage, step, response):
+        """
+        Count the token usage of an API response (or of the last chunk of a stream) and pass it to `on_usage`.
+        """
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        _tokens.inc(usage.prompt_tokens, step=step or "", model=response.model, type="prompt")
+        _tokens.inc(usage.completion_tokens, step=step or "", model=response.model, type="completion")
+        if on_usage:
+            on_usage(usage_entry(step, response.model, usage.prompt_tokens, usage.completion_tokens))
+
+    @staticmethod
+    def _parse_tool_reply(response):
+        """
+        Return the (content, tool_calls) reply of a `query_with_tools` API response.
+        """
+        message = response.choices[0].message
+        tool_calls = [
+            {"id": call.id, "name": call.function.name, "arguments": call.function.arguments}
+            for call in message.tool_calls or []
+        ]
+        return message.content, tool_calls
+
+    @staticmethod
+    def _replay_tool_reply(reply):
+        """
+        Yield a cached (content, tool_calls) reply as the events of `stream_query_with_tools`.
+        """
+        content, tool_calls = reply
+        if content:
+            yield "token", content
+        yield "tool_calls", tool_calls
+
+class AsyncChatGPT(ChatGPT):
+    """
+    Async twin of ChatGPT built on `openai.AsyncOpenAI`, for use from async views.
+
+    Cancelling an awaiting task cancels the underlying HTTP request to OpenAI.
+    """
+
+    def __init__(
+        self, model="gpt-4o", client=None, response_cache=None, singleflight=None, limiter=None, resilience=None,
+    ):
+        """
+        Initialize AsyncChatGPT.
+
+        :param client: AsyncOpenAI client to use; defaults to the pooled client of the running event loop.
+        :param response_cache: ResponseCache for replies; defaults to the process-wide cache (off unless enabled).
+        :param singleflight: SingleFlight group coalescing identical calls; defaults to the process-wide "llm" group,
+                             shared with the sync client.
+        :param limiter: ProviderLimiter for OpenAI calls; defaults to the process-wide "openai" limiter, shared
+                        with the sync client.
+        :param resilience: LLMResilience setting timeouts, retries and hedging; defaults to the process-wide policy.
+        """
+        self.client = client or get_async_openai_client()
+        self.response_cache = response_cache or get_response_cache()
+        self.singleflight = singleflight or get_singleflight("llm")
+        self.limiter = limiter or get_rate_limiter("openai")
+        self.resilience = resilience or get_llm_resilience()
+
+    async def _acreate(self, **request):
+        """
+        Async version of `ChatGPT._create`.
+        """
+        permit = await self.limiter.aacquire(tokens=self._estimate_tokens(request))
+        try:
+            response = await self.client.chat.completions.create(**request)
+        except openai.RateLimitError as e:
+            permit.release()
+            self.limiter.pause(retry_after(e.response.headers))
+            raise
+        except BaseException:
+            permit.release()
+            raise
+        if not request.get("stream"):
+            permit.release()
+            return response
+        return _AsyncPermittedStream(permit, response)
+
+    async def _arequest(self, step, on_usage=None, **request):
+        """
+        Async version of `ChatGPT._request`.
+        """
+        return await self.resilience.acall(
+            step, lambda timeout: self._acreate(timeout=timeout, **request), stream=request.get("stream", False),
+            on_discard=lambda response: self._report_usage(on_usage, step, response),
+        )
+
+    async def _acoalesce(self, step, call, **request):
+        """
+        Async version of `ChatGPT._coalesce`; `call` is a zero-argument coroutine function.
+        """
+        if step not in get_coalescing_config()["LLM_STEPS"]:
+            return await call()
+        return await self.singleflight.ado(self._request_key(step, request), call)
+
+    @traced("llm.query")
+    async def query(
+        self, prompt, conversation_history=None, max_tokens=500, temperature=0.7, response_format=None,
+        cache_step=None, on_usage=None,
+    ):
+        """
+        Async version of `ChatGPT.query`; takes the same parameters and returns the response content.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=response_format)
+        if lookup.hit:
+            return lookup.value
+
+        messages = self._build_messages(prompt, conversation_history)
+        kwargs = {"response_format": response_format} if response_format else {}
+
+        async def call():
+            response = await self._arequest(
+                cache_step,
+                on_usage=on_usage,
                 model="gpt-3.5-turbo",
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
+                **kwargs,
             )
+            self._report_usage(on_usage, cache_step, response)
+            return response.choices[0].message.content
+
+        content = await self._acoalesce(
+            cache_step, call, messages=messages, max_tokens=max_tokens, temperature=temperature, **kwargs
+        )
+        lookup.store(content)
+        return content
+
+    @traced("llm.stream_query")
+    async def stream_query(
+        self, prompt, conversation_history=None, max_tokens=500, temperature=0.7, cache_step=None, on_usage=None
+    ):
+        """
+        Async version of `ChatGPT.stream_query`, yielding content deltas as they arrive.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history)
+        if lookup.hit:
+            yield lookup.value
+            return
+
+        messages = self._build_messages(prompt, conversation_history)
+
+        stream = await self._arequest(
+            cache_step,
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        deltas = []
+        async for chunk in stream:
+            # With include_usage, the last chunk carries the usage and no choices
+            self._report_usage(on_usage, cache_step, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                deltas.append(delta)
+                yield delta
+        lookup.store("".join(deltas))
+
+    @traced("llm.query_with_tools")
+    async def query_with_tools(
+        self, prompt, conversation_history=None, tools=None, max_tokens=500, temperature=0.7, cache_step=None,
+        on_usage=None,
+    ):
+        """
+        Async version of `ChatGPT.query_with_tools`, returning (content, tool_calls).
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=tools)
+        if lookup.hit:
+            return lookup.value
+
+        messages = self._build_messages(prompt, conversation_history)
+
+        kwargs = {"tools": tools} if tools else {}
+
+        async def call():
+            response = await self._arequest(
+                cache_step,
+                on_usage=on_usage,
+                model="gpt-3.5-turbo",
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs,
+            )
+            self._report_usage(on_usage, cache_step, response)
+            return self._parse_tool_reply(response)
+
+        reply = await self._acoalesce(
+            cache_step, call, messages=messages, max_tokens=max_tokens, temperature=temperature, **kwargs
+        )
+        lookup.store(reply)
+        return reply
+
+    @traced("llm.stream_query_with_tools")
+    async def stream_query_with_tools(
+        self, prompt, conversation_history=None, tools=None, max_tokens=500, temperature=0.7, cache_step=None,
+        on_usage=None,
+    ):
+        """
+        Async version of `ChatGPT.stream_query_with_tools`.
+        """
+        lookup = self.response_cache.lookup(cache_step, prompt, conversation_history, extra=tools)
+        if lookup.hit:
+            for event in self._replay_tool_reply(lookup.value):
+                yield event
+            return
+
+        messages = self._build_messages(prompt, conversation_history)
+
+        kwargs = {"tools": tools} if tools else {}
+        stream = await self._arequest(
+            cache_step,
+            model="gpt-3.5-turbo",
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+
+        tool_calls = {}
+        deltas = []
+        async for chunk in stream:
+            # With include_usage, the last chunk carries the usage and no choices
+            self._report_usage(on_usage, cache_step, chunk)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                deltas.append(delta.content)
+                yield "token", delta.content
+            _merge_tool_call_deltas(tool_calls, delta)
 
-        return response.choices[0].message.content
\ No newline at end of file
+        tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+        lookup.store(("".join(deltas) or None, tool_calls))
+        yield "tool_calls", tool_calls
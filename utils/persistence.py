@@ -0,0 +1,185 @@
+import atexit
+import queue
+import threading
+import time
+import traceback
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from utils.metrics import metrics
+from utils.stores import get_conversation_store
+from utils.tracing import span
+
+# Defaults for settings.MESSAGE_PERSISTENCE
+DEFAULT_MESSAGE_PERSISTENCE = {
+    "WRITE_BEHIND": True,  # Buffer a turn's messages and write them in one batch at the end of the turn
+    "DURABILITY": "sync",  # 'sync': the batch is written before the response; 'async': by a background flusher
+    "RETRIES": 3,  # Further attempts of a failed background write before its messages are dropped
+    "RETRY_DELAY": 0.5,  # Seconds before the first retry of a background write; doubled on each further retry
+    "RETRY_BUDGET": 5.0,  # Seconds of backoff the flusher may spend on one group of batches before dropping its failures
+}
+
+_failures = metrics.counter(
+    "agent_message_write_failures_total",
+    "Failed background writes of message batches: 'retried', or 'dropped' once out of retries.",
+    ("outcome",),
+)
+
+
+class MessageWriter:
+    """
+    Writes batches of Messages through the ConversationStore, one transaction per batch.
+
+    With 'sync' durability the batch is written in the calling thread. With 'async' durability it
+    is queued for a background flusher thread, so the response does not wait on the database.
+    The flusher handles batches strictly in FIFO order, which preserves message order within a
+    session, and commits every batch already queued (up to MAX_GROUP) together;
+    `has_pending` tells whether a conversation still has batches in flight. A failed write is
+    retried with backoff, holding back the batches behind it, for at most RETRIES attempts and
+    RETRY_BUDGET seconds; then each batch of the group is tried alone so only the failing ones are
+    dropped. Once a batch is dropped, the conversation's batches queued behind it are dropped too,
+    so its stored history never has gaps or messages out of order.
+    """
+
+    # Batches the flusher commits in one transaction
+    MAX_GROUP = 64
+
+    def __init__(self, write_behind=None, durability=None, retries=None, retry_delay=None, retry_budget=None):
+        config = {**DEFAULT_MESSAGE_PERSISTENCE, **getattr(settings, "MESSAGE_PERSISTENCE", {})}
+        self.write_behind = write_behind if write_behind is not None else config["WRITE_BEHIND"]
+        self.durability = durability if durability is not None else config["DURABILITY"]
+        self.retries = retries if retries is not None else config["RETRIES"]
+        self.retry_delay = retry_delay if retry_delay is not None else config["RETRY_DELAY"]
+        self.retry_budget = retry_budget if retry_budget is not None else config["RETRY_BUDGET"]
+        if self.durability not in ("sync", "async"):
+            raise ValueError(f"Invalid message persistence durability: '{self.durability}'")
+        self._queue = queue.Queue()
+        self._pending = Counter()  # conversation_id -> batches queued but not yet written
+        self._failed = set()  # Conversations with a dropped batch whose later batches are still queued
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def write(self, messages, on_saved=None, store=None):
+        """
+        Persist `messages` (unsaved Messages of one conversation, in order).
+
+        :param on_saved: Optional callback invoked with the messages once written, with their ids set.
+        :param store: ConversationStore to write to; the configured store if None.
+        """
+        store = store or get_conversation_store()
+        if self.durability == "sync":
+            with span("db.write"):
+                store.append_messages(messages)
+            if on_saved:
+                on_saved(messages)
+            return
+
+        with self._lock:
+            self._pending[messages[0].conversation_id] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((messages, on_saved, store))
+
+    def has_pending(self, conversation_id):
+        """
+        Return whether batches of the conversation are queued but not yet written.
+        """
+        with self._lock:
+            return self._pending[conversation_id] > 0
+
+    def _next_group(self):
+        """
+        Block for the next batch, then take the batches queued behind it, in order.
+        """
+        group = [self._queue.get()]
+        while len(group) < self.MAX_GROUP:
+            try:
+                group.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _append(self, group, deadline):
+        """
+        Write the batches of `group` in one transaction, retrying with backoff until `deadline` (a
+        time.monotonic() value); return whether they were written.
+        """
+        store = group[0][2]
+        for attempt in range(self.retries + 1):
+            try:
+                with span("db.write"):
+                    store.append_messages([message for messages, _, _ in group for message in messages])
+                return True
+            except Exception:
+                count = sum(len(messages) for messages, _, _ in group)
+                print(f"Error writing {count} conversation messages (attempt {attempt + 1}):\n{traceback.format_exc()}")
+                delay = self.retry_delay * 2 ** attempt
+                if attempt == self.retries or time.monotonic() + delay > deadline:
+                    return False
+                _failures.inc(outcome="retried")
+                close_old_connections()  # The connection may be what failed
+                time.sleep(delay)
+
+    def _write_group(self, group):
+        """
+        Write consecutive batches going to the same store in one transaction, then notify their writers.
+        """
+        deadline = time.monotonic() + self.retry_budget
+        written = []
+        try:
+            with self._lock:
+                batches = [batch for batch in group if batch[0][0].conversation_id not in self._failed]
+            if batches and self._append(batches, deadline):
+                written = batches
+            elif len(batches) > 1:
+                # Isolate the failing batches, so they do not take other conversations down with them
+                failed = set()
+                for batch in batches:
+                    conversation_id = batch[0][0].conversation_id
+                    if conversation_id not in failed and self._append([batch], deadline):
+                        written.append(batch)
+                    else:
+                        failed.add(conversation_id)
+            for messages, on_saved, _ in written:
+                if on_saved:
+                    on_saved(messages)
+        finally:
+            saved = {id(batch) for batch in written}
+            with self._lock:
+                for batch in group:
+                    conversation_id = batch[0][0].conversation_id
+                    if id(batch) not in saved:
+                        _failures.inc(outcome="dropped")
+                        self._failed.add(conversation_id)
+                    self._pending[conversation_id] -= 1
+                    if not self._pending[conversation_id]:
+                        del self._pending[conversation_id]
+                        self._failed.discard(conversation_id)
+
+    def _run(self):
+        while True:
+            batches = self._next_group()
+            group = []
+            for batch in batches:
+                if group and batch[2] is not group[0][2]:
+                    self._write_group(group)
+                    group = []
+                group.append(batch)
+            self._write_group(group)
+            close_old_connections()
+            for _ in batches:
+                self._queue.task_done()
+
+    def drain(self):
+        """
+        Block until every queued batch has been written.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+
+message_writer = MessageWriter()
+atexit.register(message_writer.drain)
@@ -0,0 +1,342 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from utils.metrics import metrics
+
+# Defaults for each provider's entry in settings.RATE_LIMITS; None means no limit
+DEFAULT_PROVIDER_LIMITS = {
+    "REQUESTS_PER_MINUTE": None,
+    "TOKENS_PER_MINUTE": None,  # Estimated prompt tokens plus max_tokens, as the OpenAI limits count them
+    "MAX_CONCURRENCY": None,  # Calls in flight at once, streams included until consumed
+    "MAX_WAIT": 10.0,  # Seconds a call may queue for its turn before failing with RateLimitExceeded
+    "BURST_SECONDS": 5.0,  # Seconds of rate that may be spent at once after an idle period
+}
+
+# Defaults for settings.RATE_LIMITS, by provider; set them a little below the account's actual limits
+DEFAULT_RATE_LIMITS = {
+    "openai": {"REQUESTS_PER_MINUTE": 500, "TOKENS_PER_MINUTE": 200_000, "MAX_CONCURRENCY": 50, "MAX_WAIT": 20.0},
+    "google_places": {"REQUESTS_PER_MINUTE": 600, "MAX_CONCURRENCY": 20},
+    "amadeus": {"REQUESTS_PER_MINUTE": 600, "MAX_CONCURRENCY": 10},
+}
+
+# Queued calls are served lowest value first, first come first served within a priority. Limiters
+# are per process, so priorities only order the calls of one worker: in a web worker, calls made
+# for the user ahead of speculative tool calls and hedged duplicates; in a `run_jobs` worker,
+# background tool calls ahead of maintenance such as summary updates.
+PRIORITIES = {"interactive": 0, "speculative": 1, "background": 2, "maintenance": 3}
+
+_priority = ContextVar("outbound_priority", default="interactive")
+
+_wait = metrics.histogram(
+    "agent_ratelimit_wait_seconds", "Time outbound calls waited for their provider's limits.", ("provider",),
+)
+_events = metrics.counter(
+    "agent_ratelimit_events_total",
+    "Outbound calls that had to queue, gave up after MAX_WAIT, or were answered 429 by the provider.",
+    ("provider", "event"),
+)
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when an outbound call could not get within its provider's limits in MAX_WAIT seconds.
+    """
+
+
+@contextmanager
+def outbound_priority(name):
+    """
+    Queue the outbound calls made in the enclosed block (and the tasks and threads it spawns) with
+    priority `name` (see PRIORITIES), e.g. "speculative" for calls whose result may not be used.
+    """
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown outbound priority: '{name}'")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Budget refilled at `per_minute` / 60 per second, holding at most BURST_SECONDS of it.
+    """
+
+    def __init__(self, per_minute, burst_seconds):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _cost(self, amount):
+        # A call larger than the bucket waits for a full bucket rather than forever
+        return min(amount, self.capacity)
+
+    def delay(self, amount):
+        """
+        Return the seconds until `amount` is available.
+        """
+        return max(self._cost(amount) - self.level, 0.0) / self.rate
+
+    def take(self, amount):
+        self.level -= self._cost(amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "wake", "granted", "abandoned")
+
+    def __init__(self, priority, seq, tokens, wake):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.wake = wake  # Callable nudging the waiting thread or task to check its state
+        self.granted = False
+        self.abandoned = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Permit:
+    """
+    A granted call slot; release it (or leave its `with` block) when the call completes.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ProviderLimiter:
+    """
+    Client-side limits on the calls made to one provider by every thread and event loop of a worker:
+    token buckets for requests and tokens per minute and a cap on concurrent calls.
+
+    Calls over the limits queue by priority (see `outbound_priority`), then arrival, for at most
+    MAX_WAIT seconds. Only the head of the queue can be granted, so a large call is not starved by
+    smaller calls behind it. When the provider answers 429 anyway, `pause` holds every
+    call until its Retry-After has passed instead of letting them all fail.
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None,
+                 max_wait=None, burst_seconds=None):
+        config = {
+            **DEFAULT_PROVIDER_LIMITS,
+            **DEFAULT_RATE_LIMITS.get(provider, {}),
+            **getattr(settings, "RATE_LIMITS", {}).get(provider, {}),
+        }
+        requests_per_minute = requests_per_minute if requests_per_minute is not None else config["REQUESTS_PER_MINUTE"]
+        tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else config["TOKENS_PER_MINUTE"]
+        burst_seconds = burst_seconds if burst_seconds is not None else config["BURST_SECONDS"]
+        self.provider = provider
+        self.max_concurrency = max_concurrency if max_concurrency is not None else config["MAX_CONCURRENCY"]
+        self.max_wait = max_wait if max_wait is not None else config["MAX_WAIT"]
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._waiters = []  # Heap of _Waiter, highest priority first
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {"granted": 0, "queued": 0, "rejected": 0, "throttled": 0}
+
+    def stats(self):
+        """
+        Return the call counters, the calls in flight and the calls queued.
+        """
+        with self._lock:
+            queued = sum(1 for waiter in self._waiters if not waiter.abandoned)
+            return {**self.counters, "in_flight": self.in_flight, "waiting": queued}
+
+    def _dispatch(self, caller=None):
+        """
+        Grant queued calls in priority order while the limits allow. Call with the lock held.
+
+        :param caller: Waiter running the dispatch, which need not be woken.
+        :return: Seconds until the head of the queue may be granted, or None if it waits for a release.
+        """
+        now = time.monotonic()
+        for bucket in (self.requests, self.tokens):
+            if bucket is not None:
+                bucket.refill(now)
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.abandoned:
+                heapq.heappop(self._waiters)
+                continue
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return None
+            delay = max(
+                self._paused_until - now,
+                self.requests.delay(1) if self.requests else 0.0,
+                self.tokens.delay(waiter.tokens) if self.tokens else 0.0,
+            )
+            if delay > 0:
+                # The head keeps the timer: make sure it sleeps no longer than the delay
+                if waiter is not caller:
+                    waiter.wake()
+                return delay
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(waiter.tokens)
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            waiter.granted = True
+            if waiter is not caller:
+                waiter.wake()
+        return None
+
+    def _enqueue(self, tokens, priority, wake):
+        priority = PRIORITIES[priority or _priority.get()]
+        waiter = _Waiter(priority, next(self._seq), tokens, wake)
+        with self._lock:
+            heapq.heappush(self._waiters, waiter)
+        return waiter, time.monotonic()
+
+    def _poll(self, waiter, started):
+        """
+        Dispatch and return how long `waiter` should sleep, None once it is granted. Call with the lock held.
+
+        :raises RateLimitExceeded: If the waiter has queued for longer than MAX_WAIT.
+        """
+        delay = self._dispatch(waiter)
+        if waiter.granted:
+            return None
+        remaining = started + self.max_wait - time.monotonic()
+        if remaining <= 0:
+            waiter.abandoned = True
+            self.counters["rejected"] += 1
+            _events.inc(provider=self.provider, event="rejected")
+            self._dispatch()  # The abandoned waiter may have been holding up the queue
+            raise RateLimitExceeded(f"No {self.provider} capacity within {self.max_wait:g} s; retry later.")
+        return min(remaining, delay) if delay is not None else remaining
+
+    def _grant(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.counters["granted"] += 1
+            if waited > 0.001:
+                self.counters["queued"] += 1
+        if waited > 0.001:
+            _events.inc(provider=self.provider, event="queued")
+        _wait.observe(waited, provider=self.provider)
+        return Permit(self)
+
+    def acquire(self, tokens=1, priority=None):
+        """
+        Wait until a call fits the limits and return its Permit.
+
+        :param tokens: Tokens the call counts against TOKENS_PER_MINUTE.
+        :param priority: Name of the call's priority; the current `outbound_priority` if None.
+        :raises RateLimitExceeded: If the call could not be granted within MAX_WAIT seconds.
+        """
+        event = threading.Event()
+        waiter, started = self._enqueue(tokens, priority, event.set)
+        while True:
+            with self._lock:
+                timeout = self._poll(waiter, started)
+                if timeout is None:
+                    break
+                event.clear()
+            event.wait(timeout)
+        return self._grant(started)
+
+    async def aacquire(self, tokens=1, priority=None):
+        """
+        Async version of `acquire`. Cancelling the awaiting task gives up its place in the queue.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # The loop has closed; nobody is waiting anymore
+                pass
+
+        waiter, started = self._enqueue(tokens, priority, wake)
+        try:
+            while True:
+                with self._lock:
+                    timeout = self._poll(waiter, started)
+                    if timeout is None:
+                        break
+                    event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self.in_flight -= 1
+                waiter.abandoned = True
+                self._dispatch()
+            raise
+        return self._grant(started)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def pause(self, seconds):
+        """
+        Hold all calls for `seconds`, after the provider rejected one for exceeding its limits.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.counters["throttled"] += 1
+        _events.inc(provider=self.provider, event="throttled")
+
+
+def retry_after(headers, default=1.0):
+    """
+    Return the seconds to wait given by a 429 response's Retry-After header, or `default`.
+    """
+    try:
+        return float(headers.get("retry-after") or default)
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider):
+    """
+    Return the process-wide ProviderLimiter of `provider` ("openai", "google_places" or "amadeus"),
+    configured from settings.RATE_LIMITS.
+    """
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                limiter = _limiters[provider] = ProviderLimiter(provider)
+    return limiter
@@ -3,8 +3,11 @@ load_dotenv()
 import django
 django.setup()
 
+import threading
+
 from travel_agent.core.models import ToolMethod
-from utils.tools import GooglePlacesTool
+from travel_agent.core.signals import get_tool_registry_version
+from utils.tools import AmadeusTool, GooglePlacesTool
 
 
 class ToolRegistry:
@@ -12,17 +15,23 @@ class ToolRegistry:
         # Initialize tool class instances
         self.tool_instances = {
             "GooglePlacesTool": GooglePlacesTool(),
-            #"AmadeusTool": AmadeusTool(),
+            "AmadeusTool": AmadeusTool(),
         }
-        self.registry = {}
+        self.registry = None  # Loaded on first use; may legitimately be empty
+        self.tool_descriptions = None
+        self.tool_schemas = None
 
-    def validate_registry(self):
+    def validate_registry(self, methods=None):
         """
         Validate that the ToolMethod objects in the database align with the tool_instances.
+        :param methods: Optional pre-fetched ToolMethod objects; queried from the database if omitted.
         """
         validation_errors = []
 
-        for method in ToolMethod.objects.all():
+        if methods is None:
+            methods = ToolMethod.objects.all()
+
+        for method in methods:
             # Check if the tool_class exists in tool_instances
             if method.tool_class not in self.tool_instances:
                 validation_errors.append(
@@ -43,19 +52,30 @@ class ToolRegistry:
         """
         Dynamically populate the tool registry from the database, ensuring all entries are valid.
         """
-        self.registry.clear()  # Clear the registry to reload
+        self.tool_descriptions = None
+        self.tool_schemas = None
+
+        # Fetch the methods once for both validation and population
+        methods = list(ToolMethod.objects.all())
 
         # Perform validation
-        validation_errors = self.validate_registry()
+        validation_errors = self.validate_registry(methods)
         if validation_errors:
             raise ValueError(f"Tool registry validation errors: {', '.join(validation_errors)}")
 
         # Populate the registry
-        for method in ToolMethod.objects.all():
+        self.registry = {}
+        for method in methods:
             tool_class_instance = self.tool_instances.get(method.tool_class)
             if tool_class_instance:
                 self.registry[method.name] = {
+                    "tool_id": method.pk,  # Links saved tool results to the ToolMethod without a lookup
                     "method": getattr(tool_class_instance, method.name, None),
+                    # Optional async twin following Django's "a" prefix convention (e.g. asearch_places)
+                    "async_method": getattr(tool_class_instance, f"a{method.name}", None),
+                    # Optional generators of the result rows that fetch further pages lazily (e.g. iter_search_places)
+                    "iter_method": getattr(tool_class_instance, f"iter_{method.name}", None),
+                    "async_iter_method": getattr(tool_class_instance, f"aiter_{method.name}", None),
                     "parameters": method.parameters,
                     "description": method.description,
                 }
@@ -64,6 +84,76 @@ class ToolRegistry:
         """
         Return the current tool registry.
         """
-        if not self.registry:  # Ensure the registry is loaded
+        if self.registry is None:  # Ensure the registry is loaded
             self.load_registry()
         return self.registry
+
+    def get_tool_descriptions(self):
+        """
+        Return the tool-description block of the system prompt, rendered once per load.
+        """
+        if self.tool_descriptions is None:
+            self.tool_descriptions = "\n".join(
+                [f"- {name}: {info['description']}" for name, info in self.get_tool_registry().items()]
+            )
+        return self.tool_descriptions
+
+    def get_tool_schemas(self):
+        """
+        Return the registry as OpenAI function-calling tool schemas, rendered once per load.
+
+        ToolMethod.parameters maps each parameter name either to a description (the parameter is
+        then a required string) or to a full JSON schema for that parameter.
+        """
+        if self.tool_schemas is None:
+            registry = self.get_tool_registry()  # Loading the registry resets the rendered schemas
+            self.tool_schemas = []
+            for name, info in registry.items():
+                properties = {
+                    param: spec if isinstance(spec, dict) else {"type": "string", "description": spec}
+                    for param, spec in info["parameters"].items()
+                }
+                self.tool_schemas.append({
+                    "type": "function",
+                    "function": {
+                        "name": name,
+                        "description": info["description"],
+                        "parameters": {
+                            "type": "object",
+                            "properties": properties,
+                            "required": list(properties),
+                        },
+                    },
+                })
+        return self.tool_schemas
+
+
+_cached_registry = None
+_cached_version = None
+_cache_lock = threading.Lock()
+
+
+def get_cached_registry():
+    """
+    Return a process-wide, fully loaded ToolRegistry.
+
+    The registry (tool instances, validated method bindings and rendered descriptions) is built
+    once and reused across requests. It is rebuilt only when a ToolMethod row changes, which is
+    detected through the version counter bumped by the ToolMethod post_save/post_delete signals.
+    If the counter cannot be read, the registry is rebuilt on every call rather than risk going stale.
+    """
+    global _cached_registry, _cached_version
+
+    version = get_tool_registry_version()
+    if _cached_registry is not None and version is not None and _cached_version == version:
+        return _cached_registry
+
+    with _cache_lock:
+        # Another thread may have rebuilt the registry while we waited for the lock
+        if _cached_registry is None or version is None or _cached_version != version:
+            registry = ToolRegistry()
+            registry.get_tool_registry()
+            registry.get_tool_descriptions()
+            registry.get_tool_schemas()
+            _cached_registry, _cached_version = registry, version
+        return _cached_registry
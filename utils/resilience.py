@@ -0,0 +1,302 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+from django.conf import settings
+
+from utils.metrics import metrics
+from utils.ratelimit import outbound_priority
+
+# Defaults for settings.LLM_RESILIENCE
+DEFAULT_LLM_RESILIENCE = {
+    # Agent steps (cache_step of the ChatGPT call) retried on timeouts, connection errors, 429s and 5xx;
+    # chat completions have no side effects, so any step can be retried
+    "RETRY_STEPS": ["routing", "tool_routing", "answer"],
+    "MAX_ATTEMPTS": 3,
+    "BACKOFF_BASE": 0.25,  # Seconds; attempt n waits a random time up to BACKOFF_BASE * 2 ** n ("full jitter")
+    "BACKOFF_MAX": 4.0,
+    # Steps whose non-streaming calls are hedged: a duplicate request is sent once the first has taken
+    # longer than the step's HEDGE_QUANTILE latency, and the first reply wins. Each hedge costs a call.
+    "HEDGE_STEPS": [],
+    "HEDGE_QUANTILE": 0.95,
+    # Per-step timeouts: TIMEOUT_MULTIPLIER times the step's TIMEOUT_QUANTILE latency, within bounds
+    "TIMEOUT_QUANTILE": 0.99,
+    "TIMEOUT_MULTIPLIER": 3.0,
+    "MIN_TIMEOUT": 5.0,
+    "MAX_TIMEOUT": 60.0,
+    "WINDOW": 500,  # Latest latencies kept per step
+    "MIN_SAMPLES": 20,  # Latencies needed before a step's timeout and hedge delay adapt; MAX_TIMEOUT until then
+}
+
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def is_retryable(error):
+    """
+    Return whether a RETRYABLE_ERRORS `error` is transient. A 429 is only when it is a rate limit:
+    one for an exhausted quota ("insufficient_quota") fails the same way until billing changes.
+    """
+    if isinstance(error, openai.RateLimitError):
+        return error.code == "rate_limit_exceeded"
+    return True
+
+_retries = metrics.counter("agent_llm_retries_total", "LLM requests retried, by step and error.", ("step", "error"))
+_hedges = metrics.counter(
+    "agent_llm_hedges_total", "Hedged LLM requests fired, and those whose reply came first ('won').",
+    ("step", "outcome"),
+)
+
+
+class LatencyWindow:
+    """
+    The latest `size` latencies of a step, for estimating its quantiles.
+    """
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class LLMResilience:
+    """
+    Retry, timeout and hedging policy for LLM requests.
+
+    Every request gets a timeout adapted from the rolling latencies of its step. Requests of the
+    RETRY_STEPS that fail with a transient error are retried with jittered exponential backoff.
+    Requests of the HEDGE_STEPS are hedged: past the step's HEDGE_QUANTILE latency a duplicate is
+    sent and whichever replies first is used. The slower request finishes in the background and
+    its reply is dropped, after being passed to the caller's `on_discard` callback so the tokens
+    it cost are still accounted for. Streams are retried but never hedged.
+
+    Latencies are recorded per request, hedges included, so hedging does not pull the quantiles down.
+    """
+
+    def __init__(self, retry_steps=None, max_attempts=None, hedge_steps=None, min_samples=None):
+        config = {**DEFAULT_LLM_RESILIENCE, **getattr(settings, "LLM_RESILIENCE", {})}
+        self.retry_steps = set(retry_steps if retry_steps is not None else config["RETRY_STEPS"])
+        self.max_attempts = max_attempts if max_attempts is not None else config["MAX_ATTEMPTS"]
+        self.hedge_steps = set(hedge_steps if hedge_steps is not None else config["HEDGE_STEPS"])
+        self.backoff_base = config["BACKOFF_BASE"]
+        self.backoff_max = config["BACKOFF_MAX"]
+        self.hedge_quantile = config["HEDGE_QUANTILE"]
+        self.timeout_quantile = config["TIMEOUT_QUANTILE"]
+        self.timeout_multiplier = config["TIMEOUT_MULTIPLIER"]
+        self.min_timeout = config["MIN_TIMEOUT"]
+        self.max_timeout = config["MAX_TIMEOUT"]
+        self.window = config["WINDOW"]
+        self.min_samples = min_samples if min_samples is not None else config["MIN_SAMPLES"]
+        self._windows = {}  # (step, stream) -> LatencyWindow
+        self._executor = None
+        self._losers = set()  # Slower hedged tasks of async requests, kept alive until they finish
+        self._lock = threading.Lock()
+
+    def _latencies(self, key):
+        window = self._windows.get(key)
+        if window is None:
+            with self._lock:
+                window = self._windows.setdefault(key, LatencyWindow(self.window))
+        return window
+
+    def _quantile(self, key, q):
+        window = self._latencies(key)
+        return window.quantile(q) if len(window) >= self.min_samples else None
+
+    def timeout(self, step, stream=False):
+        """
+        Return the timeout in seconds of a request of `step`. For streams it bounds the wait for the
+        response headers and then for each chunk, not the whole stream.
+        """
+        latency = self._quantile((step, stream), self.timeout_quantile)
+        if latency is None:
+            return self.max_timeout
+        return min(max(latency * self.timeout_multiplier, self.min_timeout), self.max_timeout)
+
+    def hedge_delay(self, step):
+        """
+        Return the seconds after which a request of `step` is hedged, or None if it is not.
+        """
+        if step not in self.hedge_steps:
+            return None
+        return self._quantile((step, False), self.hedge_quantile)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def stats(self):
+        """
+        Return the number of recent latencies and the hedge delay and timeout of each step.
+        """
+        with self._lock:
+            keys = list(self._windows)
+        return {
+            f"{step}{' (stream)' if stream else ''}": {
+                "samples": len(self._latencies((step, stream))),
+                "p50": self._quantile((step, stream), 0.5),
+                "hedge_delay": None if stream else self.hedge_delay(step),
+                "timeout": self.timeout(step, stream),
+            }
+            for step, stream in keys
+        }
+
+    def _attempts(self, step):
+        return self.max_attempts if step in self.retry_steps else 1
+
+    def _timed(self, key, request, timeout, priority=None):
+        started = time.perf_counter()
+        with outbound_priority(priority) if priority else nullcontext():
+            response = request(timeout)
+        self._latencies(key).observe(time.perf_counter() - started)
+        return response
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+            return self._executor
+
+    @staticmethod
+    def _discard(future, on_discard):
+        """
+        Pass the response of a hedged request that lost the race to `on_discard` once it arrives.
+        """
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                on_discard(future.result())
+
+        if on_discard is not None:
+            future.add_done_callback(done)
+
+    def _hedged(self, step, request, timeout, delay, on_discard=None):
+        executor = self._get_executor()
+        key = (step, False)
+        primary = executor.submit(contextvars.copy_context().run, self._timed, key, request, timeout)
+        if wait([primary], timeout=delay).done:
+            return primary.result()
+
+        _hedges.inc(step=step, outcome="fired")
+        # The duplicate queues behind first requests, so hedging cannot crowd them out of the limits
+        hedge = executor.submit(contextvars.copy_context().run, self._timed, key, request, timeout, "speculative")
+        pending = [primary, hedge]
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        _hedges.inc(step=step, outcome="won")
+                    self._discard(hedge if future is primary else primary, on_discard)
+                    return future.result()
+        return primary.result()  # Both failed; raise the first request's error
+
+    def call(self, step, request, stream=False, on_discard=None):
+        """
+        Run `request(timeout)` under the policy of `step` and return its response.
+
+        :param request: Callable making one API request with the given timeout in seconds.
+        :param stream: Whether the request opens a stream.
+        :param on_discard: Optional callback invoked with the response of a hedged request that lost
+                           the race, whenever it arrives (possibly after this call has returned).
+        """
+        attempts = self._attempts(step)
+        for attempt in range(attempts):
+            timeout = self.timeout(step, stream)
+            delay = None if stream else self.hedge_delay(step)
+            try:
+                if delay is None:
+                    return self._timed((step, stream), request, timeout)
+                return self._hedged(step, request, timeout, delay, on_discard)
+            except RETRYABLE_ERRORS as e:
+                if attempt + 1 >= attempts or not is_retryable(e):
+                    raise
+                _retries.inc(step=step or "", error=type(e).__name__)
+                time.sleep(self.backoff(attempt))
+
+    async def _ahedged(self, step, request, timeout, delay, on_discard=None):
+        key = (step, False)
+        primary = asyncio.ensure_future(self._atimed(key, request, timeout))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            _hedges.inc(step=step, outcome="fired")
+            hedge = asyncio.ensure_future(self._atimed(key, request, timeout, "speculative"))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            _hedges.inc(step=step, outcome="won")
+                        loser = hedge if task is primary else primary
+                        self._losers.add(loser)
+                        loser.add_done_callback(self._losers.discard)
+                        self._discard(loser, on_discard)
+                        pending = set()  # Let the slower request finish
+                        return task.result()
+            return primary.result()
+        finally:
+            # Cancel both requests if the caller was cancelled
+            for task in pending:
+                task.cancel()
+
+    async def _atimed(self, key, request, timeout, priority=None):
+        started = time.perf_counter()
+        with outbound_priority(priority) if priority else nullcontext():
+            response = await request(timeout)
+        self._latencies(key).observe(time.perf_counter() - started)
+        return response
+
+    async def acall(self, step, request, stream=False, on_discard=None):
+        """
+        Async version of `call`; `request(timeout)` returns an awaitable.
+        """
+        attempts = self._attempts(step)
+        for attempt in range(attempts):
+            timeout = self.timeout(step, stream)
+            delay = None if stream else self.hedge_delay(step)
+            try:
+                if delay is None:
+                    return await self._atimed((step, stream), request, timeout)
+                return await self._ahedged(step, request, timeout, delay, on_discard)
+            except RETRYABLE_ERRORS as e:
+                if attempt + 1 >= attempts or not is_retryable(e):
+                    raise
+                _retries.inc(step=step or "", error=type(e).__name__)
+                await asyncio.sleep(self.backoff(attempt))
+
+
+_llm_resilience = None
+_llm_resilience_lock = threading.Lock()
+
+
+def get_llm_resilience():
+    """
+    Return the process-wide LLMResilience configured from settings.LLM_RESILIENCE.
+    """
+    global _llm_resilience
+    if _llm_resilience is None:
+        with _llm_resilience_lock:
+            if _llm_resilience is None:
+                _llm_resilience = LLMResilience()
+    return _llm_resilience
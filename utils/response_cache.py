@@ -0,0 +1,234 @@
+import hashlib
+import json
+import math
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from utils.cache import normalize_query, query_features
+from utils.metrics import metrics
+
+# Defaults for settings.LLM_RESPONSE_CACHE
+DEFAULT_LLM_RESPONSE_CACHE = {
+    "ENABLED": False,  # Opt-in: replies are reused across sessions
+    "MAX_ENTRIES": 2048,  # Cached replies across all steps, evicted least-recently-used
+    "DIMENSIONS": 1024,  # Size of the hashed TF-IDF vectors used for approximate matching
+    # Per-step policies; steps without a policy are never cached. HISTORY_TAIL is the number of latest
+    # messages the key is computed from, THRESHOLD the cosine similarity above which a near-duplicate
+    # counts as a hit (1.0 disables approximate matching) and STATELESS_ONLY restricts caching to
+    # calls whose history holds nothing but the current user message.
+    "POLICIES": {
+        # Classic routing: the reply is only a tool name, so near-duplicates can share it
+        "routing": {"TTL": 24 * 60 * 60, "THRESHOLD": 0.8, "HISTORY_TAIL": 1, "STATELESS_ONLY": False},
+        # Function-calling routing: the reply carries tool arguments or a direct answer
+        "tool_routing": {"TTL": 60 * 60, "THRESHOLD": 0.9, "HISTORY_TAIL": 1, "STATELESS_ONLY": True},
+        # Conversational answers, which depend on the whole conversation
+        "answer": {"TTL": 60 * 60, "THRESHOLD": 0.92, "HISTORY_TAIL": 1, "STATELESS_ONLY": True},
+    },
+}
+
+
+_events = metrics.counter(
+    "agent_llm_response_cache_total",
+    "LLM response cache lookups by outcome (exact_hit, semantic_hit, miss, bypassed) and evictions, per agent step.",
+    ("step", "event"),
+)
+
+
+def _is_stateless(history):
+    """
+    Return whether the history holds nothing but the current user message.
+    """
+    return len(history or []) <= 1 and all(message["role"] == "user" for message in history or [])
+
+
+class CacheLookup:
+    """
+    Outcome of `ResponseCache.lookup`. On a miss, pass the fresh reply to `store` to cache it.
+    """
+
+    def __init__(self, cache=None, step=None, policy=None, scope=None, key=None, text=None, hit=False, value=None):
+        self.cache = cache
+        self.step = step
+        self.policy = policy
+        self.scope = scope
+        self.key = key
+        self.text = text
+        self.hit = hit
+        self.value = value
+
+    def store(self, value):
+        if self.cache is not None and not self.hit:
+            self.cache._store(self, value)
+
+
+class ResponseCache:
+    """
+    Cache of LLM replies keyed on the normalized (prompt, history tail) of a call.
+
+    A lookup first tries an exact match. It then falls back to the most similar cached call with
+    the same prompt: texts are embedded locally as hashed TF-IDF vectors, held in a NumPy matrix,
+    and compared by cosine similarity against the step's THRESHOLD. Entries expire after their
+    step's TTL and the least recently used are evicted past MAX_ENTRIES.
+    """
+
+    def __init__(self, enabled=None, max_entries=None, dimensions=None, policies=None):
+        config = {**DEFAULT_LLM_RESPONSE_CACHE, **getattr(settings, "LLM_RESPONSE_CACHE", {})}
+        self.enabled = enabled if enabled is not None else config["ENABLED"]
+        self.max_entries = max_entries if max_entries is not None else config["MAX_ENTRIES"]
+        self.dimensions = dimensions if dimensions is not None else config["DIMENSIONS"]
+        self.policies = policies if policies is not None else config["POLICIES"]
+        self._entries = OrderedDict()  # key -> entry dict, least recently used first
+        self._lock = threading.Lock()
+        self._matrix = None  # Row i holds the unit vector of the entry in _row_keys[i]
+        self._row_keys = []
+        self._free_rows = []
+        self._scope_rows = {}  # Scope (step and prompt) -> rows of its entries
+        self._document_frequency = Counter()  # Feature bucket -> number of cached texts containing it
+        self._documents = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._row_keys = []
+            self._free_rows = []
+            self._scope_rows.clear()
+            self._document_frequency.clear()
+            self._documents = 0
+
+    def _embed(self, text):
+        """
+        Embed a normalized text as a unit-length hashed TF-IDF vector, or None if it has no features.
+        """
+        buckets = Counter(zlib.crc32(feature.encode()) % self.dimensions for feature in query_features(text))
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for bucket, count in buckets.items():
+            idf = math.log((1 + self._documents) / (1 + self._document_frequency[bucket])) + 1
+            vector[bucket] = count * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, step, prompt, history=None, extra=None):
+        """
+        Look up the reply of an LLM call.
+
+        :param step: Name of the agent step making the call; selects the caching policy.
+        :param prompt: System prompt of the call.
+        :param history: Messages sent with the call.
+        :param extra: Other inputs that change the reply (tool schemas, response format), JSON-serializable.
+        :return: CacheLookup; `hit` tells whether `value` holds a cached reply.
+        """
+        policy = self.policies.get(step) if self.enabled and step else None
+        if policy is None:
+            return CacheLookup()
+        history = history or []
+        if policy.get("STATELESS_ONLY") and not _is_stateless(history):
+            _events.inc(step=step, event="bypassed")
+            return CacheLookup()
+
+        tail = history[-policy.get("HISTORY_TAIL", 1):] if history else []
+        text = normalize_query(" ".join(message["content"] or "" for message in tail))
+        scope = hashlib.sha1(
+            json.dumps([step, prompt, extra], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        key = f"{scope}:{hashlib.sha1(text.encode()).hexdigest()}"
+        lookup = CacheLookup(self, step, policy, scope, key, text)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                _events.inc(step=step, event="exact_hit")
+            elif self._matrix is not None and policy.get("THRESHOLD", 1.0) < 1.0:
+                entry = self._nearest(scope, text, policy["THRESHOLD"], now)
+                if entry is not None:
+                    _events.inc(step=step, event="semantic_hit")
+            if entry is None:
+                _events.inc(step=step, event="miss")
+                return lookup
+            self._entries.move_to_end(entry["key"])
+            lookup.hit, lookup.value = True, entry["value"]
+            return lookup
+
+    def _nearest(self, scope, text, threshold, now):
+        """
+        Return the live entry of `scope` most similar to `text`, if above `threshold`.
+        """
+        rows = self._scope_rows.get(scope)
+        vector = self._embed(text) if rows else None
+        if vector is None:
+            return None
+        rows = np.fromiter(rows, dtype=np.intp, count=len(rows))
+        scores = self._matrix[rows] @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        key = self._row_keys[rows[best]]
+        if self._entries[key]["expires_at"] <= now:
+            self._remove(key)
+            return None
+        return self._entries[key]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        if entry["row"] is not None:
+            self._row_keys[entry["row"]] = None
+            self._free_rows.append(entry["row"])
+            self._scope_rows[entry["scope"]].discard(entry["row"])
+        return entry
+
+    def _store(self, lookup, value):
+        with self._lock:
+            if lookup.key in self._entries:
+                self._remove(lookup.key)
+            while len(self._entries) >= self.max_entries:
+                evicted = self._remove(next(iter(self._entries)))
+                _events.inc(step=evicted["step"], event="eviction")
+
+            row = None
+            features = {zlib.crc32(feature.encode()) % self.dimensions for feature in query_features(lookup.text)}
+            self._documents += 1
+            self._document_frequency.update(features)
+            vector = self._embed(lookup.text)
+            if vector is not None:
+                if self._matrix is None:
+                    self._matrix = np.zeros((self.max_entries, self.dimensions), dtype=np.float32)
+                row = self._free_rows.pop() if self._free_rows else len(self._row_keys)
+                if row == len(self._row_keys):
+                    self._row_keys.append(None)
+                self._matrix[row] = vector
+                self._row_keys[row] = lookup.key
+                self._scope_rows.setdefault(lookup.scope, set()).add(row)
+
+            self._entries[lookup.key] = {
+                "key": lookup.key,
+                "step": lookup.step,
+                "scope": lookup.scope,
+                "value": value,
+                "row": row,
+                "expires_at": time.monotonic() + lookup.policy["TTL"],
+            }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Return the process-wide ResponseCache configured from settings.LLM_RESPONSE_CACHE.
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+    return _response_cache
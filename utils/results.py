@@ -0,0 +1,119 @@
+from django.conf import settings
+
+# Defaults for settings.TOOL_RESULTS
+DEFAULT_TOOL_RESULTS = {
+    "TOP_K": 5,  # Rows of a tool result rendered into a prompt
+    "MAX_STORED_ROWS": 10,  # Rows of a tool result kept in the database
+    "FIELDS": {},  # Tool name -> fields rendered into prompts (projection); every field if not listed
+}
+
+
+def tool_result(tool, rows, total=None, has_more=False, **meta):
+    """
+    Build a structured tool result.
+
+    :param tool: Name of the tool method that produced the result.
+    :param rows: List of flat dicts, best match first, already projected to the fields worth keeping.
+    :param total: Number of matches the upstream API returned, if more than `rows`.
+    :param has_more: Whether further matches can be fetched although their number is unknown (e.g.
+                     a page of a paginated search); `total` is then left None.
+    :param meta: Scalar context of the call (e.g. the query), rendered in the header line.
+    :return: JSON-serializable dict stored in `ConversationMessage.tool_result`.
+    """
+    if has_more:
+        return {"tool": tool, "rows": rows, "total": total, "has_more": True, "meta": meta}
+    return {"tool": tool, "rows": rows, "total": total if total is not None else len(rows), "meta": meta}
+
+
+def tool_error(tool, error, **meta):
+    """
+    Build a structured tool result for a failed call.
+    """
+    return {"tool": tool, "error": str(error), "meta": meta}
+
+
+def is_tool_result(value):
+    return isinstance(value, dict) and "tool" in value and ("rows" in value or "error" in value)
+
+
+def _format_value(value):
+    """
+    Render a cell of the compact encoding; the column separator and newlines are escaped.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if isinstance(value, (list, tuple)):
+        value = ",".join(str(item) for item in value)
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def _format_count(result, shown):
+    """
+    Render how many of a result's matches are shown, e.g. "5 of 20 results" or "5 results, more available".
+    """
+    if result["total"] is None:
+        return f"{shown} results, more available"
+    return f"{shown} of {result['total']} results"
+
+
+class ToolResultEncoder:
+    """
+    Render structured tool results into the compact text sent to the LLM.
+
+    Rows are encoded as a table: a header line with the tool, row counts and call context, a line
+    of column names, then one `|`-separated line per row. Only the first TOP_K rows and the
+    tool's projected FIELDS are rendered, so the same stored result can be re-rendered smaller.
+    """
+
+    def __init__(self, top_k=None, max_stored_rows=None, fields=None):
+        config = {**DEFAULT_TOOL_RESULTS, **getattr(settings, "TOOL_RESULTS", {})}
+        self.top_k = top_k if top_k is not None else config["TOP_K"]
+        self.max_stored_rows = max_stored_rows if max_stored_rows is not None else config["MAX_STORED_ROWS"]
+        self.fields = fields if fields is not None else config["FIELDS"]
+
+    def trim(self, result):
+        """
+        Return `result` with at most MAX_STORED_ROWS rows, for storage.
+        """
+        if not is_tool_result(result) or len(result.get("rows", [])) <= self.max_stored_rows:
+            return result
+        return {**result, "rows": result["rows"][: self.max_stored_rows]}
+
+    def encode(self, result, top_k=None):
+        """
+        Render a tool's result for a prompt. Results that are not structured (plain text from
+        tools or messages stored before structured results) are returned as text unchanged.
+
+        :param top_k: Rows to render; TOP_K if None.
+        """
+        if not is_tool_result(result):
+            return str(result)
+
+        meta = ", ".join(f"{key}={_format_value(value)}" for key, value in result.get("meta", {}).items())
+        header = f"{result['tool']}({meta})" if meta else result["tool"]
+        if "error" in result:
+            return f"{header}: error: {result['error']}"
+
+        rows = result["rows"][: top_k if top_k is not None else self.top_k]
+        if not rows:
+            return f"{header}: no results"
+
+        columns = self.fields.get(result["tool"]) or list(dict.fromkeys(key for row in rows for key in row))
+        lines = [
+            f"{header}: {_format_count(result, len(rows))}",
+            "|".join(columns),
+            *("|".join(_format_value(row.get(column)) for column in columns) for row in rows),
+        ]
+        return "\n".join(lines)
+
+    def summarize(self, result):
+        """
+        Return the one-line label stored as the content of a tool result message.
+        """
+        if not is_tool_result(result):
+            return f"Tool result: {result}"
+        if "error" in result:
+            return f"Tool result: {result['tool']} failed"
+        return f"Tool result: {result['tool']} ({_format_count(result, len(result['rows']))})"
@@ -0,0 +1,322 @@
+import atexit
+import math
+import threading
+import time
+import traceback
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from travel_agent.core.models import RoutingDecision
+from utils.cache import normalize_query, query_features
+from utils.metrics import metrics
+
+# Defaults for settings.TOOL_ROUTER
+DEFAULT_TOOL_ROUTER = {
+    "ENABLED": False,  # Let the router decide confident turns; evaluate it with `manage.py evaluate_router` first
+    "RECORD": True,  # Log the LLM's routing decisions, the router's training data, even while not ENABLED
+    "THRESHOLD": 0.85,  # Probability above which a local decision is trusted without asking the LLM
+    "MIN_EXAMPLES": 20,  # Logged LLM decisions needed before the router decides on its own
+    "MAX_EXAMPLES": 2000,  # Most recent LLM decisions used for training
+    "MAX_FEATURES": 2000,  # Vocabulary size of the TF-IDF features
+    "RETRAIN_EVERY": 50,  # New LLM decisions after which the model is retrained
+    "LOG_BATCH": 20,  # Decisions buffered before they are written
+    # Seed phrases per tool (and for "none", no tool) learned alongside the logged decisions
+    "KEYWORDS": {},
+}
+
+# Label of the decision not to use any tool
+NO_TOOL = ""
+
+_decisions = metrics.counter(
+    "agent_tool_router_decisions_total",
+    "Routing steps decided by the local router ('local') or left to the LLM ('fallback').",
+    ("source",),
+)
+
+
+def _tool_key(label):
+    return "none" if label == NO_TOOL else label
+
+
+def routing_features(text, context=""):
+    """
+    Return the features of a user message: those of its text, plus those of the previous user
+    message `context` marked as such, so that follow-ups (e.g. "what about Denver?") are routed
+    like the request they follow.
+    """
+    features = query_features(normalize_query(text))
+    if context:
+        features += [f"prev:{feature}" for feature in query_features(normalize_query(context))]
+    return features
+
+
+def _fit_softmax(X, Y, l2=1e-3, iterations=300, learning_rate=1.0):
+    """
+    Fit a multinomial logistic regression without intercept by gradient descent.
+
+    Without an intercept, a message sharing no features with the training data scores every
+    label equally and is never routed confidently.
+    """
+    weights = np.zeros((X.shape[1], Y.shape[1]), dtype=np.float32)
+    for _ in range(iterations):
+        logits = X @ weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        gradient = X.T @ ((probabilities - Y) / X.shape[0]) + l2 * weights
+        weights -= learning_rate * gradient
+    return weights
+
+
+class RouterModel:
+    """
+    TF-IDF features and logistic regression weights of a trained router.
+    """
+
+    def __init__(self, vocabulary, idf, weights, labels, tools, examples):
+        self.vocabulary = vocabulary  # Feature -> column
+        self.idf = idf
+        self.weights = weights
+        self.labels = labels  # Column of `weights` -> tool name (NO_TOOL for no tool)
+        self.tools = tools  # Tool names the model was trained for
+        self.examples = examples  # Logged LLM decisions in the training set
+
+    def vectorize(self, text, context=""):
+        counts = Counter(
+            self.vocabulary[feature] for feature in routing_features(text, context) if feature in self.vocabulary
+        )
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for column, count in counts.items():
+            vector[column] = count * self.idf[column]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def predict(self, text, context=""):
+        """
+        Return (label, probability) of the most likely decision, or (None, 0.0) if the text and
+        its context share no feature with the training data.
+        """
+        vector = self.vectorize(text, context)
+        if vector is None:
+            return None, 0.0
+        logits = vector @ self.weights
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+
+def fit_router_model(tools, examples, keywords=None, max_features=None):
+    """
+    Train a RouterModel.
+
+    :param tools: Dict of tool name -> description; each description is a training document of its tool.
+    :param examples: List of (text, context, tool) decisions made by the LLM router, context being the
+                     previous user message ("" if none) and tool NO_TOOL for none.
+    :param keywords: Dict of tool name (or "none") -> seed phrases, each a training document.
+    :param max_features: Keep only the most frequent features.
+    :return: RouterModel, or None if there is nothing to choose between.
+    """
+    config = {**DEFAULT_TOOL_ROUTER, **getattr(settings, "TOOL_ROUTER", {})}
+    keywords = keywords if keywords is not None else config["KEYWORDS"]
+    max_features = max_features if max_features is not None else config["MAX_FEATURES"]
+
+    examples = [(text, context, tool) for text, context, tool in examples if tool == NO_TOOL or tool in tools]
+    documents = list(examples)
+    for tool, description in tools.items():
+        documents.append((description, "", tool))
+    for label in [NO_TOOL, *tools]:
+        documents.extend((phrase, "", label) for phrase in keywords.get(_tool_key(label), []))
+
+    labels = sorted({tool for _, _, tool in documents})
+    if len(labels) < 2:
+        return None
+
+    tokenized = [set(routing_features(text, context)) for text, context, _ in documents]
+    document_frequency = Counter(feature for features in tokenized for feature in features)
+    features = [feature for feature, _ in document_frequency.most_common(max_features)]
+    vocabulary = {feature: column for column, feature in enumerate(features)}
+    idf = np.array(
+        [math.log((1 + len(documents)) / (1 + document_frequency[feature])) + 1 for feature in features],
+        dtype=np.float32,
+    )
+
+    model = RouterModel(vocabulary, idf, None, labels, set(tools), len(examples))
+    rows, targets = [], []
+    for text, context, tool in documents:
+        vector = model.vectorize(text, context)
+        if vector is not None:
+            rows.append(vector)
+            targets.append(labels.index(tool))
+    X = np.stack(rows)
+    Y = np.eye(len(labels), dtype=np.float32)[targets]
+    model.weights = _fit_softmax(X, Y)
+    return model
+
+
+class ToolRouter:
+    """
+    In-process fast path for tool routing.
+
+    A logistic regression over TF-IDF features of the user message and of the previous one,
+    trained on the tool descriptions, seed KEYWORDS and the decisions previously made by the LLM
+    router. Messages it routes with at least THRESHOLD probability skip the LLM routing call; the
+    rest fall back to the LLM, whose decisions are logged as RoutingDecisions and retrained on
+    every RETRAIN_EVERY new decisions. Logging and training run in a background thread, never in
+    the request path. The router is off unless ENABLED, but LLM decisions are still logged (see
+    RECORD) so that `manage.py evaluate_router` can tell whether it is worth enabling.
+    """
+
+    def __init__(self, enabled=None, threshold=None, min_examples=None, max_examples=None, retrain_every=None,
+                 log_batch=None, recording=None):
+        config = {**DEFAULT_TOOL_ROUTER, **getattr(settings, "TOOL_ROUTER", {})}
+        self.enabled = enabled if enabled is not None else config["ENABLED"]
+        self.recording = recording if recording is not None else config["RECORD"]
+        self.threshold = threshold if threshold is not None else config["THRESHOLD"]
+        self.min_examples = min_examples if min_examples is not None else config["MIN_EXAMPLES"]
+        self.max_examples = max_examples if max_examples is not None else config["MAX_EXAMPLES"]
+        self.retrain_every = retrain_every if retrain_every is not None else config["RETRAIN_EVERY"]
+        self.log_batch = log_batch if log_batch is not None else config["LOG_BATCH"]
+        self.model = None
+        self._tools = None  # Tools of the latest routed turn; the model is retrained when they change
+        self._pending = []  # Unsaved RoutingDecisions
+        self._new_decisions = 0  # LLM decisions logged since the last training
+        self._retrain = False
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def route(self, text, tools, context=""):
+        """
+        Route a user message locally.
+
+        :param text: The latest user message.
+        :param context: The previous user message of the conversation, if any.
+        :param tools: Dict of tool name -> description of the available tools.
+        :return: Tuple of (decided, tool, confidence). When `decided` is False the caller asks the LLM;
+                 otherwise `tool` is the tool name to use, or None for no tool.
+        """
+        if not self.enabled:
+            return False, None, 0.0
+
+        model = self.model
+        if model is None or model.tools != set(tools):
+            with self._lock:
+                changed = self._tools != tools
+                if changed:
+                    self._tools = dict(tools)
+                    self._retrain = True
+            if changed:
+                self._start_worker()
+            return self._fallback()
+
+        started = time.perf_counter()
+        label, confidence = model.predict(text, context)
+        if label is None or confidence < self.threshold or model.examples < self.min_examples:
+            return self._fallback(confidence)
+
+        tool = label or None
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.record(text, tool, "local", context=context, confidence=confidence, latency_ms=latency_ms)
+        _decisions.inc(source="local")
+        return True, tool, confidence
+
+    def predict(self, text, tools, context=""):
+        """
+        Return (tool, probability) of the current model's most likely decision for `text`, tool being
+        None for no tool, without recording anything; (None, 0.0) if no model is trained for `tools`.
+        """
+        model = self.model
+        if not self.enabled or model is None or model.tools != set(tools):
+            return None, 0.0
+        label, probability = model.predict(text, context)
+        return label or None, probability
+
+    def _fallback(self, confidence=0.0):
+        _decisions.inc(source="fallback")
+        return False, None, confidence
+
+    def record(self, text, tool, source, context="", confidence=None, latency_ms=None):
+        """
+        Log a routing decision; LLM decisions become training examples.
+
+        :param tool: Name of the chosen tool, or None for no tool.
+        :param source: "llm" or "local".
+        :param context: The previous user message of the conversation, if any.
+        """
+        if not (self.enabled or self.recording):
+            return
+        decision = RoutingDecision(
+            text=text, context=context, tool=tool or NO_TOOL, source=source, confidence=confidence,
+            latency_ms=latency_ms,
+        )
+        with self._lock:
+            self._pending.append(decision)
+            if source == "llm":
+                self._new_decisions += 1
+                if self.enabled and self._new_decisions >= self.retrain_every:
+                    self._retrain = True
+            due = len(self._pending) >= self.log_batch or self._retrain
+        if due:
+            self._start_worker()
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._work, name="tool-router", daemon=True)
+            self._worker.start()
+
+    def _work(self):
+        try:
+            self.flush()
+            with self._lock:
+                retrain, tools = self._retrain, self._tools
+            if retrain and tools is not None:
+                self.train(tools)
+        except Exception:
+            print(f"Error updating the tool router:\n{traceback.format_exc()}")
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """
+        Write the buffered routing decisions.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            RoutingDecision.objects.bulk_create(pending)
+
+    def train(self, tools):
+        """
+        Retrain the model on the most recent logged LLM decisions and swap it in.
+        """
+        with self._lock:
+            self._retrain = False
+            self._new_decisions = 0
+        examples = (
+            RoutingDecision.objects.filter(source="llm")
+            .order_by("-created_at")
+            .values_list("text", "context", "tool")[: self.max_examples]
+        )
+        self.model = fit_router_model(tools, list(examples))
+
+
+_tool_router = None
+_tool_router_lock = threading.Lock()
+
+
+def get_tool_router():
+    """
+    Return the process-wide ToolRouter configured from settings.TOOL_ROUTER.
+    """
+    global _tool_router
+    if _tool_router is None:
+        with _tool_router_lock:
+            if _tool_router is None:
+                _tool_router = ToolRouter()
+                atexit.register(_tool_router.flush)
+    return _tool_router
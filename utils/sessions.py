@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from utils.metrics import metrics
+
+# Defaults for settings.AGENT_SESSION_CACHE
+DEFAULT_AGENT_SESSION_CACHE = {
+    "MAX_SESSIONS": 256,  # Live agents kept per worker
+    "IDLE_TIMEOUT": 15 * 60,  # Seconds after which an unused agent is evicted
+    "VERIFY": True,  # Check the database for messages written by other workers before reusing an agent
+}
+
+_events = metrics.counter(
+    "agent_session_cache_total", "Agent session cache lookups (hit, miss) and evictions.", ("cache", "event"),
+)
+
+
+class _Session:
+    """
+    A cached agent with the lock serializing its turns. `agent` is None until the first turn builds it.
+    """
+
+    def __init__(self, lock):
+        self.agent = None
+        self.lock = lock
+        self.last_used = time.monotonic()
+        self.active = 0  # Turns holding or waiting for the lock; the entry is not evicted meanwhile
+
+
+class AgentSessionCache:
+    """
+    Bounded per-worker cache of live TravelAgents keyed by session_id.
+
+    A hot agent keeps its conversation and in-memory history between turns, so a turn no longer
+    reloads the whole history from the database. Agents are evicted least-recently-used once
+    MAX_SESSIONS is exceeded, after IDLE_TIMEOUT seconds without use, or when a turn fails (its
+    in-memory state may then be out of step with the database). A miss builds a fresh agent.
+
+    The entry of a session is looked up or inserted atomically and is not evicted while a turn
+    uses it, so concurrent turns of a session always share one agent and one lock.
+    """
+
+    def __init__(self, name, max_sessions=None, idle_timeout=None, verify=None):
+        """
+        :param name: Label of the cache in the agent_session_cache_total metric, e.g. "sync".
+        """
+        config = {**DEFAULT_AGENT_SESSION_CACHE, **getattr(settings, "AGENT_SESSION_CACHE", {})}
+        self.name = name
+        self.max_sessions = max_sessions if max_sessions is not None else config["MAX_SESSIONS"]
+        self.idle_timeout = idle_timeout if idle_timeout is not None else config["IDLE_TIMEOUT"]
+        self.verify = verify if verify is not None else config["VERIFY"]
+        self._entries = OrderedDict()  # session_id -> _Session, least recently used first
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now):
+        for session_id, entry in list(self._entries.items()):
+            # Entries are ordered by last use, so stop at the first one that is still fresh
+            if now - entry.last_used < self.idle_timeout:
+                break
+            if not entry.active:
+                del self._entries[session_id]
+                _events.inc(cache=self.name, event="eviction")
+
+    def _evict_lru(self):
+        for session_id, entry in list(self._entries.items()):
+            if len(self._entries) <= self.max_sessions:
+                break
+            if not entry.active:
+                del self._entries[session_id]
+                _events.inc(cache=self.name, event="eviction")
+
+    def _acquire(self, session_id, lock_factory):
+        """
+        Return the entry of `session_id`, inserting an empty one (with a lock from `lock_factory`)
+        on a miss, and mark it in use.
+        """
+        key = str(session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Session(lock_factory())
+                _events.inc(cache=self.name, event="miss")
+            else:
+                self._entries.move_to_end(key)
+                _events.inc(cache=self.name, event="hit")
+            entry.last_used = now
+            entry.active += 1
+            self._evict_lru()
+            return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+            self._evict_lru()
+
+    def _discard(self, entry):
+        # Drop the agent but keep the entry and its lock, so the next turn rebuilds the agent in turn
+        with self._lock:
+            entry.agent = None
+            _events.inc(cache=self.name, event="eviction")
+
+    def evict(self, session_id):
+        """
+        Drop the cached agent for `session_id`, if any.
+        """
+        with self._lock:
+            if self._entries.pop(str(session_id), None) is not None:
+                _events.inc(cache=self.name, event="eviction")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @contextmanager
+    def checkout(self, session_id, factory, llm=None):
+        """
+        Yield the live agent for `session_id`, building it with `factory()` on a miss.
+
+        Turns of the same session are serialized on a per-session lock, which is also held while
+        the agent is built. A cached agent is refreshed before reuse, switching to `llm` (the
+        request's LLM client) if given; if the turn raises, the agent is dropped and the next turn
+        builds a fresh one.
+        """
+        entry = self._acquire(session_id, threading.Lock)
+        try:
+            with entry.lock:
+                try:
+                    if entry.agent is None:
+                        entry.agent = factory()
+                    else:
+                        entry.agent.refresh(check_history=self.verify, llm=llm)
+                    yield entry.agent
+                except BaseException:
+                    self._discard(entry)
+                    raise
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def acheckout(self, session_id, factory, llm=None):
+        """
+        Async version of `checkout` for AsyncTravelAgents; `factory` is a coroutine function. Pass
+        the request's AsyncChatGPT as `llm`, since each request may run on its own event loop and
+        the clients of AsyncChatGPT are bound to the loop they were created on.
+        """
+        entry = self._acquire(session_id, asyncio.Lock)
+        try:
+            async with entry.lock:
+                try:
+                    if entry.agent is None:
+                        entry.agent = await factory()
+                    else:
+                        await entry.agent.refresh(check_history=self.verify, llm=llm)
+                    yield entry.agent
+                except BaseException:
+                    self._discard(entry)
+                    raise
+        finally:
+            self._release(entry)
+
+
+# Per-worker caches for the sync (WSGI) and async (ASGI) agents
+agent_sessions = AgentSessionCache("sync")
+async_agent_sessions = AgentSessionCache("async")
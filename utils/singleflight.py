@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+
+from django.conf import settings
+
+from utils.metrics import metrics
+
+# Defaults for settings.REQUEST_COALESCING
+DEFAULT_REQUEST_COALESCING = {
+    "ENABLED": True,
+    # Agent steps (cache_step of the ChatGPT call) whose identical non-streaming LLM calls are coalesced;
+    # tool calls are always coalesced when ENABLED
+    "LLM_STEPS": ["routing", "tool_routing"],
+}
+
+_calls = metrics.counter(
+    "agent_singleflight_calls_total",
+    "Calls through a singleflight group: 'leader' ran the call, 'coalesced' waited for an identical one.",
+    ("group", "role"),
+)
+
+_config = None
+
+
+def get_coalescing_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_REQUEST_COALESCING, **getattr(settings, "REQUEST_COALESCING", {})}
+    return _config
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls onto one: the first caller of a key runs the call and
+    every caller arriving while it is in flight waits for it and shares its result or exception.
+    Nothing is kept once the call completes (see utils/cache.py for caching).
+
+    Works across the threads of a worker and across event loops: in-flight calls are tracked as
+    concurrent.futures Futures, which sync callers block on and async callers await. If the
+    leader is cancelled, its waiters retry and one of them takes over the call.
+    """
+
+    def __init__(self, name, enabled=None):
+        self.name = name
+        self.enabled = enabled if enabled is not None else get_coalescing_config()["ENABLED"]
+        self._calls = {}  # key -> Future of the in-flight call
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def stats(self):
+        """
+        Return the number of calls run, calls coalesced onto them and failed calls, and the calls in flight.
+        """
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._calls)}
+
+    def _join(self, key):
+        """
+        Return the Future of the call in flight for `key`, and whether the caller must run it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                _calls.inc(group=self.name, role="coalesced")
+                return future, False
+            future = self._calls[key] = Future()
+            self.counters["calls"] += 1
+        _calls.inc(group=self.name, role="leader")
+        return future, True
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+            if isinstance(error, Exception):
+                self.counters["errors"] += 1
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # The leader was cancelled or interrupted rather than failing; let the waiters retry
+            future.cancel()
+
+    def do(self, key, call):
+        """
+        Return `call()`, or the result of the identical call already in flight under `key`.
+        """
+        if not self.enabled:
+            return call()
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result()
+                except CancelledError:
+                    continue
+            try:
+                result = call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, result)
+            return result
+
+    async def ado(self, key, call):
+        """
+        Async version of `do`; `call` is a zero-argument coroutine function.
+        """
+        if not self.enabled:
+            return await call()
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    # Shielded so that cancelling this waiter does not cancel the shared call
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    if future.cancelled() and not asyncio.current_task().cancelling():
+                        continue
+                    raise
+            try:
+                result = await call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, result)
+            return result
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_singleflight(name):
+    """
+    Return the process-wide SingleFlight group `name` (e.g. "tools" or "llm").
+    """
+    group = _groups.get(name)
+    if group is None:
+        with _groups_lock:
+            group = _groups.get(name)
+            if group is None:
+                group = _groups[name] = SingleFlight(name)
+    return group
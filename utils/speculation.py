@@ -0,0 +1,192 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from utils.metrics import metrics
+from utils.ratelimit import outbound_priority
+
+# Defaults for settings.SPECULATIVE_TOOLS
+DEFAULT_SPECULATIVE_TOOLS = {
+    "ENABLED": False,
+    # 'router': speculate on the local router's most likely tool when it is at least MIN_CONFIDENCE sure;
+    # 'always': speculate on the first of TOOLS available on every classic turn
+    "POLICY": "router",
+    "MIN_CONFIDENCE": 0.5,
+    # Tools that may run speculatively: read-only, with the user message as their only argument
+    "TOOLS": ["search_places"],
+    "MAX_WORKERS": 8,  # Threads running speculative calls of sync tools
+}
+
+_outcomes = metrics.counter(
+    "agent_tool_speculations_total",
+    "Speculative tool calls by outcome: hit (result used), wasted (ran, result discarded or failed) or cancelled.",
+    ("tool", "outcome"),
+)
+
+
+class Speculation:
+    """
+    A tool call started before the routing decision. Claim its result with `result` (or `aresult`)
+    when routing picked the same tool, otherwise `discard` it. It counts as a hit only once its
+    result is in; a call that failed counts as wasted and is replaced by the caller's fallback.
+    """
+
+    def __init__(self, tool_name, query, future):
+        self.tool_name = tool_name
+        self.query = query
+        self.future = future  # concurrent.futures.Future, or an asyncio.Task in async agents
+
+    def matches(self, tool_name, query):
+        return tool_name == self.tool_name and query == self.query
+
+    def result(self, fallback):
+        """
+        Return the call's result, or that of `fallback()` if the call failed.
+        """
+        try:
+            result = self.future.result()
+        except Exception as e:
+            print(f"Speculative {self.tool_name} call failed, running it again: {e}")
+            _outcomes.inc(tool=self.tool_name, outcome="wasted")
+            return fallback()
+        _outcomes.inc(tool=self.tool_name, outcome="hit")
+        return result
+
+    async def aresult(self, fallback):
+        """
+        Async version of `result`; `fallback()` returns an awaitable.
+        """
+        try:
+            result = await self.future
+        except Exception as e:
+            print(f"Speculative {self.tool_name} call failed, running it again: {e}")
+            _outcomes.inc(tool=self.tool_name, outcome="wasted")
+            return await fallback()
+        _outcomes.inc(tool=self.tool_name, outcome="hit")
+        return result
+
+    def discard(self):
+        """
+        Cancel the call if it can still be cancelled; otherwise let it finish and drop its result.
+        """
+        if self.future.cancel():
+            _outcomes.inc(tool=self.tool_name, outcome="cancelled")
+            return
+        _outcomes.inc(tool=self.tool_name, outcome="wasted")
+        if self.future.done():
+            self.future.exception()  # Retrieve a failure so it is not reported as unhandled
+
+
+class ToolSpeculator:
+    """
+    Start the most probable tool of a classic turn concurrently with the routing LLM call, so
+    a turn that uses the tool waits for max(routing, tool) instead of routing + tool.
+
+    Only tools listed in TOOLS are speculated on, since their call may be wasted: they must be
+    free of side effects and take the user message as their only argument, as in classic routing.
+    """
+
+    def __init__(self, enabled=None, policy=None, min_confidence=None, tools=None, max_workers=None):
+        config = {**DEFAULT_SPECULATIVE_TOOLS, **getattr(settings, "SPECULATIVE_TOOLS", {})}
+        self.enabled = enabled if enabled is not None else config["ENABLED"]
+        self.policy = policy if policy is not None else config["POLICY"]
+        if self.policy not in ("router", "always"):
+            raise ValueError(f"Invalid tool speculation policy: '{self.policy}'")
+        self.min_confidence = min_confidence if min_confidence is not None else config["MIN_CONFIDENCE"]
+        self.tools = tools if tools is not None else config["TOOLS"]
+        self.max_workers = max_workers if max_workers is not None else config["MAX_WORKERS"]
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Return the number of speculative calls per outcome and the share whose result was used.
+        """
+        counts = {outcome: 0 for outcome in ("hit", "wasted", "cancelled")}
+        for tool in self.tools:
+            for outcome in counts:
+                counts[outcome] += _outcomes.value(tool=tool, outcome=outcome)
+        launched = sum(counts.values())
+        return {**counts, "launched": launched, "hit_rate": counts["hit"] / launched if launched else 0.0}
+
+    def choose(self, text, tools, router, context=""):
+        """
+        Return the tool to speculate on for the user message `text`, or None.
+
+        :param tools: Dict of tool name -> description of the agent's tools.
+        :param router: ToolRouter whose prediction drives the 'router' policy.
+        :param context: The previous user message, passed on to the router.
+        """
+        if not self.enabled:
+            return None
+        candidates = [tool for tool in self.tools if tool in tools]
+        if not candidates:
+            return None
+        if self.policy == "always":
+            return candidates[0]
+        tool, confidence = router.predict(text, tools, context)
+        return tool if tool in candidates and confidence >= self.min_confidence else None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool-speculation")
+            return self._executor
+
+    @staticmethod
+    def _call(method, query):
+        try:
+            # Queue behind the calls the worker's users are waiting on
+            with outbound_priority("speculative"):
+                return method(query)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    async def _acall(method, async_method, query):
+        with outbound_priority("speculative"):
+            if async_method:
+                return await async_method(query)
+            return await sync_to_async(method, thread_sensitive=False)(query)
+
+    def speculate(self, tool_name, method, query):
+        """
+        Start `method(query)` in a worker thread, in a copy of the caller's context (so its spans
+        join the request's trace), and return the Speculation.
+        """
+        context = contextvars.copy_context()
+        return Speculation(tool_name, query, self._get_executor().submit(context.run, self._call, method, query))
+
+    def aspeculate(self, tool_name, method, async_method, query):
+        """
+        Async version of `speculate`: start the tool as a task of the running event loop, awaiting
+        `async_method` if the tool has one and running `method` in a thread otherwise.
+        """
+        return Speculation(tool_name, query, asyncio.ensure_future(self._acall(method, async_method, query)))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_tool_speculator = None
+_tool_speculator_lock = threading.Lock()
+
+
+def get_tool_speculator():
+    """
+    Return the process-wide ToolSpeculator configured from settings.SPECULATIVE_TOOLS.
+    """
+    global _tool_speculator
+    if _tool_speculator is None:
+        with _tool_speculator_lock:
+            if _tool_speculator is None:
+                _tool_speculator = ToolSpeculator()
+    return _tool_speculator
@@ -0,0 +1,555 @@
+import atexit
+import itertools
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from travel_agent.core.models import Conversation, ConversationMessage, LLMUsage
+
+# Defaults for settings.CONVERSATION_STORE
+DEFAULT_CONVERSATION_STORE = {
+    "BACKEND": "orm",  # 'orm', 'sqlite' or 'memory'
+    "NAME": None,  # SQLite database file of the 'sqlite' backend; defaults to DATABASES['default']['NAME']
+    "BUSY_TIMEOUT": 5000,  # Milliseconds a connection waits on a locked database before failing
+    "CACHE_SIZE_KB": 8192,  # Page cache per connection
+    "MMAP_SIZE": 64 * 1024 * 1024,  # Bytes of the database file read through memory mapping
+    "CACHED_STATEMENTS": 64,  # Prepared statements kept per connection
+}
+
+
+def session_key(session_id):
+    """
+    Parse a session id (UUID or string) into a UUID, raising ValueError if it is malformed.
+    """
+    return session_id if isinstance(session_id, uuid.UUID) else uuid.UUID(str(session_id))
+
+
+class Message:
+    """
+    A conversation message as exchanged with a ConversationStore.
+
+    `id` and `created_at` are set by the store when the message is appended. History rows
+    returned by the stores expose the same attributes (see `ConversationMessageQuerySet.HISTORY_FIELDS`).
+    `usage` lists the token usage of the LLM calls that produced the message (see `utils.usage`),
+    written with it as LLMUsage rows; it is not read back with the history.
+    """
+
+    def __init__(
+        self, conversation_id, sender, content, token_count=None, tool_id=None, tool_result=None, id=None,
+        created_at=None, usage=None,
+    ):
+        self.conversation_id = conversation_id
+        self.sender = sender
+        self.content = content
+        self.token_count = token_count
+        self.tool_id = tool_id
+        self.tool_result = tool_result
+        self.id = id
+        self.created_at = created_at
+        self.usage = usage
+
+    def __repr__(self):
+        return f"Message({self.id!r}, {self.sender!r}, conversation={self.conversation_id!r})"
+
+
+class ConversationStore:
+    """
+    Persistence interface of conversations and their messages.
+
+    TravelAgent, MessageWriter and the views go through a store instead of the models, so the
+    backend can be swapped from settings.CONVERSATION_STORE. Conversations are referred to by
+    their integer id once looked up by session_id.
+
+    The async methods run the sync ones in a worker thread; backends override them where they
+    have a native async path.
+    """
+    shared = True  # Whether other processes (e.g. `run_jobs` workers) see the conversations
+
+    def create_conversation(self, session_id):
+        """
+        Create a conversation for `session_id` and return its id.
+        """
+        raise NotImplementedError
+
+    def get_conversation_id(self, session_id):
+        """
+        Return the id of the conversation of `session_id`, or None if there is none (or the id is malformed).
+        """
+        raise NotImplementedError
+
+    def get_or_create_conversation(self, session_id):
+        """
+        Return the id of the conversation of `session_id`, creating the conversation if needed.
+        """
+        raise NotImplementedError
+
+    def history(self, conversation_id, limit=None, before=None, after=None):
+        """
+        Return a conversation's messages, oldest first.
+
+        :param conversation_id: Id of the conversation to read.
+        :param limit: Return only the most recent `limit` messages; all messages if None. With
+                      `after`, the `limit` messages that follow it instead.
+        :param before: Id of a message; only messages preceding it are returned (keyset pagination).
+        :param after: Id of a message (or 0); only messages with greater ids are returned (forward
+                      keyset pagination).
+        """
+        raise NotImplementedError
+
+    def latest_message_id(self, conversation_id):
+        """
+        Return the id of the conversation's most recent message, or None.
+        """
+        raise NotImplementedError
+
+    def summary(self, conversation_id):
+        """
+        Return the conversation's rolling summary and the id of the last message it covers
+        (None if there is no summary yet).
+        """
+        raise NotImplementedError
+
+    def save_summary(self, conversation_id, summary, through):
+        """
+        Replace the conversation's summary with `summary`, covering the messages up to id `through`,
+        unless the stored summary already reaches that far. Return whether it was replaced.
+        """
+        raise NotImplementedError
+
+    def append_messages(self, messages):
+        """
+        Write `messages` (Messages, possibly of several conversations, in order) in one transaction,
+        setting their `id` and `created_at`.
+        """
+        raise NotImplementedError
+
+    async def aget_or_create_conversation(self, session_id):
+        return await sync_to_async(self.get_or_create_conversation, thread_sensitive=False)(session_id)
+
+    async def ahistory(self, conversation_id, limit=None, before=None, after=None):
+        return await sync_to_async(self.history, thread_sensitive=False)(conversation_id, limit, before, after)
+
+    async def alatest_message_id(self, conversation_id):
+        return await sync_to_async(self.latest_message_id, thread_sensitive=False)(conversation_id)
+
+    async def asummary(self, conversation_id):
+        return await sync_to_async(self.summary, thread_sensitive=False)(conversation_id)
+
+    def close(self):
+        """
+        Release the store's connections, if any.
+        """
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Process-local store for development and benchmarks. Nothing survives a restart and
+    conversations are not shared between workers.
+    """
+    shared = False
+
+    def __init__(self):
+        self._conversations = {}  # session UUID -> conversation id
+        self._messages = {}  # conversation id -> list of Messages, oldest first
+        self._summaries = {}  # conversation id -> (summary, id of the last message it covers)
+        self._ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_conversation(self, session_id):
+        key = session_key(session_id)
+        with self._lock:
+            if key in self._conversations:
+                raise ValueError(f"Conversation for session '{key}' already exists")
+            conversation_id = self._conversations[key] = next(self._ids)
+            self._messages[conversation_id] = []
+            return conversation_id
+
+    def get_conversation_id(self, session_id):
+        try:
+            key = session_key(session_id)
+        except ValueError:
+            return None
+        return self._conversations.get(key)
+
+    def get_or_create_conversation(self, session_id):
+        key = session_key(session_id)
+        with self._lock:
+            if key not in self._conversations:
+                self._conversations[key] = next(self._ids)
+                self._messages[self._conversations[key]] = []
+            return self._conversations[key]
+
+    def history(self, conversation_id, limit=None, before=None, after=None):
+        with self._lock:
+            messages = self._messages.get(conversation_id, [])
+            # Ids increase with insertion order, so the cursors are plain id comparisons
+            if before is not None:
+                messages = [message for message in messages if message.id < before]
+            if after is not None:
+                messages = [message for message in messages if message.id > after]
+                return messages[:limit] if limit is not None else messages
+            return messages[-limit:] if limit is not None else list(messages)
+
+    def latest_message_id(self, conversation_id):
+        with self._lock:
+            messages = self._messages.get(conversation_id)
+            return messages[-1].id if messages else None
+
+    def summary(self, conversation_id):
+        with self._lock:
+            return self._summaries.get(conversation_id, ("", None))
+
+    def save_summary(self, conversation_id, summary, through):
+        with self._lock:
+            current = self._summaries.get(conversation_id, ("", None))[1]
+            if current is not None and current >= through:
+                return False
+            self._summaries[conversation_id] = (summary, through)
+            return True
+
+    def append_messages(self, messages):
+        with self._lock:
+            for message in messages:
+                message.id = next(self._message_ids)
+                message.created_at = timezone.now()
+                self._messages.setdefault(message.conversation_id, []).append(message)
+
+    async def aget_or_create_conversation(self, session_id):
+        return self.get_or_create_conversation(session_id)
+
+    async def ahistory(self, conversation_id, limit=None, before=None, after=None):
+        return self.history(conversation_id, limit, before, after)
+
+    async def alatest_message_id(self, conversation_id):
+        return self.latest_message_id(conversation_id)
+
+    async def asummary(self, conversation_id):
+        return self.summary(conversation_id)
+
+
+class OrmConversationStore(ConversationStore):
+    """
+    Store backed by the Conversation and ConversationMessage models on the default database.
+    """
+
+    def create_conversation(self, session_id):
+        return Conversation.objects.create(session_id=session_key(session_id)).id
+
+    def get_conversation_id(self, session_id):
+        try:
+            key = session_key(session_id)
+        except ValueError:
+            return None
+        return Conversation.objects.filter(session_id=key).values_list("id", flat=True).first()
+
+    def get_or_create_conversation(self, session_id):
+        conversation, _ = Conversation.objects.get_or_create(session_id=session_key(session_id))
+        return conversation.id
+
+    def history(self, conversation_id, limit=None, before=None, after=None):
+        return ConversationMessage.objects.history(conversation_id, limit=limit, before=before, after=after)
+
+    def latest_message_id(self, conversation_id):
+        return ConversationMessage.objects.latest_id(conversation_id)
+
+    def summary(self, conversation_id):
+        row = Conversation.objects.filter(pk=conversation_id).values_list("summary", "summary_through").first()
+        return row or ("", None)
+
+    def save_summary(self, conversation_id, summary, through):
+        return Conversation.objects.filter(
+            Q(summary_through__isnull=True) | Q(summary_through__lt=through), pk=conversation_id,
+        ).update(summary=summary, summary_through=through, updated_at=timezone.now()) > 0
+
+    def append_messages(self, messages):
+        rows = [
+            ConversationMessage(
+                conversation_id=message.conversation_id,
+                sender=message.sender,
+                content=message.content,
+                token_count=message.token_count,
+                tool_id=message.tool_id,
+                tool_result=message.tool_result,
+            )
+            for message in messages
+        ]
+        with transaction.atomic():
+            ConversationMessage.objects.bulk_create(rows)
+            LLMUsage.objects.bulk_create([
+                LLMUsage(
+                    conversation_id=message.conversation_id,
+                    message_id=row.id,
+                    step=usage["step"] or "",
+                    tool=usage["tool"],
+                    model=usage["model"],
+                    prompt_tokens=usage["prompt_tokens"],
+                    completion_tokens=usage["completion_tokens"],
+                )
+                for message, row in zip(messages, rows)
+                for usage in message.usage or []
+            ])
+        for message, row in zip(messages, rows):
+            message.id, message.created_at = row.id, row.created_at
+
+    async def aget_or_create_conversation(self, session_id):
+        conversation, _ = await Conversation.objects.aget_or_create(session_id=session_key(session_id))
+        return conversation.id
+
+    async def ahistory(self, conversation_id, limit=None, before=None, after=None):
+        return await ConversationMessage.objects.ahistory(conversation_id, limit=limit, before=before, after=after)
+
+    async def alatest_message_id(self, conversation_id):
+        return await ConversationMessage.objects.alatest_id(conversation_id)
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Store that talks to the SQLite database directly, tuned for concurrent turns.
+
+    - With settings.SQLITE_WAL, the database runs in WAL mode, so readers never block on the writer
+      and vice versa.
+    - Each thread keeps one persistent connection, with a statement cache: the fixed SQL below is
+      prepared once per connection and re-executed.
+    - Writes take the write lock up front (BEGIN IMMEDIATE) and a whole batch of messages is
+      committed at once; contending writers wait up to BUSY_TIMEOUT instead of failing with
+      "database is locked".
+
+    It reads and writes the same tables as the ORM, so the two backends are interchangeable, but
+    through its own connections: model signals, ORM transactions and database settings other than
+    the file name do not apply to it. It is opt-in for that reason.
+    """
+
+    INSERT_CONVERSATION = (
+        "INSERT INTO core_conversation (session_id, created_at, updated_at, summary) VALUES (?, ?, ?, '') "
+        "ON CONFLICT (session_id) DO NOTHING"
+    )
+    SELECT_CONVERSATION = "SELECT id FROM core_conversation WHERE session_id = ?"
+    SELECT_SUMMARY = "SELECT summary, summary_through FROM core_conversation WHERE id = ?"
+    UPDATE_SUMMARY = (
+        "UPDATE core_conversation SET summary = ?, summary_through = ?, updated_at = ? "
+        "WHERE id = ? AND (summary_through IS NULL OR summary_through < ?)"
+    )
+    INSERT_MESSAGE = (
+        "INSERT INTO core_conversationmessage "
+        "(conversation_id, sender, content, token_count, tool_id, tool_result, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    )
+    INSERT_USAGE = (
+        "INSERT INTO core_llmusage "
+        "(conversation_id, message_id, step, tool, model, prompt_tokens, completion_tokens, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    SELECT_HISTORY = (
+        "SELECT id, sender, content, token_count, tool_id, tool_result, created_at FROM core_conversationmessage "
+        "WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+    SELECT_HISTORY_BEFORE = (
+        "SELECT id, sender, content, token_count, tool_id, tool_result, created_at FROM core_conversationmessage "
+        "WHERE conversation_id = ? AND (created_at, id) < "
+        "(SELECT created_at, id FROM core_conversationmessage WHERE id = ?) "
+        "ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+    SELECT_HISTORY_AFTER = (
+        "SELECT id, sender, content, token_count, tool_id, tool_result, created_at FROM core_conversationmessage "
+        "WHERE conversation_id = ? AND id > ? ORDER BY id LIMIT ?"
+    )
+    SELECT_LATEST = (
+        "SELECT id FROM core_conversationmessage WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT 1"
+    )
+
+    def __init__(self, name=None, busy_timeout=None, cache_size_kb=None, mmap_size=None, cached_statements=None):
+        config = {**DEFAULT_CONVERSATION_STORE, **getattr(settings, "CONVERSATION_STORE", {})}
+        self.name = str(name or config["NAME"] or settings.DATABASES["default"]["NAME"])
+        self.busy_timeout = busy_timeout if busy_timeout is not None else config["BUSY_TIMEOUT"]
+        self.cache_size_kb = cache_size_kb if cache_size_kb is not None else config["CACHE_SIZE_KB"]
+        self.mmap_size = mmap_size if mmap_size is not None else config["MMAP_SIZE"]
+        self.cached_statements = cached_statements if cached_statements is not None else config["CACHED_STATEMENTS"]
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.name,
+            timeout=self.busy_timeout / 1000,  # Wait on a locked database instead of failing
+            isolation_level=None,  # Autocommit; write transactions are opened explicitly
+            cached_statements=self.cached_statements,
+        )
+        if getattr(settings, "SQLITE_WAL", False):
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")  # Durable across application crashes in WAL mode
+        connection.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    @property
+    def connection(self):
+        """
+        Return this thread's connection, opening it on first use.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.ProgrammingError:
+                # Connections can only be closed from their own thread; the process exit closes them
+                pass
+        self._local = threading.local()
+
+    @staticmethod
+    def _to_db_datetime(value):
+        # Same text format as Django's SQLite backend: naive UTC when USE_TZ is on
+        if settings.USE_TZ:
+            value = timezone.make_naive(value, dt_timezone.utc)
+        return value.isoformat(" ")
+
+    @staticmethod
+    def _from_db_datetime(value):
+        value = parse_datetime(value)
+        if settings.USE_TZ:
+            value = timezone.make_aware(value, dt_timezone.utc)
+        return value
+
+    def _row(self, conversation_id, row):
+        message_id, sender, content, token_count, tool_id, tool_result, created_at = row
+        return Message(
+            conversation_id, sender, content, token_count=token_count, tool_id=tool_id,
+            tool_result=json.loads(tool_result) if tool_result is not None else None,
+            id=message_id, created_at=self._from_db_datetime(created_at),
+        )
+
+    def create_conversation(self, session_id):
+        now = self._to_db_datetime(timezone.now())
+        cursor = self.connection.execute(
+            "INSERT INTO core_conversation (session_id, created_at, updated_at, summary) VALUES (?, ?, ?, '')",
+            (session_key(session_id).hex, now, now),
+        )
+        return cursor.lastrowid
+
+    def get_conversation_id(self, session_id):
+        try:
+            key = session_key(session_id)
+        except ValueError:
+            return None
+        row = self.connection.execute(self.SELECT_CONVERSATION, (key.hex,)).fetchone()
+        return row[0] if row else None
+
+    def get_or_create_conversation(self, session_id):
+        key = session_key(session_id).hex
+        row = self.connection.execute(self.SELECT_CONVERSATION, (key,)).fetchone()
+        if row:
+            return row[0]
+        now = self._to_db_datetime(timezone.now())
+        self.connection.execute(self.INSERT_CONVERSATION, (key, now, now))
+        return self.connection.execute(self.SELECT_CONVERSATION, (key,)).fetchone()[0]
+
+    def history(self, conversation_id, limit=None, before=None, after=None):
+        # LIMIT -1 means no limit in SQLite
+        limit = limit if limit is not None else -1
+        if after is not None:
+            rows = self.connection.execute(self.SELECT_HISTORY_AFTER, (conversation_id, after, limit))
+            return [self._row(conversation_id, row) for row in rows.fetchall()]
+        if before is None:
+            rows = self.connection.execute(self.SELECT_HISTORY, (conversation_id, limit))
+        else:
+            rows = self.connection.execute(self.SELECT_HISTORY_BEFORE, (conversation_id, before, limit))
+        return [self._row(conversation_id, row) for row in rows.fetchall()][::-1]
+
+    def latest_message_id(self, conversation_id):
+        row = self.connection.execute(self.SELECT_LATEST, (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def summary(self, conversation_id):
+        row = self.connection.execute(self.SELECT_SUMMARY, (conversation_id,)).fetchone()
+        return (row[0], row[1]) if row else ("", None)
+
+    def save_summary(self, conversation_id, summary, through):
+        now = self._to_db_datetime(timezone.now())
+        cursor = self.connection.execute(self.UPDATE_SUMMARY, (summary, through, now, conversation_id, through))
+        return cursor.rowcount > 0
+
+    def append_messages(self, messages):
+        connection = self.connection
+        created = []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for message in messages:
+                created_at = timezone.now()
+                cursor = connection.execute(
+                    self.INSERT_MESSAGE,
+                    (
+                        message.conversation_id, message.sender, message.content, message.token_count,
+                        message.tool_id,
+                        json.dumps(message.tool_result) if message.tool_result is not None else None,
+                        self._to_db_datetime(created_at),
+                    ),
+                )
+                created.append((cursor.lastrowid, created_at))
+                for usage in message.usage or []:
+                    connection.execute(
+                        self.INSERT_USAGE,
+                        (
+                            message.conversation_id, cursor.lastrowid, usage["step"] or "", usage["tool"],
+                            usage["model"], usage["prompt_tokens"], usage["completion_tokens"],
+                            self._to_db_datetime(created_at),
+                        ),
+                    )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        for message, (message_id, created_at) in zip(messages, created):
+            message.id, message.created_at = message_id, created_at
+
+
+CONVERSATION_STORE_BACKENDS = {
+    "memory": InMemoryConversationStore,
+    "orm": OrmConversationStore,
+    "sqlite": SQLiteConversationStore,
+}
+
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+
+def create_conversation_store(backend):
+    """
+    Instantiate the store registered under `backend` in CONVERSATION_STORE_BACKENDS.
+    """
+    if backend not in CONVERSATION_STORE_BACKENDS:
+        raise ValueError(f"Invalid conversation store backend: '{backend}'")
+    return CONVERSATION_STORE_BACKENDS[backend]()
+
+
+def get_conversation_store():
+    """
+    Return the process-wide ConversationStore configured from settings.CONVERSATION_STORE.
+    """
+    global _conversation_store
+    if _conversation_store is None:
+        with _conversation_store_lock:
+            if _conversation_store is None:
+                config = {**DEFAULT_CONVERSATION_STORE, **getattr(settings, "CONVERSATION_STORE", {})}
+                _conversation_store = create_conversation_store(config["BACKEND"])
+                atexit.register(_conversation_store.close)
+    return _conversation_store
@@ -0,0 +1,150 @@
+from django.conf import settings
+
+from travel_agent.core.models import LLMUsage
+from utils.context import count_tokens, truncate_to_tokens
+from utils.jobs import job_handler
+from utils.llm import ChatGPT
+from utils.ratelimit import outbound_priority
+from utils.results import ToolResultEncoder
+from utils.stores import get_conversation_store
+from utils.tracing import traced
+
+# Defaults for settings.CONVERSATION_SUMMARY
+DEFAULT_CONVERSATION_SUMMARY = {
+    "ENABLED": False,
+    "KEEP_RECENT": 8,  # Latest messages always sent verbatim; older ones are folded into the summary
+    "MIN_NEW_MESSAGES": 6,  # Messages past KEEP_RECENT and the summary that trigger an update
+    "MAX_TOKENS": 300,  # Length limit of the summary
+    "MESSAGE_MAX_TOKENS": 200,  # Messages (e.g. tool results) are truncated to this size in the summary prompt
+    "BATCH_MESSAGES": 40,  # Messages folded into the summary per LLM call when catching up on a long conversation
+}
+
+SUMMARY_PROMPT = """
+You maintain the running summary of a conversation between a user and Spotradius, an AI travel
+assistant. Update the current summary with the new messages and reply with the updated summary
+only, in at most {max_words} words. Keep what later turns may need: destinations, dates, budget,
+the user's preferences and decisions, and the places or flights already suggested.
+"""
+
+_config = None
+
+
+def get_summary_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_CONVERSATION_SUMMARY, **getattr(settings, "CONVERSATION_SUMMARY", {})}
+    return _config
+
+
+class ConversationSummarizer:
+    """
+    Maintain a conversation's rolling summary, so that the context of each LLM call is the summary
+    plus the latest messages however long the conversation gets.
+
+    The summary covers the messages up to a watermark (`Conversation.summary_through`). Each update
+    folds the messages between the watermark and the KEEP_RECENT latest ones into the summary and
+    moves the watermark, so a message is summarized once. Messages are read forward from the
+    watermark in batches, so none is skipped however far behind the summary is (e.g. when
+    summaries are turned on for an existing long conversation). Updates run as "summary" jobs (see
+    utils/jobs.py), which agents enqueue after a turn once enough messages have accumulated.
+    """
+
+    def __init__(
+        self, llm, store=None, keep_recent=None, min_new_messages=None, max_tokens=None, batch_messages=None,
+    ):
+        config = get_summary_config()
+        self.llm = llm
+        self.store = store or get_conversation_store()
+        self.keep_recent = keep_recent if keep_recent is not None else config["KEEP_RECENT"]
+        self.min_new_messages = min_new_messages if min_new_messages is not None else config["MIN_NEW_MESSAGES"]
+        self.max_tokens = max_tokens if max_tokens is not None else config["MAX_TOKENS"]
+        self.batch_messages = batch_messages if batch_messages is not None else config["BATCH_MESSAGES"]
+        self.message_max_tokens = config["MESSAGE_MAX_TOKENS"]
+        self.result_encoder = ToolResultEncoder()
+
+    def _transcript(self, messages):
+        """
+        Render messages as `sender: text` lines, tool results in their compact encoding.
+        """
+        lines = []
+        for message in messages:
+            text = message.content
+            if message.tool_result is not None:
+                text = f"Tool result: {self.result_encoder.encode(message.tool_result)}"
+            lines.append(f"{message.sender}: {truncate_to_tokens(text, self.message_max_tokens)}")
+        return "\n".join(lines)
+
+    def _pending(self, conversation_id, through):
+        """
+        Return the next batch of messages to fold into the summary: the messages following the
+        watermark `through`, up to BATCH_MESSAGES, minus any of the KEEP_RECENT latest ones.
+        """
+        messages = self.store.history(
+            conversation_id, limit=self.batch_messages + self.keep_recent, after=through or 0,
+        )
+        return messages[: max(len(messages) - self.keep_recent, 0)][: self.batch_messages]
+
+    def _fold(self, conversation_id, summary, messages):
+        """
+        Ask the LLM for `summary` updated with `messages`, recording the call's token usage.
+        """
+        new_summary = self.llm.query(
+            prompt=SUMMARY_PROMPT.format(max_words=int(self.max_tokens * 0.75)),
+            conversation_history=[{
+                "role": "user",
+                "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{self._transcript(messages)}",
+            }],
+            max_tokens=self.max_tokens,
+            temperature=0.2,
+            cache_step="summary",
+            # Written as reported, as a hedged duplicate's usage may arrive after the call returns
+            on_usage=lambda entry: LLMUsage.objects.create(
+                conversation_id=conversation_id,
+                step=entry["step"],
+                model=entry["model"],
+                prompt_tokens=entry["prompt_tokens"],
+                completion_tokens=entry["completion_tokens"],
+            ),
+        )
+        return new_summary.strip()
+
+    @traced("agent.summarize")
+    def update(self, conversation_id):
+        """
+        Fold the conversation's messages older than the KEEP_RECENT latest into its summary, if at
+        least MIN_NEW_MESSAGES of them are not summarized yet. A backlog longer than BATCH_MESSAGES
+        is folded in one LLM call per batch, oldest first.
+
+        :return: Dict telling whether the summary was updated and up to which message it reaches.
+        """
+        summary, through = self.store.summary(conversation_id)
+        pending = self._pending(conversation_id, through)
+        if len(pending) < self.min_new_messages:
+            return {"updated": False, "through": through, "summarized": 0}
+
+        summarized = 0
+        while pending:
+            summary = self._fold(conversation_id, summary, pending)
+            if not self.store.save_summary(conversation_id, summary, pending[-1].id):
+                break  # Another update moved the watermark meanwhile
+            through = pending[-1].id
+            summarized += len(pending)
+            # Fold the rest of the backlog; a last batch smaller than MIN_NEW_MESSAGES waits for the next update
+            pending = self._pending(conversation_id, through)
+            if len(pending) < self.min_new_messages:
+                break
+        return {
+            "updated": summarized > 0,
+            "through": through,
+            "summarized": summarized,
+            "summary_tokens": count_tokens(summary),
+        }
+
+
+@job_handler("summary")
+def update_summary(job):
+    """
+    Update the summary of the job's conversation, queueing behind the worker's other jobs for OpenAI capacity.
+    """
+    with outbound_priority("maintenance"):
+        return ConversationSummarizer(ChatGPT()).update(job.conversation_id)
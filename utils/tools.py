@@ -1,79 +1,249 @@
-from amadeus import Client, ResponseError
+from amadeus import ResponseError
+import asyncio
+import heapq
 import os
-import json
+import time
 from dotenv import load_dotenv
 load_dotenv()
-import requests
+from utils.cache import get_tool_cache
+from utils.clients import get_amadeus_client, get_async_http_client, get_http_session, get_request_timeout
+from utils.ratelimit import get_rate_limiter, retry_after
+from utils.results import ToolResultEncoder, tool_error, tool_result
+from utils.tracing import span, traced
 
 
 class AmadeusTool:
-    def __init__(self):
-        api_key = os.getenv("AMADEUS_API_KEY")
-        api_secret = os.getenv("AMADEUS_API_SECRET")
-        self.client = Client(client_id=api_key, client_secret=api_secret)
+    # Offers requested per search; the API returns up to 250 by default, tens of KB that are never shown
+    MAX_OFFERS = 50
 
-    def search_flights(self, origin, destination, departure_date, adults=1):
-        try:
+    def __init__(self, client=None, limiter=None, cache=None, max_rows=None):
+        """
+        :param client: Amadeus client to use; defaults to the process-wide client, which reuses its OAuth token.
+            It is created on first use, so the tool can be registered without Amadeus credentials.
+        :param limiter: ProviderLimiter for Amadeus calls; defaults to the process-wide "amadeus" limiter.
+        :param cache: ToolResultCache for projected offers; defaults to the process-wide cache.
+        :param max_rows: Cheapest offers kept per search; defaults to TOOL_RESULTS['MAX_STORED_ROWS'].
+        """
+        self._client = client
+        self.limiter = limiter or get_rate_limiter("amadeus")
+        self.cache = cache or get_tool_cache()
+        self.max_rows = max_rows if max_rows is not None else ToolResultEncoder().max_stored_rows
+
+    @property
+    def client(self):
+        return self._client or get_amadeus_client()
+
+    def _fetch_offers(self, origin, destination, departure_date, adults):
+        """
+        Call Flight Offers Search and return the cheapest offers, projected, and the number of offers found.
+        """
+        with self.limiter.acquire(), span("tool.http.amadeus"):
             response = self.client.shopping.flight_offers_search.get(
                 originLocationCode=origin,
                 destinationLocationCode=destination,
                 departureDate=departure_date,
-                adults=adults
+                adults=adults,
+                max=self.MAX_OFFERS,
+            )
+        # Only the kept offers are projected; the rest of the payload is dropped here
+        cheapest = heapq.nsmallest(self.max_rows, response.data, key=lambda offer: float(offer["price"]["grandTotal"]))
+        return {"rows": [self._project_offer(offer) for offer in cheapest], "total": len(response.data)}
+
+    def search_flights(self, origin, destination, departure_date, adults=1):
+        """
+        Search flight offers and return the cheapest as a structured tool result, cheapest first.
+        Results are cached briefly per (origin, destination, date, adults), as fares move quickly.
+        """
+        meta = {"origin": origin, "destination": destination, "date": departure_date}
+        arguments = {**meta, "adults": adults}
+        try:
+            offers = self.cache.get_or_fetch(
+                "search_flights", arguments, lambda: self._fetch_offers(origin, destination, departure_date, adults)
             )
-            response = json.dumps(response.data, indent=2)
-            # append the origin, destination and departure date to the beginning of the response for debugging
-            response = f"Origin: {origin}, Destination: {destination}, Departure Date: {departure_date}\n{response}"
-            return response
         except ResponseError as error:
-            return {"error": str(error)}
+            if getattr(error.response, "status_code", None) == 429:
+                self.limiter.pause(retry_after(getattr(error.response.http_response, "headers", None)))
+            return tool_error("search_flights", error, **meta)
+
+        return tool_result("search_flights", offers["rows"], total=offers["total"], **meta)
+
+    @staticmethod
+    def _project_offer(offer):
+        """
+        Keep the fields of a flight offer that matter for choosing a flight.
+        :param offer: Flight offer from the Amadeus Flight Offers Search response.
+        """
+        segments = offer["itineraries"][0]["segments"]
+        return {
+            "price": float(offer["price"]["grandTotal"]),
+            "currency": offer["price"]["currency"],
+            "carriers": sorted({segment["carrierCode"] for segment in segments}),
+            "departs": segments[0]["departure"]["at"],
+            "arrives": segments[-1]["arrival"]["at"],
+            "duration": offer["itineraries"][0].get("duration"),
+            "stops": len(segments) - 1,
+            "seats": offer.get("numberOfBookableSeats"),
+        }
 
 class GooglePlacesTool:
-    def __init__(self):
+    # A next_page_token becomes valid a couple of seconds after it is issued
+    PAGE_TOKEN_DELAY = 2.0
+    PAGE_TOKEN_ATTEMPTS = 3
+
+    def __init__(self, session=None, async_client=None, cache=None, limiter=None):
+        """
+        :param session: requests Session to use; defaults to the process-wide pooled session.
+        :param async_client: httpx AsyncClient to use; defaults to the pooled client of the running event loop.
+        :param cache: ToolResultCache for raw API responses; defaults to the process-wide cache.
+        :param limiter: ProviderLimiter for Places API calls; defaults to the process-wide "google_places" limiter.
+        """
         self.api_key = os.getenv("GOOGLE_PLACES_API_KEY")
+        self.session = session or get_http_session()
+        self.async_client = async_client
+        self.cache = cache or get_tool_cache()
+        self.limiter = limiter or get_rate_limiter("google_places")
         self.base_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
 
+    def _get(self, params):
+        """
+        Call the Places API Text Search with `params` and return the raw JSON response.
+        """
+        with self.limiter.acquire():
+            response = self.session.get(self.base_url, params={"key": self.api_key, **params}, timeout=get_request_timeout())
+        if response.status_code == 429:
+            self.limiter.pause(retry_after(response.headers))
+        response.raise_for_status()
+        return response.json()
+
+    async def _aget(self, params):
+        """
+        Async version of `_get`.
+        """
+        client = self.async_client or get_async_http_client()
+        with await self.limiter.aacquire():
+            response = await client.get(self.base_url, params={"key": self.api_key, **params})
+        if response.status_code == 429:
+            self.limiter.pause(retry_after(response.headers))
+        response.raise_for_status()
+        return response.json()
+
+    @traced("tool.http.places")
+    def _fetch_places(self, query):
+        """
+        Call the Places API Text Search and return the raw JSON response (the first page of results).
+        """
+        return self._get({"query": query})
+
+    @traced("tool.http.places")
+    async def _afetch_places(self, query):
+        """
+        Async version of `_fetch_places`.
+        """
+        return await self._aget({"query": query})
+
+    @traced("tool.http.places")
+    def _fetch_page(self, page_token):
+        """
+        Fetch the page of results following the one that returned `page_token`. A fresh token is
+        only valid after a short delay, during which the API answers INVALID_REQUEST.
+        """
+        for attempt in range(self.PAGE_TOKEN_ATTEMPTS):
+            raw_data = self._get({"pagetoken": page_token})
+            if raw_data.get("status") != "INVALID_REQUEST":
+                break
+            time.sleep(self.PAGE_TOKEN_DELAY)
+        return raw_data
+
+    @traced("tool.http.places")
+    async def _afetch_page(self, page_token):
+        """
+        Async version of `_fetch_page`.
+        """
+        for attempt in range(self.PAGE_TOKEN_ATTEMPTS):
+            raw_data = await self._aget({"pagetoken": page_token})
+            if raw_data.get("status") != "INVALID_REQUEST":
+                break
+            await asyncio.sleep(self.PAGE_TOKEN_DELAY)
+        return raw_data
+
     def search_places(self, query):
         """
         Use the Places API Text Search to find places based on a query string
-        and return a formatted summary of results.
+        and return them as a structured tool result.
+        Raw responses are cached under the normalized query, so near-identical searches skip the API.
         :param query: Natural language search query (e.g., 'restaurants near Boston').
-        :return: Formatted string with top results.
+        :return: Structured tool result (see utils/results.py), best match first.
         """
-        params = {
-            "key": self.api_key,
-            "query": query,
-        }
-        response = requests.get(self.base_url, params=params)
-        response.raise_for_status()
-        raw_data = response.json()
+        raw_data = self.cache.get_or_fetch(
+            "search_places", {"query": query}, lambda: self._fetch_places(query)
+        )
 
-        return self._format_places_result(raw_data)
+        return self._format_places_result(raw_data, query)
 
-    def _format_places_result(self, raw_data):
+    async def asearch_places(self, query):
         """
-        Format the raw Google Places API result into a user-friendly summary.
-        :param raw_data: Raw JSON response from the Places API.
-        :return: Formatted string summary.
-        """
-        if not raw_data.get("results"):
-            return "No results found for your query."
-
-        formatted_places = []
-        for place in raw_data["results"][:5]:  # Limit to top 5 results
-            name = place.get("name", "Unknown Name")
-            address = place.get("formatted_address", "Unknown Address")
-            rating = place.get("rating", "No rating")
-            user_ratings_total = place.get("user_ratings_total", 0)
-            open_now = place.get("opening_hours", {}).get("open_now", False)
-            open_status = "Open" if open_now else "Closed"
-            types = ", ".join(place.get("types", []))
-
-            # Format the output for each place
-            formatted_places.append(
-                f"- **{name}** (Rating: {rating}, {user_ratings_total} ratings)\n"
-                f"  Address: {address}\n"
-                f"  Open/Closed Status: {open_status}\n"
-                f"  Type: {types}\n"
-            )
+        Async version of `search_places` for the ASGI agent, using httpx so the request
+        can be cancelled along with the calling task.
+        :param query: Natural language search query (e.g., 'restaurants near Boston').
+        :return: Structured tool result (see utils/results.py), best match first.
+        """
+        raw_data = await self.cache.aget_or_fetch(
+            "search_places", {"query": query}, lambda: self._afetch_places(query)
+        )
+
+        return self._format_places_result(raw_data, query)
+
+    def iter_search_places(self, query):
+        """
+        Yield the places matching `query`, best match first, as result rows. Further pages of
+        results are fetched only once the rows of the previous ones have been consumed.
+        :param query: Natural language search query (e.g., 'restaurants near Boston').
+        """
+        raw_data = self.cache.get_or_fetch(
+            "search_places", {"query": query}, lambda: self._fetch_places(query)
+        )
+        while True:
+            yield from self._project_places(raw_data)
+            if not raw_data.get("next_page_token"):
+                return
+            raw_data = self._fetch_page(raw_data["next_page_token"])
 
-        return "\n\n".join(formatted_places)
\ No newline at end of file
+    async def aiter_search_places(self, query):
+        """
+        Async version of `iter_search_places`.
+        """
+        raw_data = await self.cache.aget_or_fetch(
+            "search_places", {"query": query}, lambda: self._afetch_places(query)
+        )
+        while True:
+            for row in self._project_places(raw_data):
+                yield row
+            if not raw_data.get("next_page_token"):
+                return
+            raw_data = await self._afetch_page(raw_data["next_page_token"])
+
+    @staticmethod
+    def _project_places(raw_data):
+        """
+        Project the places of a raw Google Places API response onto the fields worth keeping.
+        """
+        return [
+            {
+                "name": place.get("name"),
+                "rating": place.get("rating"),
+                "ratings": place.get("user_ratings_total", 0),
+                "address": place.get("formatted_address"),
+                "open_now": place.get("opening_hours", {}).get("open_now"),
+                "types": place.get("types", [])[:3],
+            }
+            for place in raw_data.get("results", [])
+        ]
+
+    def _format_places_result(self, raw_data, query):
+        """
+        Project the raw Google Places API result onto the fields worth keeping.
+        :param raw_data: Raw JSON response from the Places API.
+        :param query: The search query, kept as context of the result.
+        :return: Structured tool result.
+        """
+        return tool_result("search_places", self._project_places(raw_data), query=query)
@@ -0,0 +1,219 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from utils.metrics import metrics
+
+# Defaults for settings.TRACING
+DEFAULT_TRACING = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,  # Add a Server-Timing header with the request's span durations
+    "LOG_SLOW_MS": None,  # Print the span tree of requests slower than this; never if None
+    "BUCKETS": None,  # Latency histogram bucket bounds in seconds; utils.metrics.DEFAULT_BUCKETS if None
+}
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+
+_config = None
+
+
+def _get_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_TRACING, **getattr(settings, "TRACING", {})}
+    return _config
+
+
+def _span_metrics():
+    config = _get_config()
+    return (
+        metrics.histogram(
+            "agent_span_duration_seconds", "Duration of instrumented agent operations.", ("span",),
+            buckets=config["BUCKETS"],
+        ),
+        metrics.counter("agent_span_errors_total", "Instrumented agent operations that raised.", ("span", "error")),
+    )
+
+
+class Span:
+    """
+    A timed operation, nested under the span that was current when it started.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes or {}
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration_ms(self):
+        return ((self.end if self.end is not None else time.perf_counter()) - self.start) * 1000
+
+
+class Trace:
+    """
+    The spans finished while handling one request, in the order they finished.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    @property
+    def duration_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """
+        Render the spans as a Server-Timing header value: one entry per span name and parent span
+        name with the total duration of those spans and their number, plus the request's total.
+        """
+        entries = {}
+        for span in self.spans:
+            parent = span.parent.name if span.parent is not None else None
+            entry = entries.setdefault((span.name, parent), {"dur": 0.0, "count": 0})
+            entry["dur"] += span.duration_ms
+            entry["count"] += 1
+        values = []
+        for (name, parent), entry in entries.items():
+            description = f"{entry['count']}x" if entry["count"] > 1 else ""
+            if parent is not None:
+                description = f"{description} in {parent}".strip()
+            value = f"{name};dur={entry['dur']:.1f}"
+            values.append(f'{value};desc="{description}"' if description else value)
+        values.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(values)
+
+    def format(self):
+        """
+        Render the spans as an indented tree, in start order.
+        """
+        lines = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            error = f" error={span.error}" if span.error else ""
+            attributes = "".join(f" {key}={value}" for key, value in span.attributes.items())
+            lines.append(f"{'  ' * span.depth}{span.name} {span.duration_ms:.1f} ms{attributes}{error}")
+        return "\n".join(lines)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace():
+    """
+    Collect the spans finished in this context (and the tasks and threads it spawns) into a new Trace.
+    """
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def _begin(name, attributes):
+    return Span(name, _current_span.get(), attributes)
+
+
+def _finish(span, error=None):
+    span.end = time.perf_counter()
+    histogram, errors = _span_metrics()
+    histogram.observe(span.duration_ms / 1000, span=span.name)
+    if error is not None:
+        span.error = type(error).__name__
+        errors.inc(span=span.name, error=span.error)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append(span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the enclosed block as a span of the current trace and record it in the span metrics.
+    Spans opened inside the block are nested under it. Works without a trace (metrics only).
+    """
+    if not _get_config()["ENABLED"]:
+        yield None
+        return
+    current = _begin(name, attributes)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(current, error)
+
+
+def traced(name):
+    """
+    Decorate a function, coroutine function, generator or async generator to run in a span.
+
+    Generators are timed from their first step until they are exhausted or closed; spans opened
+    while they run are not nested under them, since they yield control to their consumer.
+    """
+
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                if not _get_config()["ENABLED"]:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                    return
+                current, error = _begin(name, {}), None
+                try:
+                    async for item in func(*args, **kwargs):
+                        yield item
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _finish(current, error)
+            return async_gen_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def gen_wrapper(*args, **kwargs):
+                if not _get_config()["ENABLED"]:
+                    return (yield from func(*args, **kwargs))
+                current, error = _begin(name, {}), None
+                try:
+                    return (yield from func(*args, **kwargs))
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _finish(current, error)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
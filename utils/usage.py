@@ -0,0 +1,67 @@
+from django.conf import settings
+
+# Defaults for settings.LLM_PRICING: USD per million tokens, by model name prefix
+DEFAULT_LLM_PRICING = {
+    "gpt-3.5-turbo": {"PROMPT": 0.50, "COMPLETION": 1.50},
+    "gpt-4o-mini": {"PROMPT": 0.15, "COMPLETION": 0.60},
+    "gpt-4o": {"PROMPT": 2.50, "COMPLETION": 10.00},
+}
+
+
+def get_pricing():
+    return {**DEFAULT_LLM_PRICING, **getattr(settings, "LLM_PRICING", {})}
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, pricing=None):
+    """
+    Estimate the cost in USD of a call, or of summed calls, to `model`.
+
+    Models are matched on the longest pricing prefix, so dated snapshots such as
+    "gpt-3.5-turbo-0125" use the price of "gpt-3.5-turbo". Unknown models cost 0.
+    """
+    pricing = pricing if pricing is not None else get_pricing()
+    prefix = max((name for name in pricing if (model or "").startswith(name)), key=len, default=None)
+    if prefix is None:
+        return 0.0
+    price = pricing[prefix]
+    return (prompt_tokens * price["PROMPT"] + completion_tokens * price["COMPLETION"]) / 1_000_000
+
+
+def usage_entry(step, model, prompt_tokens, completion_tokens):
+    """
+    Build the usage record of one LLM call, as passed to a ChatGPT `on_usage` callback.
+    """
+    return {"step": step, "model": model, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+def _empty_totals():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost_usd": 0.0}
+
+
+def summarize_usage(rows, key=None, pricing=None):
+    """
+    Fold usage rows (dicts with model, prompt_tokens, completion_tokens and optionally calls) into
+    totals with their estimated cost, per value of `key` if given.
+
+    :param rows: Usage records or rows of `LLMUsage.objects.totals_by`.
+    :param key: Row field to group by (e.g. "day"); a single total if None.
+    :return: List of totals ordered by `key`, or one totals dict if `key` is None.
+    """
+    pricing = pricing if pricing is not None else get_pricing()
+    groups = {}
+    for row in rows:
+        value = row[key] if key else None
+        if value not in groups:
+            groups[value] = _empty_totals()
+        group = groups[value]
+        group["calls"] += row.get("calls", 1)
+        group["prompt_tokens"] += row["prompt_tokens"]
+        group["completion_tokens"] += row["completion_tokens"]
+        group["total_tokens"] += row["prompt_tokens"] + row["completion_tokens"]
+        group["cost_usd"] += estimate_cost(row["model"], row["prompt_tokens"], row["completion_tokens"], pricing)
+
+    for group in groups.values():
+        group["cost_usd"] = round(group["cost_usd"], 6)
+    if key is None:
+        return groups.get(None, _empty_totals())
+    return [{key: value, **group} for value, group in groups.items()]